@@ -0,0 +1,67 @@
+"""Benchmarks for greennet.broadcast, against a Queue per subscriber."""
+
+
+from greennet.hub import Hub
+from greennet.queue import Queue
+from greennet.broadcast import Broadcast, Closed
+
+from common import Timer, rate, spawn, main
+
+
+def _fan_out(kind, messages, subscribers, burst):
+    """Publish messages, burst per tick, to every subscriber."""
+    hub = Hub()
+    if kind == 'queue':
+        queues = [Queue(hub=hub) for i in xrange(subscribers)]
+        def subscriber(queue):
+            while queue.popleft() is not None:
+                pass
+        def publish(message):
+            for queue in queues:
+                queue.append(message)
+        for queue in queues:
+            spawn(hub, subscriber, queue)
+    else:
+        channel = Broadcast(max(burst * 4, 64), hub=hub)
+        def subscriber(sub):
+            try:
+                while True:
+                    sub.recv_many()
+            except Closed:
+                pass
+        publish = channel.publish
+        for i in xrange(subscribers):
+            spawn(hub, subscriber, channel.subscribe())
+    def publisher():
+        for i in xrange(messages // burst):
+            for j in xrange(burst):
+                publish(j)
+            hub.switch()
+        if kind == 'queue':
+            publish(None)
+        else:
+            channel.close()
+    spawn(hub, publisher)
+    with Timer() as t:
+        hub.run()
+    n = messages * subscribers
+    return {'kind': kind, 'messages': messages, 'subscribers': subscribers,
+            'burst': burst, 'deliveries_per_s': rate(n, t.elapsed)}
+
+
+def fan_out(quick):
+    """Messages delivered per second to each of many subscribers."""
+    deliveries = 100000 if quick else 1000000
+    return [_fan_out(kind, deliveries // subscribers, subscribers, burst)
+            for kind in ('queue', 'broadcast')
+            for subscribers in (10, 1000)
+            for burst in (1, 10)]
+
+
+BENCHMARKS = [
+    ('broadcast.fan_out', fan_out),
+]
+
+
+if __name__ == '__main__':
+    main(BENCHMARKS)
@@ -0,0 +1,77 @@
+"""Tail latency of an IO-bound task competing with CPU-bound tasks.
+
+A number of busy tasks spin and reschedule themselves with switch(), while a
+single task ping-pongs a byte over a socketpair, recording how long it waits
+for the hub to resume it after its fd becomes readable.
+"""
+
+
+import time
+import socket
+
+import greennet
+from greennet.hub import Hub, DEFAULT_PRIORITY
+
+from common import main
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def busy(hub, done, work):
+    while not done:
+        for i in xrange(work):
+            pass
+        hub.switch()
+
+
+def pinger(hub, done, s1, s2, duration, latencies):
+    end = time.time() + duration
+    while time.time() < end:
+        start = time.time()
+        s2.send('x')
+        hub.poll(s1, read=True)
+        latencies.append(time.time() - start)
+        s1.recv(1)
+    done.append(True)
+
+
+def measure(budget, priority, tasks, work, duration):
+    hub = Hub(budget=budget)
+    s1, s2 = socket.socketpair()
+    done = []
+    latencies = []
+    for i in xrange(tasks):
+        hub.schedule(greennet.greenlet(busy), hub, done, work)
+    hub.schedule_priority(greennet.greenlet(pinger), priority,
+                          hub, done, s1, s2, duration, latencies)
+    hub.run()
+    s1.close()
+    s2.close()
+    return {
+        'budget': budget,
+        'priority': priority,
+        'samples': len(latencies),
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': max(latencies) * 1000,
+    }
+
+
+def fairness(quick):
+    """Pinger latency under load, for each budget and pinger priority."""
+    tasks, duration = (200, 0.5) if quick else (1000, 2.0)
+    return [measure(budget, priority, tasks, 1000, duration)
+            for budget in (None, 0.01, 0.001)
+            for priority in (DEFAULT_PRIORITY, 0)]
+
+
+BENCHMARKS = [
+    ('hub.fairness', fairness),
+]
+
+
+if __name__ == '__main__':
+    main(BENCHMARKS)
@@ -0,0 +1,114 @@
+"""Benchmarks for the HTTP server: loopback requests per second."""
+
+
+import socket
+
+import greennet
+from greennet import http
+
+from common import Timer, rate, spawn, main
+
+
+CLIENTS = 10
+BODY = 'Hello, world!\n'
+REQUEST = 'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n'
+
+
+def app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [BODY]
+
+
+def _read_response(reader):
+    head = reader.read_until('\r\n\r\n', 65536, http.HeaderTooLarge)
+    length = int(head.split('Content-Length: ', 1)[1].split('\r\n', 1)[0])
+    while length:
+        length -= len(reader.read(length))
+
+
+def _connect(address):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setblocking(False)
+    greennet.connect(sock, address)
+    return sock
+
+
+def _serve(quick, client, requests, reconnect=False):
+    """Serve app on a loopback socket while CLIENTS tasks each run
+    client(address, requests), over one connection each or, if reconnect
+    is true, one connection per request.
+    """
+    if quick:
+        requests /= 10
+    connections = requests if reconnect else 1
+    hub = greennet.get_hub()
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(socket.SOMAXCONN)
+    listener.setblocking(False)
+    address = listener.getsockname()
+    server = http.WSGIServer(app)
+    def accept():
+        for i in xrange(connections * CLIENTS):
+            sock, addr = greennet.accept(listener)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            spawn(hub, server.handle, sock, addr)
+    spawn(hub, accept)
+    with Timer() as t:
+        for i in xrange(CLIENTS):
+            spawn(hub, client, address, requests)
+        hub.run()
+    listener.close()
+    total = requests * CLIENTS
+    return {'requests': total, 'clients': CLIENTS, 'seconds': t.elapsed,
+            'requests_per_s': rate(total, t.elapsed)}
+
+
+def keep_alive(quick):
+    """One request at a time over a persistent connection per client."""
+    def client(address, count):
+        sock = _connect(address)
+        reader = http.Reader(sock)
+        for i in xrange(count):
+            greennet.sendall(sock, REQUEST)
+            _read_response(reader)
+        sock.close()
+    return _serve(quick, client, 2000)
+
+
+def pipelined(quick):
+    """Batches of 16 pipelined requests over a persistent connection."""
+    depth = 16
+    def client(address, count):
+        sock = _connect(address)
+        reader = http.Reader(sock)
+        for i in xrange(count / depth):
+            greennet.sendall(sock, REQUEST * depth)
+            for j in xrange(depth):
+                _read_response(reader)
+        sock.close()
+    return _serve(quick, client, 20000)
+
+
+def connection_per_request(quick):
+    """A new connection for every request, as without keep-alive."""
+    request = REQUEST.replace('\r\n\r\n', '\r\nConnection: close\r\n\r\n')
+    def client(address, count):
+        for i in xrange(count):
+            sock = _connect(address)
+            greennet.sendall(sock, request)
+            _read_response(http.Reader(sock))
+            sock.close()
+    return _serve(quick, client, 200, True)
+
+
+BENCHMARKS = [
+    ('http.keep_alive', keep_alive),
+    ('http.pipelined', pipelined),
+    ('http.connection_per_request', connection_per_request),
+]
+
+
+if __name__ == '__main__':
+    main(BENCHMARKS)
@@ -0,0 +1,125 @@
+"""Benchmarks for Hub scheduling, timers and select() scaling."""
+
+
+import random
+
+from greennet import greenlet
+from greennet.hub import Hub
+from greennet.queue import Queue
+
+from common import Timer, rate, spawn, socketpair, main
+
+
+def pingpong(quick):
+    """Two tasks switching back and forth through the ready queue."""
+    n = 10000 if quick else 200000
+    hub = Hub()
+    def task():
+        for i in xrange(n):
+            hub.switch()
+    spawn(hub, task)
+    spawn(hub, task)
+    with Timer() as t:
+        hub.run()
+    return {'switches': 2 * n, 'seconds': t.elapsed,
+            'switches_per_s': rate(2 * n, t.elapsed)}
+
+
+def schedule(quick):
+    """Scheduling and running many short-lived tasks."""
+    n = 10000 if quick else 100000
+    hub = Hub()
+    def task():
+        pass
+    with Timer() as t:
+        for i in xrange(n):
+            spawn(hub, task)
+        hub.run()
+    return {'tasks': n, 'seconds': t.elapsed,
+            'tasks_per_s': rate(n, t.elapsed)}
+
+
+def _timers(n):
+    hub = Hub()
+    def task():
+        pass
+    tasks = [greenlet(task) for i in xrange(n)]
+    with Timer() as insert:
+        for task in tasks:
+            hub.call_later(task, random.random() * 0.001)
+    with Timer() as expire:
+        hub.run()
+    hub = Hub()
+    queue = Queue(hub=hub)
+    def waiter():
+        queue.popleft(timeout=60)
+    for i in xrange(n):
+        spawn(hub, waiter)
+    hub.switch()
+    with Timer() as cancel:
+        for i in xrange(n):
+            queue.append(i)
+    hub.run()
+    return {
+        'timers': n,
+        'insert_per_s': rate(n, insert.elapsed),
+        'expire_per_s': rate(n, expire.elapsed),
+        'cancel_per_s': rate(n, cancel.elapsed),
+    }
+
+
+def timers(quick, sizes=(1000, 10000)):
+    """Inserting, expiring and cancelling (via Queue waits) timers."""
+    if quick:
+        sizes = sizes[:1]
+    return dict((str(n), _timers(n)) for n in sizes)
+
+
+def _select_scaling(idle, active, rounds):
+    hub = Hub()
+    idle_pairs = [socketpair() for i in xrange(idle)]
+    active_pairs = [socketpair() for i in xrange(active)]
+    def parked(sock):
+        hub.poll(sock, read=True)
+    def pinger(s1, s2):
+        for i in xrange(rounds):
+            s1.send('x')
+            hub.poll(s2, read=True)
+            s2.recv(1)
+    for s1, s2 in idle_pairs:
+        spawn(hub, parked, s1)
+    for s1, s2 in active_pairs:
+        spawn(hub, pinger, s1, s2)
+    hub.switch()
+    with Timer() as t:
+        while hub.tasks or len(hub.fdwaits) > idle:
+            hub.switch()
+    for s1, s2 in idle_pairs:
+        s2.send('x')
+    hub.run()
+    for pair in idle_pairs + active_pairs:
+        for sock in pair:
+            sock.close()
+    return {'idle': idle, 'active': active, 'rounds': active * rounds,
+            'rounds_per_s': rate(active * rounds, t.elapsed)}
+
+
+def select_scaling(quick):
+    """Active socket ping-pong with an increasing number of idle sockets.
+    
+    Idle counts stay below FD_SETSIZE, which select() cannot exceed.
+    """
+    rounds = 100 if quick else 1000
+    return [_select_scaling(idle, 10, rounds) for idle in (0, 100, 400)]
+
+
+BENCHMARKS = [
+    ('hub.pingpong', pingpong),
+    ('hub.schedule', schedule),
+    ('hub.timers', timers),
+    ('hub.select_scaling', select_scaling),
+]
+
+
+if __name__ == '__main__':
+    main(BENCHMARKS)
@@ -0,0 +1,312 @@
+"""Benchmarks for the socket helpers: stream transfers and datagrams."""
+
+
+import socket
+import struct
+
+import greennet
+from greennet import framing
+from greennet.writer import WriteBuffer
+
+from common import Timer, rate, spawn, socketpair, main
+
+
+MB = 1024 * 1024
+
+
+def _transfer(data, count, reader):
+    """Send data count times with sendall, while reader(sock) receives it.
+    
+    Returns the elapsed time and the byte count returned by the reader.
+    """
+    hub = greennet.get_hub()
+    s1, s2 = socketpair()
+    def writer():
+        for i in xrange(count):
+            greennet.sendall(s1, data)
+    spawn(hub, writer)
+    with Timer() as t:
+        received = reader(s2)
+        hub.run()
+    s1.close()
+    s2.close()
+    assert received == len(data) * count
+    return t.elapsed
+
+
+def sendall_recv_bytes(quick):
+    """Bulk transfer with sendall and recv_bytes."""
+    count = 256 if quick else 4096
+    data = 'x' * 65536
+    total = len(data) * count
+    def reader(sock):
+        return sum(len(chunk) for chunk in greennet.recv_bytes(sock, total))
+    elapsed = _transfer(data, count, reader)
+    return {'bytes': total, 'seconds': elapsed,
+            'mb_per_s': rate(float(total) / MB, elapsed)}
+
+
+def recv_until(quick):
+    """Reading CRLF-terminated messages with recv_until."""
+    batches = 20 if quick else 200
+    message = 'x' * 1022 + '\r\n'
+    count = batches * 100
+    def reader(sock):
+        received = 0
+        for i in xrange(count):
+            for chunk in greennet.recv_until(sock, '\r\n'):
+                received += len(chunk)
+        return received
+    elapsed = _transfer(message * 100, batches, reader)
+    return {'messages': count, 'message_size': len(message),
+            'seconds': elapsed, 'messages_per_s': rate(count, elapsed),
+            'mb_per_s': rate(float(count * len(message)) / MB, elapsed)}
+
+
+def recv_until_boundary(quick):
+    """Reading multipart parts that end in a long boundary with recv_until."""
+    batches = 20 if quick else 200
+    boundary = '\r\n--' + '-' * 24 + 'greennet0123456789abcdef'
+    part = 'x' * 8000 + boundary
+    count = batches * 10
+    def reader(sock):
+        received = 0
+        for i in xrange(count):
+            for chunk in greennet.recv_until(sock, boundary, 4096):
+                received += len(chunk)
+        return received
+    elapsed = _transfer(part * 10, batches, reader)
+    return {'parts': count, 'part_size': len(part), 'seconds': elapsed,
+            'parts_per_s': rate(count, elapsed),
+            'mb_per_s': rate(float(count * len(part)) / MB, elapsed)}
+
+
+def _messages(quick, write):
+    """Send header/body/trailer messages with write(sock, parts)."""
+    count = 2000 if quick else 20000
+    parts = ['HEADER\r\n', 'x' * 200, '\r\n']
+    size = sum(len(part) for part in parts)
+    def reader(sock):
+        received = 0
+        while received < size * count:
+            received += len(greennet.recv(sock, 65536))
+        return received
+    hub = greennet.get_hub()
+    s1, s2 = socketpair()
+    def writer():
+        for i in xrange(count):
+            write(s1, parts)
+    spawn(hub, writer)
+    with Timer() as t:
+        reader(s2)
+        hub.run()
+    s1.close()
+    s2.close()
+    return {'messages': count, 'seconds': t.elapsed,
+            'messages_per_s': rate(count, t.elapsed)}
+
+
+def sendall_parts(quick):
+    """Messages of three parts, each sent with its own sendall."""
+    def write(sock, parts):
+        for part in parts:
+            greennet.sendall(sock, part)
+    return _messages(quick, write)
+
+
+def sendall_many_parts(quick):
+    """Messages of three parts, sent together with sendall_many."""
+    return _messages(quick, greennet.sendall_many)
+
+
+def _stream(quick, writer):
+    """A producer writing 1 KB messages with the function writer(sock)
+    returns, against a consumer reading 16 KB at a time.
+    """
+    count = 5000 if quick else 50000
+    data = 'x' * 1024
+    total = count * len(data)
+    hub = greennet.get_hub()
+    s1, s2 = socketpair()
+    write = writer(s1)
+    def producer():
+        for i in xrange(count):
+            write(data)
+    def consumer():
+        received = 0
+        while received < total:
+            received += len(greennet.recv(s2, 16384))
+    spawn(hub, producer)
+    spawn(hub, consumer)
+    with Timer() as t:
+        hub.run()
+    s1.close()
+    s2.close()
+    return {'messages': count, 'seconds': t.elapsed,
+            'messages_per_s': rate(count, t.elapsed)}
+
+
+def stream_sendall(quick):
+    """Writing each message with its own sendall."""
+    def writer(sock):
+        return lambda data: greennet.sendall(sock, data)
+    return _stream(quick, writer)
+
+
+def stream_write_buffer(quick):
+    """Writing messages to a WriteBuffer with a 64 KB high watermark."""
+    def writer(sock):
+        return WriteBuffer(sock, high=65536).write
+    return _stream(quick, writer)
+
+
+def _frames(quick, reader):
+    """Send bursts of 100 small u32 length-prefixed frames; reader(sock,
+    codec, count) receives them.
+    """
+    bursts = 100 if quick else 1000
+    count = bursts * 100
+    codec = framing.LengthPrefixCodec()
+    frames = ['x' * 100] * 100
+    hub = greennet.get_hub()
+    s1, s2 = socketpair()
+    def writer():
+        for i in xrange(bursts):
+            framing.send_frames(s1, codec, frames)
+    spawn(hub, writer)
+    with Timer() as t:
+        reader(s2, codec, count)
+        hub.run()
+    s1.close()
+    s2.close()
+    return {'frames': count, 'seconds': t.elapsed,
+            'frames_per_s': rate(count, t.elapsed)}
+
+
+def frames_recv_bytes(quick):
+    """Reading length-prefixed frames one at a time with recv_bytes."""
+    def reader(sock, codec, count):
+        for i in xrange(count):
+            header = ''.join(greennet.recv_bytes(sock, 4))
+            length = struct.unpack('!I', header)[0]
+            ''.join(greennet.recv_bytes(sock, length))
+    return _frames(quick, reader)
+
+
+def frames_batch(quick):
+    """Reading length-prefixed frames in batches with FrameReader."""
+    def reader(sock, codec, count):
+        frames = framing.FrameReader(sock, codec)
+        received = 0
+        while received < count:
+            received += len(frames.recv())
+    return _frames(quick, reader)
+
+
+def _proxy(quick, splice):
+    """One-way bulk transfer through greennet.proxy."""
+    count = 256 if quick else 2048
+    data = 'x' * 65536
+    total = len(data) * count
+    saved = greennet._libc_splice
+    if not splice:
+        greennet._libc_splice = None
+    hub = greennet.get_hub()
+    a1, a2 = socketpair()
+    b1, b2 = socketpair()
+    def writer():
+        for i in xrange(count):
+            greennet.sendall(a1, data)
+        a1.shutdown(socket.SHUT_WR)
+    def reader():
+        b2.shutdown(socket.SHUT_WR)
+        received = 0
+        while True:
+            n = len(greennet.recv(b2, 65536))
+            if not n:
+                break
+            received += n
+        assert received == total
+    spawn(hub, writer)
+    spawn(hub, reader)
+    try:
+        with Timer() as t:
+            greennet.proxy(a2, b1)
+            hub.run()
+    finally:
+        greennet._libc_splice = saved
+        for sock in a1, a2, b1, b2:
+            sock.close()
+    return {'bytes': total, 'seconds': t.elapsed,
+            'mb_per_s': rate(float(total) / MB, t.elapsed)}
+
+
+def proxy_splice(quick):
+    """Relaying through proxy with splice(2), where available."""
+    if greennet._libc_splice is None:
+        return {'skipped': 'splice not available'}
+    return _proxy(quick, True)
+
+
+def proxy_buffer(quick):
+    """Relaying through proxy with recv_into and a reusable buffer."""
+    return _proxy(quick, False)
+
+
+def _udp(quick, receive):
+    """Send bursts of 64 small datagrams, reading each with receive(sock)."""
+    bursts = 200 if quick else 2000
+    burst = 64
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    addr = receiver.getsockname()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    data = 'x' * 100
+    count = bursts * burst
+    with Timer() as t:
+        for i in xrange(bursts):
+            for j in xrange(burst):
+                sender.sendto(data, addr)
+            received = 0
+            while received < burst:
+                received += receive(receiver, burst)
+    sender.close()
+    receiver.close()
+    return {'packets': count, 'seconds': t.elapsed,
+            'packets_per_s': rate(count, t.elapsed)}
+
+
+def udp_recvfrom(quick):
+    """Receiving datagrams one recvfrom (and one poll) at a time."""
+    def receive(sock, burst):
+        greennet.recvfrom(sock, 2048)
+        return 1
+    return _udp(quick, receive)
+
+
+def udp_recv_many(quick):
+    """Receiving datagrams with recv_many, draining a burst per poll."""
+    def receive(sock, burst):
+        return len(greennet.recv_many(sock, burst, 2048))
+    return _udp(quick, receive)
+
+
+BENCHMARKS = [
+    ('io.sendall_recv_bytes', sendall_recv_bytes),
+    ('io.recv_until', recv_until),
+    ('io.recv_until_boundary', recv_until_boundary),
+    ('io.sendall_parts', sendall_parts),
+    ('io.sendall_many_parts', sendall_many_parts),
+    ('io.stream_sendall', stream_sendall),
+    ('io.stream_write_buffer', stream_write_buffer),
+    ('io.frames_recv_bytes', frames_recv_bytes),
+    ('io.frames_batch', frames_batch),
+    ('io.proxy_splice', proxy_splice),
+    ('io.proxy_buffer', proxy_buffer),
+    ('io.udp_recvfrom', udp_recvfrom),
+    ('io.udp_recv_many', udp_recv_many),
+]
+
+
+if __name__ == '__main__':
+    main(BENCHMARKS)
@@ -0,0 +1,158 @@
+"""Memory held per idle connection by an echo server.
+
+Python 2 has no tracemalloc, so the heap is measured from the objects
+the garbage collector tracks (their count, and their sizes according to
+sys.getsizeof), alongside the process's resident set size and the stacks
+that suspended greenlets have saved to the heap.
+"""
+
+
+import os
+import gc
+import sys
+import json
+import errno
+import socket
+import resource
+import traceback
+
+import greennet
+from greennet.hub import Hub
+
+from common import spawn, main
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'examples'))
+import echo
+
+
+FD_SETSIZE = 1024
+
+
+def _rss():
+    """Resident set size of the process, in bytes."""
+    try:
+        f = open('/proc/self/statm')
+    except IOError:
+        # Only the peak is available; kilobytes on Linux.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    try:
+        return int(f.read().split()[1]) * resource.getpagesize()
+    finally:
+        f.close()
+
+
+def _snapshot():
+    gc.collect()
+    objects = gc.get_objects()
+    greenlets = [obj for obj in objects
+                 if isinstance(obj, greennet.greenlet) and obj]
+    return {
+        'rss': _rss(),
+        'gc_objects': len(objects),
+        'gc_bytes': sum(sys.getsizeof(obj) for obj in objects),
+        'greenlets': len(greenlets),
+        'greenlet_stack_bytes': sum(getattr(g, '_stack_saved', 0)
+                                    for g in greenlets),
+    }
+
+
+def _echo_round(hub, clients):
+    """Send a message on every client, and wait for all the echoes."""
+    for client in clients:
+        client.send('ping')
+    pending = set(clients)
+    while pending:
+        hub.switch()
+        for client in list(pending):
+            try:
+                client.recv(64)
+            except socket.error, err:
+                if err.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+            else:
+                pending.discard(client)
+
+
+def _idle_connections(mode, n):
+    hub = Hub()
+    old_hub = greennet.get_hub()
+    greennet.set_hub(hub)
+    try:
+        pairs = [socket.socketpair() for i in xrange(n)]
+        clients = [client for client, server in pairs]
+        for client in clients:
+            client.setblocking(False)
+        before = _snapshot()
+        for client, server in pairs:
+            if mode == 'task':
+                spawn(hub, echo.echo, server)
+            else:
+                hub.call_when_readable(server, echo.echo_parked, server)
+        # Serve one message each, so every handler has run and is idle.
+        _echo_round(hub, clients)
+        after = _snapshot()
+        for client in clients:
+            client.close()
+        while hub.fdwaits:
+            hub.switch()
+    finally:
+        greennet.set_hub(old_hub)
+    result = {'mode': mode, 'connections': n}
+    for key, value in after.iteritems():
+        result[key + '_per_connection'] = float(value - before[key]) / n
+    return result
+
+
+def _in_child(func, *args):
+    """Run func(*args) in a child process, so each measurement starts
+    from a fresh heap; return its result.
+    """
+    r, w = os.pipe()
+    pid = os.fork()
+    if not pid:
+        status = 1
+        try:
+            try:
+                os.close(r)
+                os.write(w, json.dumps(func(*args)))
+                status = 0
+            except:
+                traceback.print_exc()
+        finally:
+            os._exit(status)
+    os.close(w)
+    chunks = []
+    while True:
+        data = os.read(r, 65536)
+        if not data:
+            break
+        chunks.append(data)
+    os.close(r)
+    if os.waitpid(pid, 0)[1]:
+        raise RuntimeError('measurement failed in the child process')
+    return json.loads(''.join(chunks))
+
+
+def idle_connections(quick):
+    """Memory per idle echo connection: a task blocked in recv each, or
+    parked with call_when_readable.
+    """
+    n = 200 if quick else 10000
+    # Each connection takes two fds, and select() only watches fds below
+    # FD_SETSIZE.
+    limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    if limit == resource.RLIM_INFINITY:
+        limit = FD_SETSIZE
+    n = min(n, (min(limit, FD_SETSIZE) - 64) // 2)
+    return [_in_child(_idle_connections, mode, n)
+            for mode in ('task', 'parked')]
+
+
+BENCHMARKS = [
+    ('memory.idle_connections', idle_connections),
+]
+
+
+if __name__ == '__main__':
+    main(BENCHMARKS)
@@ -0,0 +1,43 @@
+"""Benchmarks for greennet.queue.Queue."""
+
+
+from greennet.hub import Hub
+from greennet.queue import Queue
+
+from common import Timer, rate, spawn, main
+
+
+def _producer_consumer(n, maxlen, producers, consumers):
+    hub = Hub()
+    queue = Queue(maxlen, hub=hub)
+    def producer(count):
+        for i in xrange(count):
+            queue.append(i)
+    def consumer(count):
+        for i in xrange(count):
+            queue.popleft()
+    for i in xrange(producers):
+        spawn(hub, producer, n // producers)
+    for i in xrange(consumers):
+        spawn(hub, consumer, n // consumers)
+    with Timer() as t:
+        hub.run()
+    return {'items': n, 'maxlen': maxlen, 'producers': producers,
+            'consumers': consumers, 'items_per_s': rate(n, t.elapsed)}
+
+
+def producer_consumer(quick):
+    """Items per second through bounded and unbounded Queues."""
+    n = 10000 if quick else 200000
+    return [_producer_consumer(n, maxlen, producers, consumers)
+            for maxlen in (None, 1, 100)
+            for producers, consumers in ((1, 1), (10, 10))]
+
+
+BENCHMARKS = [
+    ('queue.producer_consumer', producer_consumer),
+]
+
+
+if __name__ == '__main__':
+    main(BENCHMARKS)
@@ -0,0 +1,60 @@
+"""Benchmarks for greennet.ratelimit: many tasks sharing one limit."""
+
+
+from greennet.hub import Hub
+from greennet.ratelimit import TokenBucket
+
+from common import Timer, rate, spawn, main
+
+
+RATE = 50000
+
+
+def _throttled(quick, limiter):
+    """Run tasks doing 20 operations each, with limiter(hub) returning
+    the function each operation calls to respect RATE operations/s.
+    """
+    tasks = 100 if quick else 1000
+    count = tasks * 20
+    hub = Hub()
+    throttle = limiter(hub)
+    def task():
+        for i in xrange(20):
+            throttle()
+    for i in xrange(tasks):
+        spawn(hub, task)
+    with Timer() as t:
+        hub.run()
+    return {'tasks': tasks, 'operations': count, 'seconds': t.elapsed,
+            'ideal_seconds': float(count) / RATE,
+            'operations_per_s': rate(count, t.elapsed)}
+
+
+def sleep_per_operation(quick):
+    """Each operation sleeps until its slot in a shared schedule."""
+    def limiter(hub):
+        schedule = [hub.time()]
+        def throttle():
+            now = hub.time()
+            slot = schedule[0] = max(schedule[0], now) + 1.0 / RATE
+            if slot > now:
+                hub.sleep(slot - now)
+        return throttle
+    return _throttled(quick, limiter)
+
+
+def token_bucket(quick):
+    """Each operation acquires a token from a shared TokenBucket."""
+    def limiter(hub):
+        return TokenBucket(RATE, burst=1, hub=hub).acquire
+    return _throttled(quick, limiter)
+
+
+BENCHMARKS = [
+    ('ratelimit.sleep_per_operation', sleep_per_operation),
+    ('ratelimit.token_bucket', token_bucket),
+]
+
+
+if __name__ == '__main__':
+    main(BENCHMARKS)
@@ -0,0 +1,105 @@
+"""Benchmarks for greennet.AsyncResult, against collecting with a Queue."""
+
+
+import random
+
+import greennet
+from greennet.hub import Hub, VirtualClockHub
+from greennet.queue import Queue
+
+from common import Timer, rate, spawn, main
+
+
+def _worker(i):
+    greennet.switch()
+    return i
+
+
+def _gather(kind, fanouts, width):
+    hub = Hub()
+    old_hub = greennet.get_hub()
+    greennet.set_hub(hub)
+    def queue_client():
+        for i in xrange(fanouts):
+            queue = Queue(hub=hub)
+            def worker(j):
+                queue.append((j, _worker(j)))
+            for j in xrange(width):
+                spawn(hub, worker, j)
+            values = [None] * width
+            for j in xrange(width):
+                j, value = queue.popleft()
+                values[j] = value
+    def result_client():
+        for i in xrange(fanouts):
+            results = [greennet.spawn(_worker, j) for j in xrange(width)]
+            greennet.wait_all(results)
+            values = [result.get() for result in results]
+    try:
+        spawn(hub, queue_client if kind == 'queue' else result_client)
+        with Timer() as t:
+            hub.run()
+    finally:
+        greennet.set_hub(old_hub)
+    n = fanouts * width
+    return {'kind': kind, 'width': width, 'tasks': n,
+            'tasks_per_s': rate(n, t.elapsed)}
+
+
+def gather(quick):
+    """Results collected per second from fan-outs of spawned tasks."""
+    n = 20000 if quick else 200000
+    return [_gather(kind, n // width, width)
+            for kind in ('queue', 'wait_all') for width in (10, 100)]
+
+
+def _hedged(kind, requests, replicas):
+    """Send each request to several replicas, keeping the first answer.
+    
+    A replica usually answers in 1ms, but one time in ten takes 100ms.
+    """
+    hub = VirtualClockHub()
+    old_hub = greennet.get_hub()
+    greennet.set_hub(hub)
+    rand = random.Random(0)
+    completed = [0]
+    def replica(i):
+        hub.sleep(0.1 if rand.random() < 0.1 else 0.001)
+        completed[0] += 1
+        return i
+    def queue_client():
+        for i in xrange(requests):
+            queue = Queue(hub=hub)
+            for j in xrange(replicas):
+                spawn(hub, lambda j: queue.append(replica(j)), j)
+            queue.popleft()
+    def result_client():
+        for i in xrange(requests):
+            results = [greennet.spawn(replica, j) for j in xrange(replicas)]
+            greennet.wait_any(results).get()
+    try:
+        spawn(hub, queue_client if kind == 'queue' else result_client)
+        with Timer() as t:
+            hub.run()
+    finally:
+        greennet.set_hub(old_hub)
+    return {'kind': kind, 'requests': requests, 'replicas': replicas,
+            'replica_calls_completed': completed[0],
+            'virtual_seconds': hub.time(),
+            'requests_per_s': rate(requests, t.elapsed)}
+
+
+def hedged(quick):
+    """Hedged requests per second, abandoning or cancelling the losers."""
+    requests = 2000 if quick else 20000
+    return [_hedged(kind, requests, 3) for kind in ('queue', 'wait_any')]
+
+
+BENCHMARKS = [
+    ('result.gather', gather),
+    ('result.hedged', hedged),
+]
+
+
+if __name__ == '__main__':
+    main(BENCHMARKS)
@@ -0,0 +1,74 @@
+"""Benchmarks for greennet.ssl: handshakes and bulk transfer."""
+
+
+import os
+
+import greennet
+from greennet import ssl
+
+from common import CERTS, Timer, rate, spawn, socketpair, main
+
+
+MB = 1024 * 1024
+
+SERVER_CERT = {
+    'certfile': os.path.join(CERTS, 'server.pem'),
+    'keyfile': os.path.join(CERTS, 'server.key'),
+}
+
+
+def _handshake():
+    """Return a connected (server, client) pair of SSL connections."""
+    hub = greennet.get_hub()
+    s1, s2 = socketpair()
+    result = []
+    def server():
+        result.append(ssl.accept(s1, SERVER_CERT))
+    spawn(hub, server)
+    client = ssl.connect(s2)
+    hub.run()
+    return result[0], client
+
+
+def handshake(quick):
+    """Full SSL handshakes per second over socketpairs."""
+    n = 20 if quick else 200
+    with Timer() as t:
+        for i in xrange(n):
+            server, client = _handshake()
+            server.close()
+            client.close()
+    return {'handshakes': n, 'seconds': t.elapsed,
+            'handshakes_per_s': rate(n, t.elapsed)}
+
+
+def bulk(quick):
+    """Bulk transfer over SSL with sendall and recv_bytes."""
+    count = 128 if quick else 2048
+    data = 'x' * 16384
+    total = len(data) * count
+    server, client = _handshake()
+    hub = greennet.get_hub()
+    def writer():
+        for i in xrange(count):
+            greennet.sendall(server, data)
+    spawn(hub, writer)
+    with Timer() as t:
+        received = sum(len(chunk)
+                       for chunk in greennet.recv_bytes(client, total))
+        hub.run()
+    server.close()
+    client.close()
+    assert received == total
+    return {'bytes': total, 'seconds': t.elapsed,
+            'mb_per_s': rate(float(total) / MB, t.elapsed)}
+
+
+BENCHMARKS = [
+    ('ssl.handshake', handshake),
+    ('ssl.bulk', bulk),
+]
+
+
+if __name__ == '__main__':
+    main(BENCHMARKS)
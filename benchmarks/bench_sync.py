@@ -0,0 +1,122 @@
+"""Benchmarks for greennet.sync, against the 1-slot Queue workarounds."""
+
+
+import random
+
+from greennet.hub import Hub, Timeout
+from greennet.queue import Queue
+from greennet.sync import Event, Lock
+
+from common import Timer, rate, spawn, main
+
+
+class QueueLock(object):
+    
+    """A Lock made of a 1-slot Queue: append to acquire, pop to release."""
+    
+    def __init__(self, hub):
+        self.queue = Queue(1, hub=hub)
+    
+    def acquire(self, timeout=None):
+        self.queue.append(None, timeout)
+    
+    def release(self):
+        self.queue.popleft()
+
+
+class QueueEvent(object):
+    
+    """An Event made of a Queue: each woken waiter passes the item on."""
+    
+    def __init__(self, hub):
+        self.queue = Queue(hub=hub)
+    
+    def wait(self):
+        self.queue.append(self.queue.popleft())
+    
+    def set(self):
+        self.queue.append(None)
+
+
+def _lock_contention(kind, n, tasks):
+    hub = Hub()
+    lock = Lock(hub) if kind == 'lock' else QueueLock(hub)
+    def task(count):
+        for i in xrange(count):
+            lock.acquire()
+            hub.switch()
+            lock.release()
+    for i in xrange(tasks):
+        spawn(hub, task, n // tasks)
+    with Timer() as t:
+        hub.run()
+    return {'kind': kind, 'acquires': n, 'tasks': tasks,
+            'acquires_per_s': rate(n, t.elapsed)}
+
+
+def lock_contention(quick):
+    """Acquire/release pairs per second, yielding while holding the lock."""
+    n = 10000 if quick else 200000
+    return [_lock_contention(kind, n, tasks)
+            for kind in ('queue', 'lock') for tasks in (1, 10, 100)]
+
+
+def _event_fanout(kind, waiters, rounds):
+    hub = Hub()
+    def waiter(event):
+        event.wait()
+    with Timer() as t:
+        for i in xrange(rounds):
+            event = Event(hub) if kind == 'event' else QueueEvent(hub)
+            for j in xrange(waiters):
+                spawn(hub, waiter, event)
+            hub.switch()
+            event.set()
+            hub.run()
+    n = waiters * rounds
+    return {'kind': kind, 'waiters': waiters, 'rounds': rounds,
+            'wakeups_per_s': rate(n, t.elapsed)}
+
+
+def event_fanout(quick):
+    """Waiters woken per second by setting an Event they all wait on."""
+    rounds = 10 if quick else 100
+    return [_event_fanout(kind, waiters, rounds)
+            for kind in ('queue', 'event') for waiters in (10, 1000)]
+
+
+def _lock_timeouts(kind, waiters):
+    hub = Hub()
+    lock = Lock(hub) if kind == 'lock' else QueueLock(hub)
+    def task(timeout):
+        try:
+            lock.acquire(timeout=timeout)
+        except Timeout:
+            pass
+    lock.acquire()
+    rand = random.Random(0)
+    for i in xrange(waiters):
+        spawn(hub, task, rand.random() * 0.01)
+    with Timer() as t:
+        hub.run()
+    return {'kind': kind, 'waiters': waiters,
+            'timeouts_per_s': rate(waiters, t.elapsed)}
+
+
+def lock_timeouts(quick):
+    """Waiters per second that give up, in random order, on a lock that is
+    never released.
+    """
+    waiters = 2000 if quick else 20000
+    return [_lock_timeouts(kind, waiters) for kind in ('queue', 'lock')]
+
+
+BENCHMARKS = [
+    ('sync.lock_contention', lock_contention),
+    ('sync.event_fanout', event_fanout),
+    ('sync.lock_timeouts', lock_timeouts),
+]
+
+
+if __name__ == '__main__':
+    main(BENCHMARKS)
@@ -0,0 +1,83 @@
+"""Helpers shared by the benchmarks."""
+
+
+import os
+import sys
+import time
+import json
+import socket
+
+import greennet
+from greennet.hub import Hub
+
+
+CERTS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                     os.pardir, 'examples', 'certs')
+
+
+class Timer(object):
+    
+    """Context manager measuring elapsed wall-clock time."""
+    
+    def __enter__(self):
+        self.start = time.time()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.elapsed = time.time() - self.start
+
+
+def rate(count, elapsed):
+    """Operations per second, guarding against a zero elapsed time."""
+    return count / max(elapsed, 1e-9)
+
+
+def spawn(hub, func, *args, **kwargs):
+    """Schedule func to run in a new task on the given hub."""
+    task = greennet.greenlet(func)
+    hub.schedule(task, *args, **kwargs)
+    return task
+
+
+def socketpair():
+    """Return a pair of connected, non-blocking sockets."""
+    s1, s2 = socket.socketpair()
+    s1.setblocking(False)
+    s2.setblocking(False)
+    return s1, s2
+
+
+def main(benchmarks, argv=None):
+    """Run (name, function) pairs, and write their results as JSON.
+    
+    Each function takes the quick flag and returns a dict of results.
+    Command-line arguments select benchmarks by name prefix; --quick runs
+    smaller sizes, and -o FILE writes to a file instead of stdout.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    quick = '--quick' in argv
+    out = sys.stdout
+    names = []
+    args = iter(argv)
+    for arg in args:
+        if arg == '-o':
+            out = open(args.next(), 'w')
+        elif arg != '--quick':
+            names.append(arg)
+    results = {}
+    for name, func in benchmarks:
+        if names and not [n for n in names if name.startswith(n)]:
+            continue
+        sys.stderr.write('%s...\n' % (name,))
+        results[name] = func(quick)
+    json.dump({
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'time': time.time(),
+        'quick': quick,
+        'results': results,
+    }, out, indent=2, sort_keys=True)
+    out.write('\n')
+    if out is not sys.stdout:
+        out.close()
@@ -0,0 +1,39 @@
+"""Compare two benchmark result files written by run.py.
+
+Usage: python benchmarks/compare.py BEFORE.json AFTER.json
+
+Prints every rate (keys ending in _per_s) found in both files, with the
+ratio of the new value to the old one.
+"""
+
+
+import sys
+import json
+
+
+def rates(results, prefix=''):
+    """Yield (path, value) for every rate in a results structure."""
+    if isinstance(results, dict):
+        for key, value in sorted(results.iteritems()):
+            path = '%s.%s' % (prefix, key) if prefix else key
+            if key.endswith('_per_s'):
+                yield path, value
+            else:
+                for item in rates(value, path):
+                    yield item
+    elif isinstance(results, list):
+        for i, value in enumerate(results):
+            for item in rates(value, '%s[%d]' % (prefix, i)):
+                yield item
+
+
+def main(before, after):
+    old = dict(rates(json.load(open(before))['results']))
+    new = dict(rates(json.load(open(after))['results']))
+    for path in sorted(set(old) & set(new)):
+        print '%-60s %14.1f %14.1f %7.2fx' % (
+            path, old[path], new[path], new[path] / max(old[path], 1e-9))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:3])
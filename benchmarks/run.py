@@ -0,0 +1,37 @@
+"""Run the whole benchmark suite, writing the results as JSON.
+
+Usage: python benchmarks/run.py [--quick] [-o FILE] [NAME-PREFIX ...]
+
+The greennet package must be importable (e.g. via PYTHONPATH).
+"""
+
+
+from common import main
+
+import bench_broadcast
+import bench_hub
+import bench_fairness
+import bench_http
+import bench_io
+import bench_memory
+import bench_queue
+import bench_ratelimit
+import bench_result
+import bench_sync
+
+BENCHMARKS = (bench_hub.BENCHMARKS + bench_fairness.BENCHMARKS +
+              bench_io.BENCHMARKS + bench_queue.BENCHMARKS +
+              bench_http.BENCHMARKS + bench_ratelimit.BENCHMARKS +
+              bench_result.BENCHMARKS + bench_sync.BENCHMARKS +
+              bench_broadcast.BENCHMARKS + bench_memory.BENCHMARKS)
+
+try:
+    import bench_ssl
+except ImportError:
+    pass
+else:
+    BENCHMARKS += bench_ssl.BENCHMARKS
+
+
+if __name__ == '__main__':
+    main(BENCHMARKS)
@@ -1,5 +1,6 @@
 from __future__ import with_statement
 from contextlib import closing
+import sys
 import socket
 
 from py.magic import greenlet
@@ -17,12 +18,28 @@ def echo(sock):
             greennet.sendall(sock, data)
 
 
+def echo_parked(sock, bufsize=65536):
+    """Echo what the client sent, then park the socket until it sends more.
+    
+    An idle connection holds no task, only a callback on its fd.
+    """
+    data = sock.recv(bufsize)
+    if not data:
+        sock.close()
+        return
+    greennet.sendall(sock, data)
+    greennet.call_when_readable(sock, echo_parked, sock, bufsize)
+
+
 if __name__ == '__main__':
+    parked = '--parked' in sys.argv[1:]
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.bind(('', 1234))
     sock.listen(socket.SOMAXCONN)
     with closing(sock):
         while True:
             client, addr = greennet.accept(sock)
-            greennet.schedule(greenlet(echo), client)
-
+            if parked:
+                greennet.call_when_readable(client, echo_parked, client)
+            else:
+                greennet.schedule(greenlet(echo), client)
@@ -1,19 +1,39 @@
+from __future__ import with_statement
 import os
 import sys
-import time
+import mmap
 import errno
 import socket
 
 from py.magic import greenlet
 
-from greennet.hub import Hub, Timeout
-from greennet.util import prefixes
+from greennet.hub import Hub, VirtualClockHub, Timeout, Cancelled, Shutdown
+from greennet.hub import READ, WRITE
+from greennet.util import Matcher
+
+from greennet import dns
+from greennet.result import (AsyncResult, spawn, wait_any, wait_all,
+                             as_completed)
 
 try:
     from greennet import ssl
 except ImportError:
     ssl = None
 
+try:
+    from sendfile import sendfile as _sendfile
+except ImportError:
+    _sendfile = getattr(os, 'sendfile', None)
+
+try:
+    import ctypes
+    _libc_splice = ctypes.CDLL(None, use_errno=True).splice
+    _libc_splice.argtypes = (ctypes.c_int, ctypes.c_void_p, ctypes.c_int,
+                             ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint)
+    _libc_splice.restype = ctypes.c_ssize_t
+except (ImportError, OSError, AttributeError):
+    _libc_splice = None
+
 
 class ConnectionLost(Exception):
     """Connection was terminated."""
@@ -31,6 +51,10 @@ try:
         except AttributeError:
             _hubs.hub = Hub()
             return _hubs.hub
+    def set_hub(hub):
+        """Make hub the Hub instance for this thread."""
+        global _hubs
+        _hubs.hub = hub
 except ImportError:
     _hub = None
     def get_hub():
@@ -39,6 +63,10 @@ except ImportError:
         if _hub is None:
             _hub = Hub()
         return _hub
+    def set_hub(hub):
+        """Make hub the global Hub instance."""
+        global _hub
+        _hub = hub
 
 
 def schedule(task, *args, **kwargs):
@@ -46,6 +74,39 @@ def schedule(task, *args, **kwargs):
     get_hub().schedule(task, *args, **kwargs)
 
 
+def schedule_priority(task, priority, *args, **kwargs):
+    """Assign a task's priority (0 is highest), and schedule it."""
+    get_hub().schedule_priority(task, priority, *args, **kwargs)
+
+
+def set_priority(task, priority):
+    """Assign the priority at which a task is scheduled (0 is highest)."""
+    get_hub().set_priority(task, priority)
+
+
+def deadline(timeout):
+    """Bound the time the current task may spend waiting.
+    
+    Returns a context manager. Every wait the task makes in the with-block
+    must complete within timeout seconds, or Timeout is raised; the whole
+    block uses a single timer. A timeout of None means no limit.
+    
+    >>> import socket
+    >>> s1, s2 = socket.socketpair()
+    >>> s2.send('some data')
+    9
+    >>> with deadline(0.1):
+    ...     while True:
+    ...         data = recv(s1, 4)
+    Traceback (most recent call last):
+        ...
+    Timeout
+    >>> s1.close()
+    >>> s2.close()
+    """
+    return get_hub().deadline(timeout)
+
+
 def switch():
     """Reschedule the current task, and run the event-loop."""
     get_hub().switch()
@@ -59,6 +120,24 @@ def run():
     get_hub().run()
 
 
+def stop():
+    """Make run() return once the tasks currently ready have run."""
+    get_hub().stop()
+
+
+def run_until(until):
+    """Run the event loop until a predicate holds or a time is reached."""
+    return get_hub().run_until(until)
+
+
+def shutdown(grace):
+    """Let the tasks in flight finish, then cancel the stragglers.
+    
+    Returns the number of tasks drained and killed (see Hub.shutdown).
+    """
+    return get_hub().shutdown(grace)
+
+
 def sleep(timeout):
     """Suspend the current task for the specified number of seconds."""
     get_hub().sleep(timeout)
@@ -69,6 +148,11 @@ def call_later(task, timeout, *args, **kwargs):
     get_hub().call_later(task, timeout, *args, **kwargs)
 
 
+def call_when_readable(obj, func, *args, **kwargs):
+    """Run func(*args, **kwargs) in a new task once obj is readable."""
+    return get_hub().call_when_readable(obj, func, *args, **kwargs)
+
+
 def readable(obj, timeout=None):
     """Suspend the current task until the selectable-object is readable."""
     get_hub().poll(obj, read=True, timeout=timeout)
@@ -82,7 +166,9 @@ def writeable(obj, timeout=None):
 def connect(sock, addr, timeout=None):
     """Connect a socket to the specified address.
     
-    Suspends the current task until the connection is established.
+    Suspends the current task until the connection is established. For
+    internet sockets, the host may be a name; it is resolved to the first of
+    its addresses with greennet.dns, within the same timeout.
     
     >>> import socket
     >>> s1 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -100,6 +186,16 @@ def connect(sock, addr, timeout=None):
     >>> s1.close()
     >>> s2.close()
     """
+    if (sock.family in (socket.AF_INET, socket.AF_INET6) and
+        not dns.is_address(addr[0], sock.family)):
+        with deadline(timeout):
+            addr = dns.resolve(addr[0], addr[1], family=sock.family)[0]
+            _connect(sock, addr)
+    else:
+        _connect(sock, addr, timeout)
+
+
+def _connect(sock, addr, timeout=None):
     sock_timeout = sock.gettimeout()
     if sock_timeout != 0.0:
         sock.setblocking(False)
@@ -192,9 +288,143 @@ def recv(sock, bufsize, flags=0, timeout=None):
     return sock.recv(bufsize, flags)
 
 
+def sendto(sock, data, addr, timeout=None):
+    """Send a datagram to the given address.
+    
+    >>> import socket
+    >>> s1 = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    >>> s1.bind(('127.0.0.1', 0))
+    >>> s2 = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    >>> sendto(s2, 'some data', s1.getsockname())
+    9
+    >>> s1.recv(9)
+    'some data'
+    >>> s1.close()
+    >>> s2.close()
+    """
+    writeable(sock, timeout=timeout)
+    return sock.sendto(data, addr)
+
+
+def recvfrom(sock, bufsize, flags=0, timeout=None):
+    """Receive a datagram, returning the data and the sender's address.
+    
+    >>> import socket
+    >>> s1 = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    >>> s1.bind(('127.0.0.1', 0))
+    >>> s2 = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    >>> s2.bind(('127.0.0.1', 0))
+    >>> recvfrom(s1, 9, timeout=0)
+    Traceback (most recent call last):
+        ...
+    Timeout
+    >>> s2.sendto('some data', s1.getsockname())
+    9
+    >>> data, addr = recvfrom(s1, 9)
+    >>> data, addr == s2.getsockname()
+    ('some data', True)
+    >>> s1.close()
+    >>> s2.close()
+    """
+    readable(sock, timeout=timeout)
+    return sock.recvfrom(bufsize, flags)
+
+
+def _nonblocking_calls(sock, call, items):
+    """Call call(item) for each item without blocking, until one would block.
+    
+    Returns the list of results; it is shorter than items if the socket's
+    buffer filled (or emptied) part-way. The socket's timeout is restored.
+    """
+    results = []
+    sock_timeout = sock.gettimeout()
+    if sock_timeout != 0.0:
+        sock.setblocking(False)
+    try:
+        for item in items:
+            while True:
+                try:
+                    results.append(call(item))
+                    break
+                except socket.error, err:
+                    if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        return results
+                    elif err.args[0] != errno.EINTR:
+                        raise
+    finally:
+        if sock_timeout != 0.0:
+            sock.settimeout(sock_timeout)
+    return results
+
+
+def recv_many(sock, max_packets, bufsize=65535, timeout=None):
+    """Receive up to max_packets queued datagrams.
+    
+    Suspends the current task until the socket is readable, then reads every
+    queued datagram (up to max_packets) without waiting again. Returns a
+    non-empty list of (data, address) pairs.
+    
+    >>> import socket
+    >>> s1 = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    >>> s1.bind(('127.0.0.1', 0))
+    >>> s2 = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    >>> recv_many(s1, 10, timeout=0)
+    Traceback (most recent call last):
+        ...
+    Timeout
+    >>> for data in ('one', 'two', 'three'):
+    ...     s2.sendto(data, s1.getsockname())
+    3
+    3
+    5
+    >>> [data for data, addr in recv_many(s1, 2)]
+    ['one', 'two']
+    >>> [data for data, addr in recv_many(s1, 2)]
+    ['three']
+    >>> s1.close()
+    >>> s2.close()
+    """
+    recvfrom = sock.recvfrom
+    with deadline(timeout):
+        while True:
+            readable(sock)
+            packets = _nonblocking_calls(sock, lambda i: recvfrom(bufsize),
+                                         xrange(max_packets))
+            if packets:
+                return packets
+
+
+def sendto_many(sock, packets, timeout=None):
+    """Send a list of (data, address) datagrams.
+    
+    Datagrams are sent without waiting for as long as the socket's buffer
+    has room; the task is only suspended when it fills.
+    
+    >>> import socket
+    >>> s1 = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    >>> s1.bind(('127.0.0.1', 0))
+    >>> s2 = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    >>> addr = s1.getsockname()
+    >>> sendto_many(s2, [('one', addr), ('two', addr)])
+    >>> [data for data, addr in recv_many(s1, 10)]
+    ['one', 'two']
+    >>> s1.close()
+    >>> s2.close()
+    """
+    sendto = sock.sendto
+    with deadline(timeout):
+        while packets:
+            sent = _nonblocking_calls(sock, lambda p: sendto(*p), packets)
+            packets = packets[len(sent):]
+            if packets:
+                writeable(sock)
+
+
 def sendall(sock, data, timeout=None):
     """Send all data on the given socket.
     
+    The timeout applies to the whole transfer, not to each send.
+    
     >>> import socket
     >>> s1, s2 = socket.socketpair()
     >>> sendall(s1, 'some data')
@@ -207,12 +437,177 @@ def sendall(sock, data, timeout=None):
         _send = ssl.send
     else:
         _send = send
-    if timeout is not None:
-        end = time.time() + timeout
-    while data:
-        data = data[_send(sock, data, timeout):]
-        if timeout is not None:
-            timeout = end - time.time()
+    with deadline(timeout):
+        while data:
+            data = data[_send(sock, data):]
+
+
+# Consecutive buffers smaller than this are joined before sending.
+COALESCE_LIMIT = 65536
+
+
+def _coalesce(bufs, limit):
+    """Generator joining runs of small buffers into strings of about limit.
+    
+    >>> list(_coalesce(['a', 'b', 'cdef', 'g', 'h'], 4))
+    ['ab', 'cdef', 'gh']
+    """
+    pending = []
+    size = 0
+    for buf in bufs:
+        if len(buf) >= limit:
+            if pending:
+                yield ''.join(pending)
+                pending = []
+                size = 0
+            yield buf
+            continue
+        pending.append(buf)
+        size += len(buf)
+        if size >= limit:
+            yield ''.join(pending)
+            pending = []
+            size = 0
+    if len(pending) == 1:
+        yield pending[0]
+    elif pending:
+        yield ''.join(pending)
+
+
+def sendall_many(sock, bufs, timeout=None):
+    """Send all the data in a sequence of strings, in order.
+    
+    Runs of small strings are joined so that they go out in a single send,
+    and large ones are sent as they are; partial sends never copy the rest
+    of a string. The timeout applies to the whole transfer.
+    
+    >>> import socket
+    >>> s1, s2 = socket.socketpair()
+    >>> sendall_many(s1, ['header ', 'body', ' trailer'])
+    >>> s2.recv(19)
+    'header body trailer'
+    >>> s1.close()
+    >>> s2.close()
+    """
+    if ssl and isinstance(sock, ssl.peekable):
+        _send = ssl.send
+    else:
+        _send = send
+    with deadline(timeout):
+        for data in _coalesce(bufs, COALESCE_LIMIT):
+            while data:
+                data = buffer(data, _send(sock, data))
+
+
+# Size of the slices of a mapped file sent when sendfile is not available.
+SENDFILE_CHUNK = 262144
+
+
+def sendfile(sock, file, offset=0, count=None, timeout=None):
+    """Send count bytes of a file, starting at offset, on the given socket.
+    
+    The file is a file object or descriptor; by default, everything from
+    offset to its end is sent. Returns the number of bytes sent, which is
+    less than count only if the file is shorter. The timeout applies to the
+    whole transfer.
+    
+    The data is sent with sendfile(2) (os.sendfile, or the sendfile module
+    on Python 2) where possible. Otherwise, including over SSL connections,
+    the file is mapped into memory and sent in slices, without reading it
+    into strings first.
+    
+    >>> import socket, tempfile
+    >>> f = tempfile.TemporaryFile()
+    >>> f.write('some data')
+    >>> f.flush()
+    >>> s1, s2 = socket.socketpair()
+    >>> sendfile(s1, f, 2, 5)
+    5
+    >>> s2.recv(5)
+    'me da'
+    >>> sendfile(s1, f, 5)
+    4
+    >>> s2.recv(4)
+    'data'
+    >>> s1.close()
+    >>> s2.close()
+    >>> f.close()
+    """
+    if not isinstance(file, (int, long)):
+        file = file.fileno()
+    if count is None:
+        count = max(os.fstat(file).st_size - offset, 0)
+    if count <= 0:
+        return 0
+    if ssl and isinstance(sock, ssl.peekable):
+        with deadline(timeout):
+            return _sendfile_mmap(sock, file, offset, count, ssl.send)
+    # A partial transfer must not block the Hub.
+    sock_timeout = sock.gettimeout()
+    if sock_timeout != 0.0:
+        sock.setblocking(False)
+    try:
+        with deadline(timeout):
+            if _sendfile is not None:
+                return _sendfile_native(sock, file, offset, count)
+            return _sendfile_mmap(sock, file, offset, count, _send_some)
+    finally:
+        if sock_timeout != 0.0:
+            sock.settimeout(sock_timeout)
+
+
+def _send_some(sock, data):
+    """Send on a non-blocking socket, waiting for it to be writeable only
+    if it is not.
+    """
+    while True:
+        try:
+            return sock.send(data)
+        except socket.error, err:
+            if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                writeable(sock)
+            elif err.args[0] != errno.EINTR:
+                raise
+
+
+def _sendfile_native(sock, fd, offset, count):
+    """Transfer with sendfile(2), waiting for writability when the socket
+    buffer is full.
+    """
+    sent = 0
+    out = sock.fileno()
+    while sent < count:
+        try:
+            n = _sendfile(out, fd, offset + sent, count - sent)
+        except (IOError, OSError), err:
+            if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                writeable(sock)
+                continue
+            if err.args[0] == errno.EINTR:
+                continue
+            raise
+        if not n:
+            break
+        sent += n
+    return sent
+
+
+def _sendfile_mmap(sock, fd, offset, count, _send):
+    """Transfer by sending slices of the mapped file."""
+    count = min(count, os.fstat(fd).st_size - offset)
+    if count <= 0:
+        return 0
+    start = offset - offset % mmap.ALLOCATIONGRANULARITY
+    m = mmap.mmap(fd, offset - start + count, access=mmap.ACCESS_READ,
+                  offset=start)
+    try:
+        pos = offset - start
+        end = pos + count
+        while pos < end:
+            pos += _send(sock, buffer(m, pos, min(SENDFILE_CHUNK, end - pos)))
+    finally:
+        m.close()
+    return count
 
 
 def recv_bytes(sock, n, bufsize=None, timeout=None):
@@ -221,7 +616,8 @@ def recv_bytes(sock, n, bufsize=None, timeout=None):
     Generator yields data as it becomes available.
     
     Raises ConnectionLost if the connection is terminated before the
-    specified number of bytes is read.
+    specified number of bytes is read. The timeout applies to the whole
+    transfer, including time spent between chunks.
     
     >>> import socket
     >>> s1, s2 = socket.socketpair()
@@ -246,25 +642,56 @@ def recv_bytes(sock, n, bufsize=None, timeout=None):
         _recv = recv
     if bufsize is None:
         bufsize = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
-    if timeout is not None:
-        end = time.time() + timeout
+    # No Deadline is held across the yields: it would stay on the stack
+    # of whichever task consumes the generator, bounding its other waits.
+    expires = _expires(timeout)
     while n:
-        data = _recv(sock, min(n, bufsize), timeout=timeout)
+        data = _recv(sock, min(n, bufsize), timeout=_remaining(expires))
         if not data:
             raise ConnectionLost()
         yield data
         n -= len(data)
-        if timeout is not None:
-            timeout = end - time.time()
+
+
+def _expires(timeout):
+    """Return the hub time a timeout runs out at, or None for no limit."""
+    if timeout is None:
+        return None
+    return get_hub().time() + timeout
+
+
+def _remaining(expires):
+    """Return the seconds left until expires (see _expires), or None."""
+    if expires is None:
+        return None
+    return max(0.0, expires - get_hub().time())
+
+
+_matchers = {}
+
+
+def _matcher(term):
+    """Return a (cached) Matcher for a terminator or tuple of them."""
+    try:
+        return _matchers[term]
+    except KeyError:
+        if len(_matchers) >= 256:
+            _matchers.clear()
+        matcher = _matchers[term] = Matcher(term)
+        return matcher
 
 
 def recv_until(sock, term, bufsize=None, timeout=None):
     """Receive from socket until the specified terminator.
     
-    Generator yields data as it becomes available.
+    Generator yields data as it becomes available. The terminator may also
+    be a tuple of alternatives, or a greennet.util.Matcher; receiving stops
+    at whichever completes first. Each received byte is examined once, even
+    if a terminator is split between chunks.
     
     Raises ConnectionLost if the connection is terminated before the
-    terminator is encountered.
+    terminator is encountered. The timeout applies to the whole transfer,
+    including time spent between chunks.
     
     >>> import socket
     >>> s1, s2 = socket.socketpair()
@@ -284,6 +711,10 @@ def recv_until(sock, term, bufsize=None, timeout=None):
     ['some', ' dat']
     >>> s1.recv(1)
     'a'
+    >>> s2.send('some data')
+    9
+    >>> list(recv_until(s1, ('ta', 'me'), 3))
+    ['som', 'e']
     >>> s1.close()
     >>> s2.close()
     """
@@ -293,30 +724,24 @@ def recv_until(sock, term, bufsize=None, timeout=None):
         _recv = recv
     if bufsize is None:
         bufsize = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
-    if timeout is not None:
-        end = time.time() + timeout
-    assert bufsize >= len(term)
+    if isinstance(term, Matcher):
+        matcher = term
+    else:
+        matcher = _matcher(term)
+    state = 0
+    expires = _expires(timeout)
     while True:
-        data = _recv(sock, bufsize, socket.MSG_PEEK, timeout=timeout)
+        data = _recv(sock, bufsize, socket.MSG_PEEK,
+                     timeout=_remaining(expires))
         if not data:
             raise ConnectionLost()
-        test = data.find(term)
-        if test > -1:
-            data = sock.recv(test + len(term))
-            yield data
+        # Every peeked byte is scanned once and then consumed; a partial
+        # match is carried over in the matcher state.
+        end, state = matcher.search(data, state)
+        if end > -1:
+            yield sock.recv(end)
             break
-        for p in prefixes(term):
-            if data.endswith(p):
-                seen = len(data) - len(p)
-                if seen:
-                    data = sock.recv(seen)
-                    yield data
-                break
-        else:
-            data = sock.recv(len(data))
-            yield data
-        if timeout is not None:
-            timeout = end - time.time()
+        yield sock.recv(len(data))
 
 
 def recv_until_maxlen(sock, term, maxlen, exc_type,
@@ -358,3 +783,199 @@ def recv_until_maxlen(sock, term, maxlen, exc_type,
             raise exc_type()
         yield data
 
+
+# splice(2) flags: move pages instead of copying, and don't block on pipes.
+_SPLICE_FLAGS = 1 | 2
+
+
+def _splice(fd_in, fd_out, count):
+    """Move up to count bytes between descriptors, one being a pipe."""
+    n = _libc_splice(fd_in, None, fd_out, None, count, _SPLICE_FLAGS)
+    if n < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return n
+
+
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK)
+
+# Errors from splice(2) meaning it cannot be used for a socket (an
+# unsupported socket type, or a seccomp filter or sandbox forbidding it).
+_NO_SPLICE = (errno.EINVAL, errno.ENOSYS, errno.EPERM)
+
+
+class _Relay(object):
+    
+    """One direction of a proxy, copying through a reusable buffer."""
+    
+    def __init__(self, src, dst, bufsize):
+        self.src = src
+        self.dst = dst
+        self.buf = bytearray(bufsize)
+        self.view = memoryview(self.buf)
+        self.start = self.end = 0
+        self.eof = False
+        self.done = False
+        self.count = 0
+    
+    def pending(self):
+        return self.end - self.start
+    
+    def read(self):
+        """Read into the buffer; return the byte count, 0 at EOF."""
+        self.start = 0
+        self.end = self.src.recv_into(self.buf)
+        return self.end
+    
+    def write(self):
+        """Write from the buffer; return the byte count."""
+        n = self.dst.send(self.view[self.start:self.end])
+        self.start += n
+        return n
+    
+    def close(self):
+        pass
+
+
+class _SpliceRelay(_Relay):
+    
+    """One direction of a proxy, moving data through a pipe with splice."""
+    
+    def __init__(self, src, dst, bufsize):
+        self.src = src
+        self.dst = dst
+        self.bufsize = bufsize
+        self.pipe_r, self.pipe_w = os.pipe()
+        self.in_pipe = 0
+        self.started = False
+        self.eof = False
+        self.done = False
+        self.count = 0
+    
+    def pending(self):
+        return self.in_pipe
+    
+    def read(self):
+        n = _splice(self.src.fileno(), self.pipe_w, self.bufsize)
+        self.in_pipe += n
+        self.started = True
+        return n
+    
+    def write(self):
+        n = _splice(self.pipe_r, self.dst.fileno(), self.in_pipe)
+        self.in_pipe -= n
+        return n
+    
+    def close(self):
+        os.close(self.pipe_r)
+        os.close(self.pipe_w)
+
+
+def _pump(relay):
+    """Move data along a relay until it would block, reading at most once.
+    
+    Returns the event the relay is waiting for: READ on its source, WRITE
+    on its destination, or None once it is done.
+    """
+    read = False
+    while True:
+        if relay.pending():
+            try:
+                relay.count += relay.write()
+            except (socket.error, OSError), err:
+                if err.args[0] in _WOULD_BLOCK:
+                    return WRITE
+                raise
+        elif relay.eof:
+            try:
+                relay.dst.shutdown(socket.SHUT_WR)
+            except socket.error, err:
+                if err.args[0] != errno.ENOTCONN:
+                    raise
+            relay.done = True
+            return None
+        elif read:
+            return READ
+        else:
+            read = True
+            try:
+                if not relay.read():
+                    relay.eof = True
+            except (socket.error, OSError), err:
+                if err.args[0] in _WOULD_BLOCK:
+                    return READ
+                raise
+
+
+def proxy(sock_a, sock_b, timeout=None, bufsize=65536):
+    """Relay data between two sockets in both directions, in one task.
+    
+    Data is moved with splice(2) through a pipe where that is available
+    (Linux), and through a reusable buffer otherwise, including when the
+    first splice from a socket fails because the kernel or a sandbox does
+    not allow it for that socket. When one side shuts
+    down its writing half, the other side's writing half is shut down once
+    everything before it has been relayed. Returns when both directions are
+    finished, with the byte counts (a to b, b to a); neither socket is
+    closed. Raises Timeout if no data can be moved for timeout seconds.
+    Only plain sockets are supported.
+    
+    >>> import socket
+    >>> a1, a2 = socket.socketpair()
+    >>> b1, b2 = socket.socketpair()
+    >>> a1.sendall('request')
+    >>> a1.shutdown(socket.SHUT_WR)
+    >>> b2.sendall('response')
+    >>> b2.shutdown(socket.SHUT_WR)
+    >>> proxy(a2, b1)
+    (7, 8)
+    >>> b2.recv(100), a1.recv(100)
+    ('request', 'response')
+    >>> for s in a1, a2, b1, b2:
+    ...     s.close()
+    """
+    hub = get_hub()
+    if _libc_splice is not None:
+        relay_type = _SpliceRelay
+    else:
+        relay_type = _Relay
+    timeouts = [(sock, sock.gettimeout()) for sock in (sock_a, sock_b)]
+    relays = []
+    def pump(i):
+        relay = relays[i]
+        try:
+            return _pump(relay)
+        except OSError, err:
+            if (not isinstance(relay, _SpliceRelay) or relay.started or
+                err.args[0] not in _NO_SPLICE):
+                raise
+        # Nothing has been spliced yet, so copy through a buffer instead.
+        relay.close()
+        relays[i] = _Relay(relay.src, relay.dst, bufsize)
+        return _pump(relays[i])
+    try:
+        for sock in sock_a, sock_b:
+            sock.setblocking(False)
+        relays.append(relay_type(sock_a, sock_b, bufsize))
+        relays.append(relay_type(sock_b, sock_a, bufsize))
+        waiting = [pump(i) for i in xrange(len(relays))]
+        while waiting[0] or waiting[1]:
+            fds = []
+            for relay, event in zip(relays, waiting):
+                if event == READ:
+                    fds.append((relay.src, READ))
+                elif event == WRITE:
+                    fds.append((relay.dst, WRITE))
+            for sock, events in hub.poll_many(fds, timeout=timeout):
+                for i, relay in enumerate(relays):
+                    if ((waiting[i] == READ and relay.src is sock and
+                         events & READ) or
+                        (waiting[i] == WRITE and relay.dst is sock and
+                         events & WRITE)):
+                        waiting[i] = pump(i)
+    finally:
+        for relay in relays:
+            relay.close()
+        for sock, sock_timeout in timeouts:
+            sock.settimeout(sock_timeout)
+    return relays[0].count, relays[1].count
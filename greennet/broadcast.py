@@ -0,0 +1,244 @@
+"""Publish/subscribe broadcast channels."""
+
+
+from greennet import get_hub
+from greennet.sync import Waiters
+
+
+# What happens when a subscriber falls a whole buffer behind.
+DROP = 'drop'               # it skips to the oldest message still buffered
+DISCONNECT = 'disconnect'   # it is unsubscribed, and Disconnected raised
+BLOCK = 'block'             # publishers wait for it to catch up
+POLICIES = (DROP, DISCONNECT, BLOCK)
+
+
+class Closed(Exception):
+    """The channel or the subscriber is closed, with nothing left to read."""
+    pass
+
+
+class Disconnected(Exception):
+    """The subscriber fell too far behind, and was unsubscribed."""
+    pass
+
+
+class Broadcast(object):
+    
+    """A channel delivering every published message to every subscriber.
+    
+    Messages are kept once, in a ring buffer of capacity slots shared by
+    all the subscribers, each of which reads from its own cursor. Publishing
+    wakes all the waiting subscribers in one batch, and a woken subscriber
+    reads everything published meanwhile in one go (see
+    Subscriber.recv_many).
+    
+    A subscriber that falls capacity messages behind is handled according
+    to the policy: with DROP, it loses the oldest messages, counted in its
+    dropped attribute; with DISCONNECT, it is unsubscribed when it next
+    reads; with BLOCK, publishers wait until it has caught up.
+    
+    >>> channel = Broadcast(2)
+    >>> a, b = channel.subscribe(), channel.subscribe()
+    >>> channel.publish_many(['one', 'two', 'three'])
+    >>> a.recv_many(), a.dropped
+    (['two', 'three'], 1)
+    >>> channel.close()
+    >>> list(b)
+    ['two', 'three']
+    """
+    
+    def __init__(self, capacity, policy=DROP, hub=None):
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+        if policy not in POLICIES:
+            raise ValueError('unknown policy %r' % (policy,))
+        self.hub = get_hub() if hub is None else hub
+        self.capacity = capacity
+        self.policy = policy
+        self.closed = False
+        self._buffer = [None] * capacity
+        self._head = 0          # sequence number of the next message
+        self._subscribers = 0
+        # Only BLOCK needs to know where the slowest subscriber is.
+        self._cursors = {} if policy == BLOCK else None
+        self._tail = 0          # the lowest cursor, if there are any
+        self._readers = Waiters(self.hub)
+        self._writers = Waiters(self.hub)
+    
+    def __len__(self):
+        """Number of subscribers."""
+        return self._subscribers
+    
+    def subscribe(self):
+        """Return a new Subscriber, which will receive the messages
+        published from now on.
+        """
+        if self.closed:
+            raise Closed()
+        return Subscriber(self)
+    
+    def publish(self, message, timeout=None):
+        """Publish a message to all the subscribers."""
+        self.publish_many((message,), timeout)
+    
+    def publish_many(self, messages, timeout=None):
+        """Publish several messages, waking the waiting subscribers once.
+        
+        With the BLOCK policy, the current task is suspended while the
+        slowest subscriber is a whole buffer behind; Timeout is raised if
+        that lasts more than timeout seconds, after the messages before it
+        were published.
+        """
+        if self.closed:
+            raise Closed()
+        buffer = self._buffer
+        capacity = self.capacity
+        block = self.policy == BLOCK
+        expires = None
+        try:
+            for message in messages:
+                if block and self._backlog() >= capacity:
+                    if expires is None:
+                        expires = self.hub._expires(timeout)
+                    self._readers.wake_all()
+                    while self._backlog() >= capacity:
+                        self._writers.wait(expires)
+                        if self.closed:
+                            raise Closed()
+                buffer[self._head % capacity] = message
+                self._head += 1
+        finally:
+            self._readers.wake_all()
+    
+    def close(self):
+        """Close the channel; subscribers can read what was published
+        before Closed is raised.
+        """
+        self.closed = True
+        self._readers.wake_all()
+        self._writers.wake_all()
+    
+    def _backlog(self):
+        """Number of messages the slowest subscriber has yet to read."""
+        if not self._cursors:
+            return 0
+        return self._head - self._tail
+    
+    def _add_cursor(self, cursor):
+        cursors = self._cursors
+        if not cursors or cursor < self._tail:
+            self._tail = cursor
+        cursors[cursor] = cursors.get(cursor, 0) + 1
+    
+    def _remove_cursor(self, cursor):
+        cursors = self._cursors
+        count = cursors[cursor] - 1
+        if count:
+            cursors[cursor] = count
+            return
+        del cursors[cursor]
+        if cursor == self._tail:
+            # Cursors only move forward, so the slowest is found by
+            # stepping forward to the next one.
+            if cursors:
+                tail = cursor + 1
+                while tail not in cursors:
+                    tail += 1
+                self._tail = tail
+            if len(self._writers):
+                self._writers.wake_all()
+
+
+class Subscriber(object):
+    
+    """A reader of a Broadcast channel (see Broadcast.subscribe)."""
+    
+    def __init__(self, channel):
+        self.channel = channel
+        self.cursor = channel._head
+        self.dropped = 0
+        self.closed = False
+        channel._subscribers += 1
+        if channel._cursors is not None:
+            channel._add_cursor(self.cursor)
+    
+    def __len__(self):
+        """Number of messages waiting to be read."""
+        if self.closed:
+            return 0
+        return min(self.channel._head - self.cursor, self.channel.capacity)
+    
+    def __iter__(self):
+        """Iterate over the messages until the channel is closed."""
+        while True:
+            try:
+                messages = self.recv_many()
+            except Closed:
+                return
+            for message in messages:
+                yield message
+    
+    def recv(self, timeout=None):
+        """Return the next message, suspending the current task until there
+        is one.
+        """
+        return self.recv_many(1, timeout)[0]
+    
+    def recv_many(self, limit=None, timeout=None):
+        """Return the next messages (at most limit of them), suspending the
+        current task until there is at least one.
+        
+        Raises Closed once the channel is closed and every message has been
+        read, or the subscriber is closed. With the DISCONNECT policy, a
+        subscriber a whole buffer behind is closed, and Disconnected raised.
+        """
+        if self.closed:
+            raise Closed()
+        channel = self.channel
+        if channel._head == self.cursor:
+            if channel.closed:
+                raise Closed()
+            expires = channel.hub._expires(timeout)
+            while channel._head == self.cursor:
+                channel._readers.wait(expires)
+                if channel.closed or self.closed:
+                    break
+            if self.closed or channel._head == self.cursor:
+                raise Closed()
+        cursor = self.cursor
+        head = channel._head
+        capacity = channel.capacity
+        if head - cursor > capacity:
+            if channel.policy == DISCONNECT:
+                self.close()
+                raise Disconnected()
+            self.dropped += head - capacity - cursor
+            cursor = head - capacity
+        end = head if limit is None else min(head, cursor + limit)
+        buffer = channel._buffer
+        start = cursor % capacity
+        stop = start + end - cursor
+        if stop <= capacity:
+            messages = buffer[start:stop]
+        else:
+            messages = buffer[start:] + buffer[:stop - capacity]
+        if channel._cursors is not None:
+            # Adding the new cursor first bounds the search for the slowest.
+            channel._add_cursor(end)
+            channel._remove_cursor(self.cursor)
+        self.cursor = end
+        return messages
+    
+    def close(self):
+        """Unsubscribe from the channel."""
+        if not self.closed:
+            self.closed = True
+            channel = self.channel
+            channel._subscribers -= 1
+            if channel._cursors is not None:
+                channel._remove_cursor(self.cursor)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,613 @@
+"""Non-blocking DNS resolution with a cache."""
+
+
+from __future__ import with_statement
+import errno
+import heapq
+import random
+import socket
+import struct
+import weakref
+
+import greennet
+from greennet import greenlet
+from greennet.hub import Wait, Timeout
+
+
+QTYPES = {socket.AF_INET: 1, socket.AF_INET6: 28}
+FAMILIES = dict((qtype, family) for family, qtype in QTYPES.iteritems())
+TYPE_CNAME = 5
+TYPE_SOA = 6
+CLASS_IN = 1
+RCODE_NOERROR = 0
+RCODE_NXDOMAIN = 3
+FLAG_TC = 0x0200
+MAX_UDP_SIZE = 512
+MAX_NDOTS = 15
+
+# Query IDs must not be predictable, or answers are easier to forge.
+_random = random.SystemRandom()
+
+
+class DNSError(socket.gaierror):
+    """Name resolution failed."""
+    pass
+
+
+class Truncated(ValueError):
+    """The response did not fit in a datagram; retry the query over TCP."""
+    pass
+
+
+def _no_name(name):
+    return DNSError(socket.EAI_NONAME, 'Name or service not known: %r' % name)
+
+
+def is_address(host, family=socket.AF_INET):
+    """Return True if host needs no resolving in the given address family.
+    
+    >>> is_address('127.0.0.1')
+    True
+    >>> is_address('::1', socket.AF_INET6)
+    True
+    >>> is_address('localhost')
+    False
+    """
+    if host in ('', '<broadcast>'):
+        return True
+    try:
+        socket.inet_pton(family, host)
+    except (socket.error, ValueError):
+        return False
+    return True
+
+
+def _sockaddr(family, ip, port):
+    if family == socket.AF_INET6:
+        return (ip, port, 0, 0)
+    return (ip, port)
+
+
+def read_resolv_conf(path='/etc/resolv.conf'):
+    """Return the nameserver addresses listed in a resolv.conf file."""
+    nameservers = []
+    try:
+        f = open(path)
+    except IOError:
+        return [('127.0.0.1', 53)]
+    try:
+        for line in f:
+            fields = line.split()
+            if len(fields) >= 2 and fields[0] == 'nameserver':
+                nameservers.append((fields[1], 53))
+    finally:
+        f.close()
+    return nameservers or [('127.0.0.1', 53)]
+
+
+def read_search_list(path='/etc/resolv.conf'):
+    """Return the (search, ndots) settings of a resolv.conf file.
+    
+    search is the list of domains that names with fewer than ndots dots are
+    tried in first, as the C library does. Without a search or domain line,
+    it is the domain of the host name, if it has one.
+    """
+    search = None
+    ndots = 1
+    try:
+        f = open(path)
+    except IOError:
+        f = None
+    if f is not None:
+        try:
+            for line in f:
+                fields = line.split()
+                if not fields:
+                    continue
+                if fields[0] == 'search':
+                    search = [domain.rstrip('.').lower()
+                              for domain in fields[1:]]
+                elif fields[0] == 'domain' and len(fields) >= 2:
+                    search = [fields[1].rstrip('.').lower()]
+                elif fields[0] == 'options':
+                    for option in fields[1:]:
+                        if option.startswith('ndots:'):
+                            try:
+                                ndots = min(int(option[6:]), MAX_NDOTS)
+                            except ValueError:
+                                pass
+        finally:
+            f.close()
+    if search is None:
+        hostname = socket.gethostname()
+        if '.' in hostname:
+            search = [hostname.split('.', 1)[1].lower()]
+        else:
+            search = []
+    return [domain for domain in search if domain], ndots
+
+
+def read_hosts(path='/etc/hosts'):
+    """Return a dict mapping (name, family) to addresses from a hosts file."""
+    hosts = {}
+    try:
+        f = open(path)
+    except IOError:
+        return hosts
+    try:
+        for line in f:
+            fields = line.split('#', 1)[0].split()
+            if len(fields) < 2:
+                continue
+            ip = fields[0]
+            if is_address(ip, socket.AF_INET):
+                family = socket.AF_INET
+            elif is_address(ip, socket.AF_INET6):
+                family = socket.AF_INET6
+            else:
+                continue
+            for name in fields[1:]:
+                hosts.setdefault((name.lower(), family), []).append(ip)
+    finally:
+        f.close()
+    return hosts
+
+
+def build_query(ident, name, qtype):
+    """Encode a recursive query for name.
+    
+    >>> build_query(0x1234, 'a.bc', 1)
+    '\\x124\\x01\\x00\\x00\\x01\\x00\\x00\\x00\\x00\\x00\\x00\\x01a\\x02bc\\x00\\x00\\x01\\x00\\x01'
+    """
+    labels = name.split('.')
+    if len(name) > 253 or not all(0 < len(label) < 64 for label in labels):
+        raise _no_name(name)
+    return (struct.pack('!HHHHHH', ident, 0x0100, 1, 0, 0, 0) +
+            ''.join(chr(len(label)) + label for label in labels) + '\0' +
+            struct.pack('!HH', qtype, CLASS_IN))
+
+
+def _read_name(data, offset):
+    """Decode a possibly compressed name; return it and the offset after it."""
+    labels = []
+    end = None
+    for jumps in xrange(128):
+        length = ord(data[offset])
+        if length >= 0xc0:
+            if end is None:
+                end = offset + 2
+            offset = struct.unpack('!H', data[offset:offset + 2])[0] & 0x3fff
+        elif length:
+            labels.append(data[offset + 1:offset + 1 + length])
+            offset += 1 + length
+        else:
+            if end is None:
+                end = offset + 1
+            return '.'.join(labels).lower(), end
+    raise ValueError('name compression loop')
+
+
+def _read_record(data, offset):
+    name, offset = _read_name(data, offset)
+    rtype, rclass, ttl, length = struct.unpack('!HHIH',
+                                               data[offset:offset + 10])
+    offset += 10
+    rdata = data[offset:offset + length]
+    if len(rdata) != length:
+        raise ValueError('truncated record')
+    return name, rtype, rclass, ttl, rdata, offset + length
+
+
+def parse_response(data, ident, name, qtype):
+    """Decode the response to a query built by build_query.
+    
+    Returns (rcode, addresses, ttl). For a positive answer, ttl is the
+    smallest TTL along the CNAME chain; for a negative one it comes from the
+    SOA record if the server sent one, else it is None. Raises ValueError if
+    data is not a well-formed response to the query, and Truncated if it is
+    one the server had to truncate.
+    """
+    try:
+        (rident, flags, qdcount, ancount, nscount,
+         arcount) = struct.unpack('!HHHHHH', data[:12])
+        if rident != ident or not flags & 0x8000 or qdcount != 1:
+            raise ValueError('not a response to the query')
+        qname, offset = _read_name(data, 12)
+        if qname != name.lower() or data[offset:offset + 4] != \
+                struct.pack('!HH', qtype, CLASS_IN):
+            raise ValueError('not a response to the query')
+        if flags & FLAG_TC:
+            raise Truncated('truncated response')
+        offset += 4
+        family = FAMILIES[qtype]
+        names = set([qname])
+        addresses = []
+        ttl = None
+        for i in xrange(ancount):
+            (owner, rtype, rclass, rttl, rdata,
+             offset) = _read_record(data, offset)
+            if rclass != CLASS_IN or owner not in names:
+                continue
+            if rtype == TYPE_CNAME:
+                names.add(_read_name(data, offset - len(rdata))[0])
+            elif rtype == qtype:
+                addresses.append(socket.inet_ntop(family, rdata))
+            else:
+                continue
+            ttl = rttl if ttl is None else min(ttl, rttl)
+        if not addresses:
+            ttl = None
+            for i in xrange(nscount):
+                (owner, rtype, rclass, rttl, rdata,
+                 offset) = _read_record(data, offset)
+                if rtype == TYPE_SOA:
+                    minimum = struct.unpack('!I', rdata[-4:])[0]
+                    ttl = min(rttl, minimum)
+        return flags & 0xf, addresses, ttl
+    except (struct.error, IndexError, socket.error), err:
+        raise ValueError('malformed response: %s' % (err,))
+
+
+class LookupWait(Wait):
+    
+    """Wait for a Lookup to complete."""
+    
+    __slots__ = ('lookup',)
+    
+    def __init__(self, task, lookup, expires):
+        super(LookupWait, self).__init__(task, expires)
+        self.lookup = lookup
+    
+    def _unlink(self):
+        # Waits compare by expiry, so find this one by identity.
+        waits = self.lookup.waits
+        for i, wait in enumerate(waits):
+            if wait is self:
+                del waits[i]
+                break
+    
+    def timeout(self):
+        self._unlink()
+        super(LookupWait, self).timeout()
+    
+    def cancel(self, hub):
+        self._unlink()
+        super(LookupWait, self).cancel(hub)
+
+
+class Lookup(object):
+    
+    """A query in progress, shared by all tasks resolving the same name."""
+    
+    __slots__ = ('addresses', 'error', 'waits')
+    
+    def __init__(self):
+        self.addresses = None
+        self.error = None
+        self.waits = []
+    
+    def wait(self, hub, timeout):
+        """Suspend the current task until the query completes."""
+        wait = LookupWait(greenlet.getcurrent(), self, hub._expires(timeout))
+        self.waits.append(wait)
+        hub._suspend(wait)
+        if self.error is not None:
+            raise self.error
+        return self.addresses
+    
+    def finish(self, hub, addresses, error):
+        """Record the result, and wake all the waiting tasks."""
+        self.addresses = addresses
+        self.error = error
+        waits, self.waits = self.waits, []
+        for wait in waits:
+            hub._wake(wait)
+
+
+class Resolver(object):
+    
+    """A caching stub resolver that queries nameservers over UDP.
+    
+    Queries are sent from a separate task and their responses awaited with
+    Hub.poll, so resolving never blocks the Hub. Tasks resolving a name that
+    is already being queried wait for that query instead of sending another.
+    
+    Answers are cached for their TTL, clamped to [min_ttl, max_ttl].
+    Names that do not exist (or have no address of the requested family) are
+    cached for the TTL given by the server's SOA record, or negative_ttl if
+    it sent none. Each nameserver is tried in turn, tries times, waiting
+    timeout seconds for each; a truncated answer is asked for again over TCP.
+    
+    Names are completed with the domains in search the way the C library
+    does: a name with at least ndots dots is tried as given first, a shorter
+    one after the search domains, and one ending in a dot only as given.
+    
+    nameservers, search and ndots default to the settings in
+    /etc/resolv.conf, and hosts (a dict as returned by read_hosts) to the
+    contents of /etc/hosts.
+    """
+    
+    def __init__(self, nameservers=None, hosts=None, timeout=2.0, tries=2,
+                 min_ttl=0, max_ttl=3600, negative_ttl=30, max_entries=10000,
+                 search=None, ndots=None, hub=None):
+        self.hub = greennet.get_hub() if hub is None else hub
+        if nameservers is None:
+            nameservers = read_resolv_conf()
+        self.nameservers = list(nameservers)
+        if search is None or ndots is None:
+            conf_search, conf_ndots = read_search_list()
+            if search is None:
+                search = conf_search
+            if ndots is None:
+                ndots = conf_ndots
+        self.search = list(search)
+        self.ndots = ndots
+        self.hosts = read_hosts() if hosts is None else hosts
+        self.timeout = timeout
+        self.tries = tries
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.cache = {}
+        self._expiries = []     # heap of (expires, key); may hold stale items
+        self._lookups = {}
+    
+    def resolve(self, host, port, timeout=None, family=socket.AF_INET):
+        """Return a list of socket addresses for host and port.
+        
+        Raises DNSError if the name cannot be resolved, and Timeout if that
+        takes longer than timeout seconds.
+        """
+        if isinstance(host, unicode):
+            host = host.encode('idna')
+        if is_address(host, family):
+            return [_sockaddr(family, host, port)]
+        name = host.lower()
+        addresses = self.hosts.get((name.rstrip('.'), family))
+        if addresses is None:
+            failure = None
+            with self.hub.deadline(timeout):
+                for candidate in self._search_names(name):
+                    try:
+                        addresses = self._lookup((candidate, family))
+                    except DNSError, err:
+                        # Report a temporary failure over a missing name,
+                        # as the name might have been found.
+                        if failure is None or err.args[0] != socket.EAI_NONAME:
+                            failure = err
+                        continue
+                    break
+            if addresses is None:
+                if failure.args[0] == socket.EAI_NONAME:
+                    raise _no_name(host)
+                raise failure
+        return [_sockaddr(family, ip, port) for ip in addresses]
+    
+    def _search_names(self, name):
+        """Return the names to try for name, completed with the search list.
+        
+        >>> r = Resolver([], {}, search=['corp', 'example.com'], ndots=1)
+        >>> r._search_names('db')
+        ['db.corp', 'db.example.com', 'db']
+        >>> r._search_names('redis.svc')
+        ['redis.svc', 'redis.svc.corp', 'redis.svc.example.com']
+        >>> r._search_names('db.')
+        ['db']
+        """
+        if name.endswith('.'):
+            return [name.rstrip('.')]
+        names = ['%s.%s' % (name, domain) for domain in self.search]
+        if name.count('.') >= self.ndots:
+            names.insert(0, name)
+        else:
+            names.append(name)
+        return names
+    
+    def _lookup(self, key):
+        """Return the addresses for key, from the cache or a query.
+        
+        Raises DNSError if the name cannot be resolved.
+        """
+        addresses = self._cached(key)
+        if addresses is None:
+            lookup = self._lookups.get(key)
+            if lookup is None:
+                lookup = self._lookups[key] = Lookup()
+                self.hub.schedule(greenlet(self._query), key, lookup)
+            addresses = lookup.wait(self.hub, None)
+        return addresses
+    
+    def _cached(self, key):
+        """Return the cached addresses for key, or None if not cached."""
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        expires, addresses, error = entry
+        if expires <= self.hub.time():
+            del self.cache[key]
+            return None
+        if error is not None:
+            raise error
+        return addresses
+    
+    def _store(self, key, ttl, addresses, error):
+        if ttl <= 0:
+            return
+        if key not in self.cache and len(self.cache) >= self.max_entries:
+            self._evict()
+        expires = self.hub.time() + ttl
+        self.cache[key] = (expires, addresses, error)
+        expiries = self._expiries
+        heapq.heappush(expiries, (expires, key))
+        if len(expiries) > 2 * self.max_entries:
+            # Drop the items left behind by entries replaced or expired.
+            expiries[:] = [(entry[0], k)
+                           for k, entry in self.cache.iteritems()]
+            heapq.heapify(expiries)
+    
+    def _evict(self):
+        """Drop the cache entry that expires first."""
+        expiries = self._expiries
+        while expiries:
+            expires, key = heapq.heappop(expiries)
+            entry = self.cache.get(key)
+            if entry is not None and entry[0] == expires:
+                del self.cache[key]
+                return
+    
+    def _query(self, key, lookup):
+        """Resolve key, then cache the result and pass it to the waiters."""
+        name, family = key
+        addresses = error = None
+        try:
+            try:
+                addresses, ttl = self._query_nameservers(name, QTYPES[family])
+                if addresses:
+                    ttl = max(self.min_ttl, min(self.max_ttl, ttl))
+                    self._store(key, ttl, addresses, None)
+                else:
+                    error = _no_name(name)
+                    self._store(key, ttl, None, error)
+            except DNSError, error:
+                pass
+            except EnvironmentError, err:
+                error = DNSError(socket.EAI_AGAIN, str(err))
+        finally:
+            del self._lookups[key]
+            if addresses is None and error is None:
+                # This task was killed (see Hub.throw); the tasks sharing
+                # the lookup must not be left with no result.
+                error = DNSError(socket.EAI_AGAIN,
+                                 'Lookup of %r was interrupted' % name)
+            lookup.finish(self.hub, addresses, error)
+    
+    def _query_nameservers(self, name, qtype):
+        """Return (addresses, ttl); addresses is empty if the name is unknown.
+        
+        Raises DNSError if no nameserver answers.
+        """
+        for attempt in xrange(self.tries):
+            for server in self.nameservers:
+                response = self._query_nameserver(server, name, qtype)
+                if response is None:
+                    continue
+                rcode, addresses, ttl = response
+                if rcode == RCODE_NOERROR and addresses:
+                    return addresses, ttl
+                if rcode in (RCODE_NOERROR, RCODE_NXDOMAIN):
+                    if ttl is None:
+                        ttl = self.negative_ttl
+                    return [], ttl
+        raise DNSError(socket.EAI_AGAIN,
+                       'Temporary failure in name resolution: %r' % name)
+    
+    def _query_nameserver(self, server, name, qtype):
+        """Send one query; return the parsed response, or None on timeout."""
+        ident = _random.randrange(0x10000)
+        query = build_query(ident, name, qtype)
+        if is_address(server[0], socket.AF_INET6):
+            sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setblocking(False)
+            try:
+                sock.sendto(query, server)
+            except socket.error:
+                return None
+            try:
+                with self.hub.deadline(self.timeout):
+                    while True:
+                        self.hub.poll(sock, read=True)
+                        try:
+                            data, addr = sock.recvfrom(MAX_UDP_SIZE)
+                        except socket.error:
+                            continue
+                        if addr[:2] != server[:2]:
+                            continue
+                        try:
+                            return parse_response(data, ident, name, qtype)
+                        except Truncated:
+                            break
+                        except ValueError:
+                            continue
+            except Timeout:
+                return None
+        finally:
+            sock.close()
+        return self._query_nameserver_tcp(server, name, qtype)
+    
+    def _query_nameserver_tcp(self, server, name, qtype):
+        """Send one query over TCP; return the parsed response, or None on
+        timeout or error.
+        """
+        ident = _random.randrange(0x10000)
+        query = build_query(ident, name, qtype)
+        if is_address(server[0], socket.AF_INET6):
+            sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.setblocking(False)
+            try:
+                with self.hub.deadline(self.timeout):
+                    err = sock.connect_ex(server)
+                    if err in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                        self.hub.poll(sock, write=True)
+                        err = sock.getsockopt(socket.SOL_SOCKET,
+                                              socket.SO_ERROR)
+                    if err:
+                        return None
+                    data = struct.pack('!H', len(query)) + query
+                    while data:
+                        self.hub.poll(sock, write=True)
+                        data = data[sock.send(data):]
+                    length = struct.unpack('!H', self._recv_tcp(sock, 2))[0]
+                    data = self._recv_tcp(sock, length)
+            except (Timeout, socket.error, EOFError):
+                return None
+            try:
+                return parse_response(data, ident, name, qtype)
+            except ValueError:
+                return None
+        finally:
+            sock.close()
+    
+    def _recv_tcp(self, sock, n):
+        """Receive exactly n bytes; raises EOFError if the server hangs up."""
+        chunks = []
+        while n:
+            self.hub.poll(sock, read=True)
+            data = sock.recv(n)
+            if not data:
+                raise EOFError()
+            chunks.append(data)
+            n -= len(data)
+        return ''.join(chunks)
+
+
+_resolvers = weakref.WeakKeyDictionary()
+
+
+def get_resolver(hub=None):
+    """Return the Resolver used with hub (by default, the current Hub)."""
+    if hub is None:
+        hub = greennet.get_hub()
+    resolver = _resolvers.get(hub)
+    if resolver is None:
+        resolver = _resolvers[hub] = Resolver(hub=hub)
+    return resolver
+
+
+def set_resolver(resolver):
+    """Make resolver the Resolver used with its Hub."""
+    _resolvers[resolver.hub] = resolver
+
+
+def resolve(host, port, timeout=None, family=socket.AF_INET):
+    """Return a list of socket addresses for host and port.
+    
+    Uses the current Hub's Resolver; see Resolver.resolve.
+    """
+    return get_resolver().resolve(host, port, timeout, family)
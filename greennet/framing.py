@@ -0,0 +1,334 @@
+"""Message framing: length-prefixed and delimited codecs."""
+
+from __future__ import with_statement
+
+import struct
+
+import greennet
+from greennet import ConnectionLost
+
+
+MAX_FRAME_SIZE = 1 << 20
+
+
+class FrameError(ValueError):
+    """A frame was malformed or larger than the codec allows."""
+    pass
+
+
+class Codec(object):
+    
+    """Base class for framing codecs.
+    
+    decode() takes buffered data and returns every complete frame in it at
+    once, so a single read can yield a batch of messages. encode() returns
+    a list of strings for one frame, ready for sendall_many or a
+    WriteBuffer.
+    """
+    
+    # How many bytes received before a chunk may_complete() needs to see.
+    overlap = 0
+    
+    def __init__(self, max_size=MAX_FRAME_SIZE):
+        self.max_size = max_size
+    
+    def decode(self, data):
+        """Decode all the complete frames at the start of data.
+        
+        Returns (frames, pos, need): data[pos:] is an incomplete frame, and
+        no more frames can be decoded until it is at least need bytes long.
+        Raises FrameError if a frame is larger than max_size.
+        """
+        raise NotImplementedError()
+    
+    def may_complete(self, chunk, tail, size):
+        """Return whether a frame may end within a newly received chunk.
+        
+        tail is the end of the data received before chunk (its last overlap
+        bytes), and size the length of the incomplete frame, chunk
+        included. A reader only decodes once this is true, so codecs that
+        can tell cheaply spare it rejoining and decoding a long frame every
+        time a piece arrives. Raises FrameError if the frame is already too
+        large.
+        """
+        return True
+    
+    def encode(self, frame):
+        """Return a list of strings making up the encoded frame."""
+        raise NotImplementedError()
+    
+    def encode_many(self, frames):
+        """Return a list of strings making up all the encoded frames."""
+        bufs = []
+        for frame in frames:
+            bufs.extend(self.encode(frame))
+        return bufs
+    
+    def _check(self, size):
+        if size > self.max_size:
+            raise FrameError('frame of %d bytes exceeds the limit of %d' %
+                             (size, self.max_size))
+
+
+class LengthPrefixCodec(Codec):
+    
+    """Frames preceded by their length, as a fixed-size integer.
+    
+    The prefix is a struct format: '!H' (u16) or '!I' (u32, the default).
+    
+    >>> codec = LengthPrefixCodec('!H')
+    >>> data = ''.join(codec.encode_many(['spam', 'eggs']))
+    >>> data
+    '\\x00\\x04spam\\x00\\x04eggs'
+    >>> codec.decode(data + '\\x00\\x05ha')
+    (['spam', 'eggs'], 12, 7)
+    """
+    
+    def __init__(self, fmt='!I', max_size=MAX_FRAME_SIZE):
+        prefix = struct.Struct(fmt)
+        max_size = min(max_size, (1 << (8 * prefix.size)) - 1)
+        super(LengthPrefixCodec, self).__init__(max_size)
+        self._prefix = prefix
+    
+    def decode(self, data):
+        unpack_from = self._prefix.unpack_from
+        header = self._prefix.size
+        max_size = self.max_size
+        frames = []
+        pos = 0
+        size = len(data)
+        while size - pos >= header:
+            length = unpack_from(data, pos)[0]
+            if length > max_size:
+                self._check(length)
+            end = pos + header + length
+            if end > size:
+                return frames, pos, end - pos
+            frames.append(data[pos + header:end])
+            pos = end
+        return frames, pos, header
+    
+    def encode(self, frame):
+        self._check(len(frame))
+        return [self._prefix.pack(len(frame)), frame]
+
+
+def encode_varint(n):
+    """Encode a non-negative integer as a base-128 varint.
+    
+    >>> encode_varint(1), encode_varint(300)
+    ('\\x01', '\\xac\\x02')
+    """
+    out = []
+    while n > 0x7f:
+        out.append(chr(n & 0x7f | 0x80))
+        n >>= 7
+    out.append(chr(n))
+    return ''.join(out)
+
+
+def decode_varint(data, pos=0):
+    """Decode a varint from data at pos.
+    
+    Returns (value, end), or (None, pos) if the varint is incomplete.
+    
+    >>> decode_varint('\\xac\\x02x')
+    (300, 2)
+    >>> decode_varint('\\xac')
+    (None, 0)
+    """
+    value = 0
+    shift = 0
+    for i in xrange(pos, min(len(data), pos + 10)):
+        byte = ord(data[i])
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, i + 1
+        shift += 7
+    if len(data) - pos >= 10:
+        raise FrameError('varint too long')
+    return None, pos
+
+
+class VarintCodec(Codec):
+    
+    """Frames preceded by their length, as a base-128 varint.
+    
+    >>> codec = VarintCodec()
+    >>> data = ''.join(codec.encode_many(['spam', 'x' * 200]))
+    >>> frames, pos, need = codec.decode(data)
+    >>> [len(frame) for frame in frames], pos == len(data), need
+    ([4, 200], True, 1)
+    """
+    
+    def decode(self, data):
+        max_size = self.max_size
+        frames = []
+        pos = 0
+        size = len(data)
+        while pos < size:
+            length, start = decode_varint(data, pos)
+            if length is None:
+                return frames, pos, size - pos + 1
+            if length > max_size:
+                self._check(length)
+            end = start + length
+            if end > size:
+                return frames, pos, end - pos
+            frames.append(data[start:end])
+            pos = end
+        return frames, pos, 1
+    
+    def encode(self, frame):
+        self._check(len(frame))
+        return [encode_varint(len(frame)), frame]
+
+
+class DelimitedCodec(Codec):
+    
+    """Frames followed by a delimiter, which is not part of the frame.
+    
+    >>> codec = DelimitedCodec('\\r\\n')
+    >>> codec.decode('PING\\r\\nPING\\r\\nPI')
+    (['PING', 'PING'], 12, 3)
+    >>> DelimitedCodec('\\n', max_size=4).decode('PING\\nPINGPONG')
+    Traceback (most recent call last):
+        ...
+    FrameError: frame of 8 bytes exceeds the limit of 4
+    """
+    
+    def __init__(self, delimiter='\r\n', max_size=MAX_FRAME_SIZE):
+        if not delimiter:
+            raise ValueError('empty delimiter')
+        super(DelimitedCodec, self).__init__(max_size)
+        self.delimiter = delimiter
+        self.overlap = len(delimiter) - 1
+    
+    def decode(self, data):
+        frames = data.split(self.delimiter)
+        rest = frames.pop()
+        max_size = self.max_size
+        for frame in frames:
+            if len(frame) > max_size:
+                self._check(len(frame))
+        # Without a delimiter, rest can only grow into a frame that is too
+        # big once it is longer than the limit.
+        if len(rest) > max_size:
+            self._check(len(rest))
+        return frames, len(data) - len(rest), len(rest) + 1
+    
+    def may_complete(self, chunk, tail, size):
+        """A frame ends within chunk if a delimiter does.
+        
+        >>> codec = DelimitedCodec('\\r\\n', max_size=8)
+        >>> codec.may_complete('PI', '', 2)
+        False
+        >>> codec.may_complete('\\nPO', 'G\\r', 7)
+        True
+        >>> codec.may_complete('NG', '\\n', 9)
+        Traceback (most recent call last):
+            ...
+        FrameError: frame of 9 bytes exceeds the limit of 8
+        """
+        delimiter = self.delimiter
+        if delimiter in chunk:
+            return True
+        if tail and delimiter in tail + chunk[:self.overlap]:
+            return True
+        # Without a delimiter, the frame is at least size bytes long.
+        if size > self.max_size:
+            self._check(size)
+        return False
+    
+    def encode(self, frame):
+        if self.delimiter in frame:
+            raise FrameError('frame contains the delimiter')
+        self._check(len(frame))
+        return [frame, self.delimiter]
+
+
+class FrameReader(object):
+    
+    """Read batches of frames from a socket.
+    
+    Each call to recv() decodes every frame that is complete in the buffer,
+    so frames that arrive together cost one read and one suspension.
+    Partial frames are kept as a list of chunks, and only joined once
+    there is enough data for the codec to make progress (see
+    Codec.may_complete), so reading a frame takes time linear in its size
+    however many pieces it arrives in.
+    """
+    
+    def __init__(self, sock, codec, bufsize=65536):
+        self.sock = sock
+        self.codec = codec
+        self.bufsize = bufsize
+        self._buf = ''
+        self._chunks = []
+        self._size = 0
+        self._need = 1
+        self._ready = False     # whether a frame may be complete
+        self._tail = ''         # the last codec.overlap bytes received
+    
+    def __iter__(self):
+        """Yield frames until the connection is closed."""
+        while True:
+            frames = self.recv()
+            if not frames:
+                break
+            for frame in frames:
+                yield frame
+    
+    def recv(self, timeout=None):
+        """Return a list of one or more frames.
+        
+        Returns an empty list if the connection is closed between frames,
+        and raises ConnectionLost if it is closed in the middle of one.
+        """
+        if greennet.ssl and isinstance(self.sock, greennet.ssl.peekable):
+            _recv = greennet.ssl.recv
+        else:
+            _recv = greennet.recv
+        codec = self.codec
+        overlap = codec.overlap
+        with greennet.deadline(timeout):
+            while True:
+                if self._ready and self._size >= self._need:
+                    if self._chunks:
+                        self._chunks.insert(0, self._buf)
+                        self._buf = ''.join(self._chunks)
+                        self._chunks = []
+                    frames, pos, self._need = codec.decode(self._buf)
+                    # Every complete frame has been decoded.
+                    self._ready = False
+                    if pos:
+                        self._buf = self._buf[pos:]
+                        self._size = len(self._buf)
+                        if overlap:
+                            self._tail = self._buf[-overlap:]
+                    if frames:
+                        return frames
+                data = _recv(self.sock, self.bufsize)
+                if not data:
+                    if self._size:
+                        raise ConnectionLost()
+                    return []
+                self._chunks.append(data)
+                self._size += len(data)
+                if not self._ready:
+                    self._ready = codec.may_complete(data, self._tail,
+                                                     self._size)
+                if overlap:
+                    self._tail = (self._tail + data)[-overlap:]
+
+
+def send_frames(sock, codec, frames, timeout=None):
+    """Encode frames and send them all, coalesced into as few sends as
+    possible.
+    """
+    greennet.sendall_many(sock, codec.encode_many(frames), timeout)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
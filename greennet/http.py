@@ -0,0 +1,568 @@
+"""Minimal HTTP/1.1 server for WSGI applications."""
+
+from __future__ import with_statement
+
+import sys
+import time
+import socket
+import urllib
+import logging
+from email.utils import formatdate
+
+import greennet
+from greennet import ConnectionLost, Timeout, Cancelled
+from greennet.writer import WriteBuffer
+
+
+log = logging.getLogger('greennet.http')
+
+MAX_HEADER_SIZE = 65536
+MAX_HEADERS = 100
+IDLE_TIMEOUT = 60.0
+REQUEST_TIMEOUT = 30.0
+# Unread request bodies up to this size are discarded to keep the
+# connection alive; the connection is closed for bigger ones.
+MAX_DRAIN = 1 << 20
+# High watermark of a connection's WriteBuffer: the handler waits for
+# the client to read responses once this much is buffered.
+FLUSH_SIZE = 65536
+
+REASONS = {
+    400: 'Bad Request',
+    431: 'Request Header Fields Too Large',
+    500: 'Internal Server Error',
+    501: 'Not Implemented',
+    505: 'HTTP Version Not Supported',
+}
+
+
+class HTTPError(Exception):
+    
+    """The request cannot be served; args are (status, message)."""
+    
+    def __init__(self, status, message=None):
+        super(HTTPError, self).__init__(status, message or REASONS[status])
+        self.status = status
+
+
+class HeaderTooLarge(HTTPError):
+    def __init__(self):
+        super(HeaderTooLarge, self).__init__(431)
+
+
+class LineTooLong(HTTPError):
+    def __init__(self):
+        super(LineTooLong, self).__init__(400, 'Line Too Long')
+
+
+class Reader(object):
+    
+    """Buffered reads from a socket.
+    
+    Data is received in chunks of up to bufsize bytes, so pipelined
+    requests, and small request bodies, come out of the buffer without
+    further system calls or suspensions.
+    """
+    
+    def __init__(self, sock, bufsize=65536):
+        self.sock = sock
+        self.bufsize = bufsize
+        if greennet.ssl and isinstance(sock, greennet.ssl.peekable):
+            self._recv = greennet.ssl.recv
+        else:
+            self._recv = greennet.recv
+        self._buf = ''
+        self._pos = 0
+    
+    def __len__(self):
+        """Number of bytes received but not yet read."""
+        return len(self._buf) - self._pos
+    
+    def fill(self, timeout=None):
+        """Receive more data into the buffer; return False at EOF."""
+        data = self._recv(self.sock, self.bufsize, timeout=timeout)
+        if not data:
+            return False
+        if self._pos < len(self._buf):
+            self._buf = self._buf[self._pos:] + data
+        else:
+            self._buf = data
+        self._pos = 0
+        return True
+    
+    def read(self, n, timeout=None):
+        """Read up to n bytes, receiving only if the buffer is empty.
+        
+        Returns an empty string at EOF.
+        """
+        if self._pos == len(self._buf) and not self.fill(timeout):
+            return ''
+        pos = self._pos
+        self._pos = min(pos + n, len(self._buf))
+        return self._buf[pos:self._pos]
+    
+    def read_until(self, term, maxlen, exc_type, timeout=None):
+        """Read up to and including term.
+        
+        Raises exc_type if term is not found within maxlen bytes, and
+        ConnectionLost at EOF. The timeout applies to all the receives
+        needed, and no deadline is set up if the data is already buffered.
+        """
+        end = self._buf.find(term, self._pos)
+        if end < 0:
+            with greennet.deadline(timeout):
+                while end < 0:
+                    if len(self) > maxlen:
+                        raise exc_type()
+                    # Only the new data, and a possible partial terminator
+                    # before it, need to be searched.
+                    start = max(len(self) - len(term) + 1, 0)
+                    if not self.fill():
+                        raise ConnectionLost()
+                    end = self._buf.find(term, start)
+        end += len(term)
+        if end - self._pos > maxlen:
+            raise exc_type()
+        pos = self._pos
+        self._pos = end
+        return self._buf[pos:end]
+
+
+class Input(object):
+    
+    """File-like request body, for wsgi.input.
+    
+    Reads are bounded by the Content-Length, or decode the chunked transfer
+    coding. If the client sent "Expect: 100-continue", the interim response
+    is sent on the first read.
+    """
+    
+    def __init__(self, reader, length=None, chunked=False, timeout=None,
+                 expect=None):
+        self.reader = reader
+        self.timeout = timeout
+        self.chunked = chunked
+        self._remaining = 0 if length is None else length
+        self._chunk = 0
+        self._done = not chunked and not self._remaining
+        self._pending = ''
+        self._expect = expect
+    
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = sys.maxint
+        parts = []
+        if self._pending:
+            parts.append(self._pending[:size])
+            self._pending = self._pending[size:]
+            size -= len(parts[0])
+        while size:
+            data = self._read_some(min(size, 65536))
+            if not data:
+                break
+            parts.append(data)
+            size -= len(data)
+        return ''.join(parts)
+    
+    def readline(self, size=-1):
+        if size is None or size < 0:
+            size = sys.maxint
+        parts = []
+        while size:
+            data = self._pending or self._read_some(min(size, 8192))
+            if not data:
+                break
+            end = data.find('\n', 0, size) + 1 or min(len(data), size)
+            parts.append(data[:end])
+            self._pending = data[end:]
+            size -= end
+            if parts[-1].endswith('\n'):
+                break
+        return ''.join(parts)
+    
+    def readlines(self, hint=-1):
+        return list(self)
+    
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+    
+    def drain(self, limit):
+        """Discard the unread body; return False if it exceeds limit.
+        
+        A body the client is waiting to be asked for is never drained.
+        """
+        if self._expect is not None and not self._done:
+            return False
+        limit -= len(self._pending)
+        self._pending = ''
+        while not self._done:
+            data = self._read_some(65536)
+            limit -= len(data)
+            if limit < 0:
+                return False
+        return True
+    
+    def _read_some(self, n):
+        """Read up to n bytes of the body; return '' at the end of it."""
+        if self._done:
+            return ''
+        reader = self.reader
+        if self._expect is not None:
+            self._expect()
+            self._expect = None
+        if not self.chunked:
+            data = reader.read(min(n, self._remaining), self.timeout)
+            if not data:
+                raise ConnectionLost()
+            self._remaining -= len(data)
+            self._done = not self._remaining
+            return data
+        if not self._chunk:
+            line = reader.read_until('\r\n', 1024, LineTooLong, self.timeout)
+            try:
+                self._chunk = int(line.split(';', 1)[0], 16)
+            except ValueError:
+                raise HTTPError(400, 'Bad Chunk Size')
+            if self._chunk < 0:
+                raise HTTPError(400, 'Bad Chunk Size')
+            if not self._chunk:
+                # Skip the trailer.
+                while reader.read_until('\r\n', MAX_HEADER_SIZE, LineTooLong,
+                                        self.timeout) != '\r\n':
+                    pass
+                self._done = True
+                return ''
+        data = reader.read(min(n, self._chunk), self.timeout)
+        if not data:
+            raise ConnectionLost()
+        self._chunk -= len(data)
+        if not self._chunk:
+            if reader.read_until('\r\n', 2, LineTooLong,
+                                 self.timeout) != '\r\n':
+                raise HTTPError(400, 'Bad Chunk')
+        return data
+
+
+_date = [None, None]
+
+
+def http_date():
+    """Return the current time formatted for the Date header, cached for
+    the current second.
+    """
+    now = int(time.time())
+    if _date[0] != now:
+        _date[:] = [now, formatdate(now, usegmt=True)]
+    return _date[1]
+
+
+class Request(object):
+    
+    """A request in progress, and the WSGI start_response/write pair."""
+    
+    def __init__(self, writer, environ, version, keep_alive):
+        self.writer = writer
+        self.environ = environ
+        self.version = version
+        self.keep_alive = keep_alive
+        self.status = None
+        self.headers = None
+        self.headers_sent = False
+        self.chunked = False
+        self.body = environ['REQUEST_METHOD'] != 'HEAD'
+        self.length = None
+        self.sent = 0
+    
+    def start_response(self, status, headers, exc_info=None):
+        if exc_info:
+            try:
+                if self.headers_sent:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+            finally:
+                exc_info = None
+        elif self.status is not None:
+            raise AssertionError('start_response called twice')
+        self.status = status
+        self.headers = headers
+        return self.write
+    
+    def send_headers(self, length=None):
+        """Send the status line and headers, choosing how the end of the
+        body is marked: by Content-Length (given here, if the application
+        did not set one), chunked coding, or closing the connection.
+        """
+        if self.status is None:
+            raise AssertionError('write before start_response')
+        code = int(self.status[:3])
+        lines = ['%s %s\r\n' % (self.version, self.status)]
+        has_date = False
+        for name, value in self.headers:
+            key = name.lower()
+            if key == 'content-length':
+                self.length = int(value)
+            elif key == 'connection' and value.lower() == 'close':
+                self.keep_alive = False
+            elif key == 'date':
+                has_date = True
+            lines.append('%s: %s\r\n' % (name, value))
+        if not has_date:
+            lines.append('Date: %s\r\n' % (http_date(),))
+        if code < 200 or code in (204, 304):
+            self.body = False
+        elif self.length is None and self.body:
+            if length is not None:
+                self.length = length
+                lines.append('Content-Length: %d\r\n' % (length,))
+            elif self.version == 'HTTP/1.1':
+                self.chunked = True
+                lines.append('Transfer-Encoding: chunked\r\n')
+            else:
+                self.keep_alive = False
+        if not self.keep_alive:
+            lines.append('Connection: close\r\n')
+        elif self.version == 'HTTP/1.0':
+            lines.append('Connection: keep-alive\r\n')
+        lines.append('\r\n')
+        self.writer.write(''.join(lines))
+        self.headers_sent = True
+    
+    def write(self, data):
+        if not self.headers_sent:
+            self.send_headers()
+        if not data or not self.body:
+            return
+        writer = self.writer
+        if self.chunked:
+            writer.write('%x\r\n' % (len(data),))
+            writer.write(data)
+            writer.write('\r\n')
+        else:
+            writer.write(data)
+        self.sent += len(data)
+    
+    def finish(self):
+        """Mark the end of the response."""
+        if not self.headers_sent:
+            self.send_headers(0)
+        if self.chunked:
+            self.writer.write('0\r\n\r\n')
+        elif self.body and self.length != self.sent:
+            # The client cannot tell where this response ends.
+            self.keep_alive = False
+
+
+class WSGIServer(object):
+    
+    """Serve a WSGI application over HTTP/1.1.
+    
+    Each connection is handled by its own task. Connections are kept alive
+    between requests until idle_timeout seconds pass without a new request,
+    and pipelined requests are answered in order; responses produced in the
+    same Hub tick go out in a single send. The request line and headers
+    must arrive within request_timeout seconds, and fit in max_header_size
+    bytes and max_headers lines. A client that stops reading its responses
+    is disconnected when sending to it makes no progress for
+    request_timeout seconds.
+    """
+    
+    def __init__(self, app, idle_timeout=IDLE_TIMEOUT,
+                 request_timeout=REQUEST_TIMEOUT,
+                 max_header_size=MAX_HEADER_SIZE, max_headers=MAX_HEADERS,
+                 bufsize=65536):
+        self.app = app
+        self.idle_timeout = idle_timeout
+        self.request_timeout = request_timeout
+        self.max_header_size = max_header_size
+        self.max_headers = max_headers
+        self.bufsize = bufsize
+    
+    def serve(self, sock):
+        """Accept connections on a listening socket, forever."""
+        while True:
+            client, addr = greennet.accept(sock)
+            greennet.schedule(greennet.greenlet(self.handle), client, addr)
+    
+    def handle(self, sock, addr):
+        """Serve requests on a connection until it is closed."""
+        if not (greennet.ssl and isinstance(sock, greennet.ssl.peekable)):
+            sock.setblocking(False)
+        reader = Reader(sock, self.bufsize)
+        writer = WriteBuffer(sock, high=FLUSH_SIZE,
+                             timeout=self.request_timeout)
+        base = self.base_environ(sock, addr)
+        try:
+            try:
+                while self.handle_request(reader, writer, base):
+                    pass
+                writer.flush(self.request_timeout)
+            except HTTPError, err:
+                self.send_error(writer, err)
+            except (ConnectionLost, Timeout, EnvironmentError):
+                pass
+        finally:
+            writer.close()
+            sock.close()
+    
+    def base_environ(self, sock, addr):
+        """Return the environ entries shared by a connection's requests."""
+        try:
+            server = sock.getsockname()
+        except (socket.error, TypeError):
+            server = ('', 0)
+        if not isinstance(server, tuple):
+            server = (server or '', 0)
+        if not isinstance(addr, tuple):
+            addr = (addr or '', 0)
+        ssl = greennet.ssl and isinstance(sock, greennet.ssl.peekable)
+        return {
+            'SCRIPT_NAME': '',
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'REMOTE_ADDR': addr[0],
+            'REMOTE_PORT': str(addr[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': ssl and 'https' or 'http',
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': False,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+    
+    def handle_request(self, reader, writer, base):
+        """Read and answer one request; return whether to keep going."""
+        if not len(reader):
+            try:
+                if not reader.fill(self.idle_timeout):
+                    return False
+            except Timeout:
+                return False
+        head = reader.read_until('\r\n\r\n', self.max_header_size,
+                                 HeaderTooLarge, self.request_timeout)
+        environ, version, keep_alive, framing = self.parse_head(head, base)
+        length = environ.get('CONTENT_LENGTH')
+        expect = None
+        if environ.get('HTTP_EXPECT', '').lower() == '100-continue':
+            def expect():
+                writer.write('HTTP/1.1 100 Continue\r\n\r\n')
+                writer.flush(self.request_timeout)
+        environ['wsgi.input'] = body = Input(
+            reader, length and int(length), framing == 'chunked',
+            self.request_timeout, expect)
+        request = Request(writer, environ, version, keep_alive)
+        try:
+            result = self.app(environ, request.start_response)
+            try:
+                if (isinstance(result, (list, tuple)) and len(result) == 1
+                    and not request.headers_sent):
+                    request.send_headers(len(result[0]))
+                for data in result:
+                    request.write(data)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        except HTTPError:
+            if request.headers_sent:
+                return False
+            raise
+        except (ConnectionLost, Timeout, EnvironmentError, Cancelled):
+            # Not the application's fault; Cancelled means the task is
+            # being stopped (e.g. by Hub.shutdown).
+            raise
+        except Exception:
+            log.exception('Error in WSGI application')
+            if request.headers_sent:
+                return False
+            raise HTTPError(500)
+        request.finish()
+        return request.keep_alive and body.drain(MAX_DRAIN)
+    
+    def parse_head(self, head, base):
+        """Parse a request line and headers into a WSGI environ.
+        
+        Returns (environ, version, keep_alive, framing), where framing is
+        how the request body is delimited: 'chunked', 'length' or None.
+        """
+        lines = head.split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            raise HTTPError(400, 'Bad Request Line')
+        if version not in ('HTTP/1.1', 'HTTP/1.0'):
+            if not version.startswith('HTTP/'):
+                raise HTTPError(400, 'Bad Request Line')
+            raise HTTPError(505)
+        if len(lines) - 3 > self.max_headers:
+            raise HeaderTooLarge()
+        environ = dict(base)
+        environ['REQUEST_METHOD'] = method
+        environ['SERVER_PROTOCOL'] = version
+        if target.startswith(('http://', 'https://')):
+            parts = target.split('/', 3)
+            target = '/' + (parts[3] if len(parts) > 3 else '')
+        path, _, query = target.partition('?')
+        environ['PATH_INFO'] = urllib.unquote(path)
+        environ['QUERY_STRING'] = query
+        for line in lines[1:-2]:
+            name, sep, value = line.partition(':')
+            if not sep or not name or name[-1] in ' \t' or \
+               line[0] in ' \t':
+                raise HTTPError(400, 'Bad Header')
+            key = name.upper().replace('-', '_')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+            value = value.strip()
+            if key in environ:
+                if key == 'CONTENT_LENGTH':
+                    raise HTTPError(400, 'Bad Content-Length')
+                value = environ[key] + ',' + value
+            environ[key] = value
+        connection = environ.get('HTTP_CONNECTION', '').lower()
+        if version == 'HTTP/1.1':
+            keep_alive = 'close' not in connection
+        else:
+            keep_alive = 'keep-alive' in connection
+        framing = None
+        encoding = environ.get('HTTP_TRANSFER_ENCODING')
+        if encoding is not None:
+            if encoding.lower() != 'chunked':
+                raise HTTPError(501)
+            if 'CONTENT_LENGTH' in environ:
+                raise HTTPError(400, 'Bad Content-Length')
+            framing = 'chunked'
+        elif 'CONTENT_LENGTH' in environ:
+            length = environ['CONTENT_LENGTH']
+            if not length.isdigit():
+                raise HTTPError(400, 'Bad Content-Length')
+            framing = 'length'
+        return environ, version, keep_alive, framing
+    
+    def send_error(self, writer, err):
+        """Send a response for an HTTPError; the connection is closed after
+        it.
+        """
+        message = err.args[1]
+        writer.write('HTTP/1.1 %d %s\r\nContent-Type: text/plain\r\n'
+                     'Content-Length: %d\r\nConnection: close\r\n\r\n%s' %
+                     (err.status, REASONS.get(err.status, message),
+                      len(message), message))
+        try:
+            writer.flush(self.request_timeout)
+        except (Timeout, EnvironmentError):
+            pass
+
+
+def serve(sock, app, **kwargs):
+    """Serve a WSGI application on a listening socket, forever.
+    
+    Keyword arguments are passed to WSGIServer.
+    """
+    WSGIServer(app, **kwargs).serve(sock)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -4,9 +4,10 @@
 import select
 import errno
 import heapq
+import bisect
 import time
 import socket
-from itertools import chain
+import weakref
 from collections import deque
 
 from greennet import greenlet
@@ -15,21 +16,37 @@ READ = 1
 WRITE = 2
 EXC = 4
 
+PRIORITIES = 8
+DEFAULT_PRIORITY = 4
+
+TICK_BOUNDS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
 
 class Timeout(Exception):
     """Timed out waiting for an event."""
     pass
 
 
+class Cancelled(Exception):
+    """The task was cancelled while waiting (see Hub.throw)."""
+    pass
+
+
+class Shutdown(Cancelled):
+    """The Hub shut down while the task was waiting (see Hub.shutdown)."""
+    pass
+
+
 class Wait(object):
     
     """Wait for an event."""
     
-    __slots__ = ('task', 'expires')
+    __slots__ = ('task', 'expires', 'deadline')
     
     def __init__(self, task, expires):
         self.task = task
         self.expires = expires
+        self.deadline = None
     
     def timeout(self):
         """Called when the event times out.
@@ -38,6 +55,11 @@ class Wait(object):
         """
         self.task.throw(Timeout)
     
+    def cancel(self, hub):
+        """Stop waiting for the event, without resuming the task."""
+        if self.expires is not None:
+            hub._remove_timeout(self)
+    
     def __cmp__(self, other):
         """cmp(x, y) <==> cmp(x.expires, y.expires)"""
         return cmp(self.expires, other.expires)
@@ -71,54 +93,464 @@ class FDWait(Wait):
         self.fd = fd
         self.mask = (read and READ) | (write and WRITE) | (exc and EXC)
     
+    def cancel(self, hub):
+        hub._remove_fdwait(self)
+        super(FDWait, self).cancel(hub)
+    
+    def fire(self, hub, events):
+        """Called when some of the awaited events occur."""
+        hub._remove_fdwait(self)
+        hub._wake(self)
+    
     def fileno(self):
         return self.fd
 
 
+class FDCallback(FDWait):
+    
+    """Run a function in a new task when an IO event occurs.
+    
+    Unlike an FDWait, this keeps no task suspended (and no greenlet stack
+    alive) until then.
+    """
+    
+    __slots__ = ('func', 'args', 'kwargs')
+    
+    def __init__(self, func, args, kwargs, fd, read=False,
+                 write=False, exc=False):
+        super(FDCallback, self).__init__(None, fd, read, write, exc)
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+    
+    def fire(self, hub, events):
+        hub._remove_fdwait(self)
+        hub.schedule(greenlet(self.func), *self.args, **self.kwargs)
+
+
+class FDSetWait(Wait):
+    
+    """Wait for IO events on any of several file descriptors.
+    
+    Each file descriptor is registered as an FDSetMember. Events on all the
+    members that become ready in the same iteration of the loop are
+    collected in the ready list, as (obj, events) pairs; the task is woken
+    once, and its remaining members are unregistered when it resumes.
+    """
+    
+    __slots__ = ('hub', 'members', 'ready', 'woken')
+    
+    def __init__(self, hub, task, expires):
+        super(FDSetWait, self).__init__(task, expires)
+        self.hub = hub
+        self.members = []
+        self.ready = []
+        self.woken = False
+    
+    def remove_members(self, hub):
+        """Unregister the members that have not fired."""
+        for member in self.members:
+            if member.fired is None:
+                hub._remove_fdwait(member)
+        self.members = []
+    
+    def timeout(self):
+        self.remove_members(self.hub)
+        super(FDSetWait, self).timeout()
+    
+    def cancel(self, hub):
+        self.remove_members(hub)
+        super(FDSetWait, self).cancel(hub)
+
+
+class FDSetMember(FDWait):
+    
+    """One file descriptor of an FDSetWait."""
+    
+    __slots__ = ('group', 'obj', 'fired')
+    
+    def __init__(self, group, obj, fd, mask):
+        super(FDSetMember, self).__init__(group.task, fd)
+        self.mask = mask
+        self.group = group
+        self.obj = obj
+        self.fired = None
+    
+    def fire(self, hub, events):
+        hub._remove_fdwait(self)
+        self.fired = events & self.mask
+        group = self.group
+        group.ready.append((self.obj, self.fired))
+        if not group.woken:
+            group.woken = True
+            hub._wake(group)
+
+
+class Deadline(Wait):
+    
+    """Bound the time a task spends waiting, across many operations.
+    
+    Use as a context manager (see Hub.deadline). While a Deadline is active,
+    the task's waits that have no earlier timeout of their own register no
+    timer: the Deadline's single timer covers them all. When it expires, the
+    task's current wait is cancelled and Timeout is raised in the task, and
+    every later wait within the with-block raises Timeout immediately.
+    """
+    
+    __slots__ = ('hub', 'wait', 'expired', 'active')
+    
+    def __init__(self, hub, task, expires):
+        super(Deadline, self).__init__(task, expires)
+        self.hub = hub
+        self.wait = None
+        self.expired = False
+        self.active = False
+    
+    def __enter__(self):
+        if self.expires is not None:
+            self.hub._push_deadline(self)
+        return self
+    
+    def __exit__(self, *exc_info):
+        if self.active:
+            self.hub._pop_deadline(self)
+    
+    def timeout(self):
+        """Cancels the task's current wait, and raises Timeout in it."""
+        self.expired = True
+        wait = self.wait
+        if wait is not None:
+            self.wait = None
+            wait.deadline = None
+            wait.cancel(self.hub)
+            self.task.throw(Timeout)
+
+
+class FDRegistration(object):
+    
+    """All FDWaits on a single file descriptor.
+    
+    The registration's mask is the union of the masks of its waits, so a
+    reader and a writer on the same fd are polled once, with a combined mask.
+    """
+    
+    __slots__ = ('fd', 'waits', 'mask')
+    
+    def __init__(self, fd):
+        self.fd = fd
+        self.waits = []
+        self.mask = 0
+    
+    def add(self, wait):
+        """Add an FDWait to the registration."""
+        self.waits.append(wait)
+        self.mask |= wait.mask
+    
+    def remove(self, wait):
+        """Remove an FDWait from the registration."""
+        # Waits compare by expiry, so remove by identity.
+        self.waits = [w for w in self.waits if w is not wait]
+        mask = 0
+        for w in self.waits:
+            mask |= w.mask
+        self.mask = mask
+    
+    def ready(self, events):
+        """Return the waits interested in any of the given events."""
+        return [wait for wait in self.waits if wait.mask & events]
+    
+    def fileno(self):
+        return self.fd
+
+
+class ReadyQueue(object):
+    
+    """Tasks ready to run, in a fixed number of FIFO priority levels.
+    
+    Level 0 is the highest priority. A bitmap of non-empty levels makes
+    picking the next task a constant-time operation.
+    
+    >>> q = ReadyQueue()
+    >>> q.append('normal')
+    >>> q.append('high', 0)
+    >>> q.append('low', PRIORITIES - 1)
+    >>> len(q)
+    3
+    >>> [q.popleft() for i in xrange(len(q))]
+    ['high', 'normal', 'low']
+    >>> q.popleft()
+    Traceback (most recent call last):
+        ...
+    IndexError: pop from an empty ReadyQueue
+    """
+    
+    __slots__ = ('levels', 'bitmap', 'size')
+    
+    def __init__(self):
+        self.levels = [deque() for i in xrange(PRIORITIES)]
+        self.bitmap = 0
+        self.size = 0
+    
+    def __len__(self):
+        return self.size
+    
+    def append(self, item, priority=DEFAULT_PRIORITY):
+        """Append an item to the given priority level."""
+        self.levels[priority].append(item)
+        self.bitmap |= 1 << priority
+        self.size += 1
+    
+    def popleft(self):
+        """Pop the oldest item from the highest non-empty priority level."""
+        bitmap = self.bitmap
+        if not bitmap:
+            raise IndexError('pop from an empty ReadyQueue')
+        return self.pop_level((bitmap & -bitmap).bit_length() - 1)
+    
+    def pop_level(self, priority):
+        """Pop the oldest item from the given (non-empty) priority level."""
+        level = self.levels[priority]
+        item = level.popleft()
+        if not level:
+            self.bitmap &= ~(1 << priority)
+        self.size -= 1
+        return item
+    
+    def counts(self):
+        """Return (priority, number of items) for the non-empty levels,
+        highest priority first.
+        
+        Items are only ever added at the end of a level, so the items
+        counted are the first ones popped from it (see Hub._run_tasks).
+        """
+        bitmap = self.bitmap
+        return [(priority, len(level))
+                for priority, level in enumerate(self.levels)
+                if bitmap >> priority & 1]
+
+
+class Histogram(object):
+    
+    """Counts of samples falling into fixed buckets.
+    
+    counts[i] is the number of samples no greater than bounds[i] (and greater
+    than any previous bound). The last count is for samples above all bounds.
+    
+    >>> h = Histogram((1, 10))
+    >>> for value in (0.5, 1, 5, 50):
+    ...     h.add(value)
+    >>> h.counts
+    [2, 1, 1]
+    """
+    
+    __slots__ = ('bounds', 'counts')
+    
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+    
+    def add(self, value):
+        """Count a sample."""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+
+
+class HubStats(object):
+    
+    """Counters describing the work done by a Hub's event loop.
+    
+    iterations -- number of loop iterations
+    poll_time -- seconds spent blocked in select() or sleep()
+    run_time -- seconds spent running ready tasks
+    timeouts -- number of timeouts fired
+    ready_max -- largest number of ready tasks at the start of an iteration
+    ticks -- Histogram of iteration durations, excluding poll_time
+    
+    Current ready task, FDWait and timeout counts are read from the Hub by
+    snapshot().
+    """
+    
+    def __init__(self, hub):
+        self.hub = hub
+        self.iterations = 0
+        self.poll_time = 0.0
+        self.run_time = 0.0
+        self.timeouts = 0
+        self.ready_max = 0
+        self.ticks = Histogram(TICK_BOUNDS)
+    
+    def snapshot(self):
+        """Return the current counters and gauges as a dict."""
+        hub = self.hub
+        return {
+            'iterations': self.iterations,
+            'poll_time': self.poll_time,
+            'run_time': self.run_time,
+            'timeouts': self.timeouts,
+            'ready_max': self.ready_max,
+            'ready': len(hub.tasks),
+            'fds': len(hub.fdwaits),
+            'fdwaits': sum(len(reg.waits)
+                           for reg in hub.fdwaits.itervalues()),
+            'timers': len(hub.timeouts),
+            'ticks': {
+                'bounds': list(self.ticks.bounds),
+                'counts': list(self.ticks.counts),
+            },
+        }
+
+
+def _check_priority(priority):
+    if not 0 <= priority < PRIORITIES:
+        raise ValueError('priority must be in range(%d)' % (PRIORITIES,))
+
+
 class Hub(object):
     
     """Schedule and run tasks based on an event-loop.
     
-    The default implementation uses select() to wait on FDWaits.
+    The default implementation uses select() to wait on FDWaits. FDWaits are
+    kept in the fdwaits dict, which maps file descriptors to their
+    FDRegistration. The waiting dict maps each suspended task to its Wait,
+    until the task is woken.
+    
+    Each iteration of the loop runs only the tasks that were ready when it
+    started, so tasks rescheduling themselves cannot starve IO or timeouts.
+    If budget is given, an iteration also stops running tasks once that many
+    seconds have passed; the rest run after IO and timeouts are serviced.
+    
+    Ready tasks are run highest priority first (see ReadyQueue). A task keeps
+    its assigned priority whenever it is resumed, whether by IO, a timeout or
+    switch().
+    
+    If stats is true, or once enable_stats() is called, the loop keeps a
+    HubStats instance in the stats attribute; otherwise stats is None.
+    
+    Objects in the switch_hooks list have their before_switch(task) and
+    after_switch(task) methods called around every switch the Hub makes into
+    a task. For a timer with no task (such as a ConnectionPool's ReapTimer),
+    the task is the short-lived greenlet running its timeout() method.
     """
     
-    def __init__(self):
-        self.greenlet = greenlet(self._run)
-        self.fdwaits = set()
+    def __init__(self, budget=None, stats=False):
+        self.budget = budget
+        self.stats = HubStats(self) if stats else None
+        self.switch_hooks = []
+        self.greenlet = greenlet(self._main)
+        self.fdwaits = {}
         self.timeouts = []
-        self.tasks = deque()
+        self.tasks = ReadyQueue()
+        self.priorities = weakref.WeakKeyDictionary()
+        self.deadlines = {}
+        self.waiting = {}
+        self.stopping = False
+        self.until = None       # predicate checked by run_until
+    
+    def time(self):
+        """Return the current time, as used for timeouts."""
+        return time.time()
     
     def poll(self, fd, read=False, write=False, exc=False, timeout=None):
         """Suspend the current task until an IO event occurs."""
-        expires = None if timeout is None else time.time() + timeout
+        expires = self._expires(timeout)
         if hasattr(fd, 'fileno'):
             fd = fd.fileno()
         wait = FDWait(greenlet.getcurrent(), fd, read, write, exc, expires)
-        self.fdwaits.add(wait)
-        if timeout is not None:
-            self._add_timeout(wait)
-        self.greenlet.switch()
+        self._add_fdwait(wait)
+        self._suspend(wait)
+    
+    def poll_many(self, fds, timeout=None):
+        """Suspend the current task until an IO event occurs on any of fds.
+        
+        fds is a sequence of (obj, mask) pairs, where obj is a file
+        descriptor or an object with a fileno() method, and mask is a
+        combination of READ, WRITE and EXC. Returns a list of (obj, events)
+        pairs for the objects that are ready.
+        """
+        expires = self._expires(timeout)
+        group = FDSetWait(self, greenlet.getcurrent(), expires)
+        for obj, mask in fds:
+            fd = obj.fileno() if hasattr(obj, 'fileno') else obj
+            member = FDSetMember(group, obj, fd, mask)
+            group.members.append(member)
+            self._add_fdwait(member)
+        try:
+            self._suspend(group)
+        finally:
+            group.remove_members(self)
+        return group.ready
     
     def sleep(self, timeout):
         """Suspend the current task for the specified number of seconds."""
-        expires = time.time() + timeout
+        self._expires(None)     # raises Timeout if the deadline has passed
+        expires = self.time() + timeout
         sleep = Sleep(greenlet.getcurrent(), expires)
-        self._add_timeout(sleep)
-        self.greenlet.switch()
+        self._suspend(sleep)
+    
+    def deadline(self, timeout):
+        """Return a context manager bounding the current task's waits.
+        
+        All the waits (poll, sleep, Queue operations...) the task makes in
+        the with-block must complete within timeout seconds of this call, or
+        Timeout is raised. A timeout of None means no limit. Deadlines nest;
+        the earliest one applies.
+        """
+        expires = None if timeout is None else self.time() + timeout
+        return Deadline(self, greenlet.getcurrent(), expires)
     
     def call_later(self, task, timeout, *args, **kwargs):
         """Run the task after the specified number of seconds."""
-        expires = time.time() + timeout
+        try:
+            task.parent = self.greenlet
+        except ValueError:
+            pass
+        expires = self.time() + timeout
         sleep = Sleep(task, expires, args, kwargs)
         self._add_timeout(sleep)
     
+    def call_when_readable(self, obj, func, *args, **kwargs):
+        """Run func(*args, **kwargs) in a new task once obj is readable.
+        
+        obj is a file descriptor or an object with a fileno() method. No
+        task exists until then, so this parks an idle connection for the
+        cost of an FDCallback, which is returned; its cancel(hub) method
+        stops watching obj.
+        """
+        fd = obj.fileno() if hasattr(obj, 'fileno') else obj
+        callback = FDCallback(func, args, kwargs, fd, read=True)
+        self._add_fdwait(callback)
+        return callback
+    
     def schedule(self, task, *args, **kwargs):
         """Schedule a task to be run during the next iteration of the loop."""
         try:
             task.parent = self.greenlet
         except ValueError:
             pass
-        self.tasks.append((task, args, kwargs))
+        if self.priorities:
+            priority = self.priorities.get(task, DEFAULT_PRIORITY)
+        else:
+            priority = DEFAULT_PRIORITY
+        self.tasks.append((task, args, kwargs), priority)
+    
+    def schedule_priority(self, task, priority, *args, **kwargs):
+        """Assign a task's priority (see set_priority), and schedule it."""
+        self.set_priority(task, priority)
+        self.schedule(task, *args, **kwargs)
+    
+    def set_priority(self, task, priority):
+        """Assign the priority at which a task is scheduled from now on.
+        
+        Priorities are in range(PRIORITIES), 0 being the highest.
+        """
+        _check_priority(priority)
+        if priority == DEFAULT_PRIORITY:
+            self.priorities.pop(task, None)
+        else:
+            self.priorities[task] = priority
+    
+    def get_priority(self, task):
+        """Return the priority assigned to a task."""
+        return self.priorities.get(task, DEFAULT_PRIORITY)
     
     def switch(self):
         """Reschedule the current task, and run the event-loop."""
@@ -132,24 +564,284 @@ class Hub(object):
         """
         self.greenlet.switch()
     
+    def stop(self):
+        """Make run() return once the tasks currently ready have run.
+        
+        Everything still scheduled stays so; run() carries on from there.
+        If the loop is not running, the next run() returns after running
+        the tasks ready then.
+        """
+        self.stopping = True
+    
+    def run_until(self, until):
+        """Run the event loop until a condition holds.
+        
+        until is either a predicate, called with no arguments after every
+        batch of ready tasks, or a time (as returned by time()) to stop at.
+        Returns True if the condition was met, False if there was nothing
+        left to run first.
+        """
+        if callable(until):
+            return self._run_until(until)
+        return self._run_until(None, until)
+    
+    def shutdown(self, grace):
+        """Let the tasks in flight finish, then cancel the stragglers.
+        
+        Runs the event loop until no task is waiting or ready, for at most
+        grace seconds; Shutdown is then raised in each task still waiting,
+        and the loop runs once more so they can clean up. A task that does
+        not handle Shutdown just ends. Returns a
+        (drained, killed) tuple: the number of tasks in flight when called
+        that finished on their own, and the number Shutdown was raised in.
+        
+        Stop accepting new work (e.g. close listening sockets) before
+        calling this: a task waiting in accept() would only be killed.
+        Tasks that keep rescheduling themselves with switch() are never
+        waiting, so they are neither drained nor killed.
+        """
+        in_flight = set(self.waiting)
+        for level in self.tasks.levels:
+            in_flight.update(task for task, args, kwargs in level)
+        self._run_until(lambda: not (self.waiting or self.tasks),
+                        self.time() + grace)
+        killed = [task for task in self.waiting.keys()
+                  if self._cancel_wait(task)]
+        for task in killed:
+            self.schedule(greenlet(self._kill), task)
+        self.stop()
+        self.run()
+        drained = len([task for task in in_flight.difference(killed)
+                       if task.dead])
+        return drained, len(killed)
+    
+    def enable_stats(self):
+        """Start collecting loop statistics, and return the new HubStats."""
+        self.stats = HubStats(self)
+        return self.stats
+    
+    def disable_stats(self):
+        """Stop collecting loop statistics."""
+        self.stats = None
+    
+    def _run_until(self, predicate, expires=None):
+        """Run the event loop until predicate() is true, or expires."""
+        timer = None
+        if expires is not None:
+            fired = []
+            timer = Sleep(greenlet(fired.append, self.greenlet), expires,
+                          (True,))
+            self._add_timeout(timer)
+            if predicate is None:
+                predicate = lambda: fired
+            else:
+                predicate = (lambda until=predicate: fired or until())
+        if predicate():
+            return True
+        until = self.until
+        self.until = predicate
+        try:
+            self.greenlet.switch()
+        finally:
+            self.until = until
+            if timer is not None and not fired:
+                self._remove_timeout(timer)
+        return bool(predicate())
+    
+    def _stopped(self):
+        """Return whether stop() was called or the run_until predicate
+        holds.
+        """
+        return self.stopping or (self.until is not None and self.until())
+    
     def _run_tasks(self):
-        """Run all immediately available tasks.
+        """Run as many tasks as were ready at the start of this iteration.
+        
+        Tasks are picked highest priority first. Tasks scheduled while
+        running, whatever their priority and including those rescheduling
+        themselves, are left for the next iteration. Returns early if the
+        iteration's budget is used up; the tasks not run stay at the front
+        of their levels.
+        """
+        tasks = self.tasks
+        end = None if self.budget is None else time.time() + self.budget
+        for priority, count in tasks.counts():
+            for i in xrange(count):
+                task, args, kwargs = tasks.pop_level(priority)
+                if self.switch_hooks:
+                    self._hooked_switch(task, task.switch, args, kwargs)
+                else:
+                    task.switch(*args, **kwargs)
+                if end is not None and time.time() >= end:
+                    return
+    
+    def _hooked_switch(self, task, switch, args=(), kwargs={}):
+        """Call switch(*args, **kwargs), running switch_hooks for task."""
+        hooks = list(self.switch_hooks)
+        for hook in hooks:
+            hook.before_switch(task)
+        try:
+            switch(*args, **kwargs)
+        finally:
+            for hook in hooks:
+                hook.after_switch(task)
+    
+    def _push_deadline(self, deadline):
+        """Make a Deadline active, unless an enclosing one expires first."""
+        stack = self.deadlines.get(deadline.task)
+        if stack is None:
+            stack = self.deadlines[deadline.task] = []
+        elif stack[-1].expires <= deadline.expires:
+            return
+        stack.append(deadline)
+        deadline.active = True
+        self._add_timeout(deadline)
+    
+    def _pop_deadline(self, deadline):
+        """Deactivate a Deadline, removing its timer if it has not fired."""
+        stack = self.deadlines[deadline.task]
+        stack[:] = [d for d in stack if d is not deadline]
+        if not stack:
+            del self.deadlines[deadline.task]
+        deadline.active = False
+        if not deadline.expired:
+            self._remove_timeout(deadline)
+    
+    def _current_deadline(self):
+        """Return the current task's earliest active Deadline, or None."""
+        if not self.deadlines:
+            return None
+        stack = self.deadlines.get(greenlet.getcurrent())
+        if stack:
+            return stack[-1]
+        return None
+    
+    def _expires(self, timeout):
+        """Return the expiry time for a wait of the current task.
+        
+        Returns None if the wait needs no timer of its own, because it has no
+        timeout or the task's Deadline expires first. Raises Timeout if the
+        Deadline has already expired.
+        """
+        deadline = self._current_deadline()
+        if deadline is None:
+            return None if timeout is None else self.time() + timeout
+        if deadline.expired:
+            raise Timeout()
+        if timeout is None:
+            return None
+        expires = self.time() + timeout
+        if expires < deadline.expires:
+            return expires
+        return None
+    
+    def _suspend(self, wait):
+        """Suspend the current task until the Wait is woken or times out.
+        
+        The caller registers the wait wherever it will be woken from; its
+        timer, if it has an expiry time, is added here.
+        """
+        if wait.expires is not None:
+            self._add_timeout(wait)
+        task = wait.task
+        self.waiting[task] = wait
+        deadline = self._current_deadline()
+        if deadline is not None:
+            deadline.wait = wait
+            wait.deadline = deadline
+        try:
+            self.greenlet.switch()
+        finally:
+            self.waiting.pop(task, None)
+            if deadline is not None:
+                if deadline.wait is wait:
+                    deadline.wait = None
+                wait.deadline = None
+    
+    def _wake(self, wait):
+        """Schedule the task of a Wait whose event has happened.
         
-        Returns when all tasks either finish or are waiting for an event.
+        The caller has already unregistered the wait; its timer is removed
+        here.
         """
-        while self.tasks:
-            task, args, kwargs = self.tasks.popleft()
-            task.switch(*args, **kwargs)
+        if wait.expires is not None:
+            self._remove_timeout(wait)
+        if wait.deadline is not None:
+            wait.deadline.wait = None
+            wait.deadline = None
+        self.waiting.pop(wait.task, None)
+        self.schedule(wait.task)
+    
+    def throw(self, task, typ=Cancelled, val=None, tb=None):
+        """Raise an exception (by default, Cancelled) in a waiting task.
+        
+        The task's wait is cancelled, and the exception is raised in it on
+        the next iteration of the loop. Returns False, doing nothing, if the
+        task is not waiting: it is running, already woken, or not started.
+        """
+        if not self._cancel_wait(task):
+            return False
+        self.schedule(greenlet(task.throw), typ, val, tb)
+        return True
+    
+    def _cancel_wait(self, task):
+        """Cancel the wait of a task, which must then be resumed some other
+        way. Returns False if the task is not waiting.
+        """
+        wait = self.waiting.pop(task, None)
+        if wait is None:
+            return False
+        if wait.deadline is not None:
+            wait.deadline.wait = None
+            wait.deadline = None
+        wait.cancel(self)
+        return True
+    
+    def _kill(self, task):
+        """Raise Shutdown in a task whose wait was cancelled.
+        
+        Run as a task of its own, made the parent of task, so that task
+        simply ends if it does not handle Shutdown.
+        """
+        task.parent = greenlet.getcurrent()
+        try:
+            task.throw(Shutdown)
+        except Shutdown:
+            pass
+    
+    def _add_fdwait(self, wait):
+        """Register an FDWait with the registration for its fd."""
+        try:
+            reg = self.fdwaits[wait.fd]
+        except KeyError:
+            reg = self.fdwaits[wait.fd] = FDRegistration(wait.fd)
+        reg.add(wait)
+    
+    def _remove_fdwait(self, wait):
+        """Unregister an FDWait, dropping its fd's registration if empty."""
+        reg = self.fdwaits[wait.fd]
+        reg.remove(wait)
+        if not reg.waits:
+            del self.fdwaits[wait.fd]
     
     def _add_timeout(self, item):
         """Add a Wait object to the timeout heap."""
-        assert item not in self.timeouts
+        # Waits compare by expiry, so check membership by identity.
+        assert not [wait for wait in self.timeouts if wait is item]
         heapq.heappush(self.timeouts, item)
     
     def _remove_timeout(self, item):
         """Remove a Wait object from the timeout heap."""
-        self.timeouts.remove(item)
-        heapq.heapify(self.timeouts)
+        timeouts = self.timeouts
+        for i, wait in enumerate(timeouts):
+            if wait is item:
+                break
+        else:
+            raise ValueError('Wait not in timeouts')
+        last = timeouts.pop()
+        if i < len(timeouts):
+            timeouts[i] = last
+            heapq.heapify(timeouts)
     
     def _handle_timeouts(self):
         """Fire timeout events and return the next-expiring timeout.
@@ -158,50 +850,153 @@ class Hub(object):
         """
         while self.timeouts:
             wait = self.timeouts[0]
-            timeout = wait.expires - time.time()
+            timeout = wait.expires - self.time()
             if timeout <= 0.0:
                 heapq.heappop(self.timeouts)
                 if isinstance(wait, FDWait):
-                    self.fdwaits.remove(wait)
-                self.schedule(greenlet(wait.timeout))
-                self._run_tasks()
+                    self._remove_fdwait(wait)
+                if self.stats is not None:
+                    self.stats.timeouts += 1
+                callback = greenlet(wait.timeout, self.greenlet)
+                if self.switch_hooks:
+                    task = wait.task
+                    if task is None:
+                        task = callback
+                    self._hooked_switch(task, callback.switch)
+                else:
+                    callback.switch()
             else:
                 return timeout
     
+    def _select(self, r, w, e, timeout):
+        """Wait for IO on the given FDRegistrations, like select.select()."""
+        return select.select(r, w, e, timeout)
+    
+    def _sleep(self, timeout):
+        """Wait for the next timeout when there is no IO to wait for."""
+        time.sleep(timeout)
+    
+    def _main(self):
+        """Body of the Hub's greenlet.
+        
+        Runs the event loop, switching back to the parent greenlet whenever
+        there is nothing left to run, so the Hub can be run again later.
+        """
+        while True:
+            self._run()
+            self.greenlet.parent.switch()
+    
     def _run(self):
         """Main event loop.
         
         Runs tasks, then handles FDWaits, then handles timeouts. This
         implementation uses select() to wait for IO, and sleep() if there are
-        timeouts but no FDWaits.
+        timeouts but no FDWaits (see _select and _sleep). Neither blocks
+        while tasks are still ready.
+        
+        Returns early, after running tasks, if stop() was called or the
+        run_until predicate holds; in that case it does not block for IO or
+        timeouts either.
         """
         while self.fdwaits or self.tasks or self.timeouts:
+            stats = self.stats
+            if stats is not None:
+                start = time.time()
+                poll_time = stats.poll_time
+                stats.iterations += 1
+                stats.ready_max = max(stats.ready_max, len(self.tasks))
             self._run_tasks()
+            if stats is not None:
+                stats.run_time += time.time() - start
+            if self._stopped():
+                break
             if self.fdwaits:
                 while True:
                     timeout = self._handle_timeouts()
+                    if self.tasks or self._stopped():
+                        timeout = 0.0
                     r = []; w = []; e = []
-                    for wait in self.fdwaits:
-                        if wait.mask & READ:
-                            r.append(wait)
-                        if wait.mask & WRITE:
-                            w.append(wait)
-                        if wait.mask & EXC:
-                            e.append(wait)
+                    for reg in self.fdwaits.itervalues():
+                        if reg.mask & READ:
+                            r.append(reg)
+                        if reg.mask & WRITE:
+                            w.append(reg)
+                        if reg.mask & EXC:
+                            e.append(reg)
+                    if stats is not None:
+                        polled = time.time()
                     try:
-                        r, w, e = select.select(r, w, e, timeout)
+                        r, w, e = self._select(r, w, e, timeout)
                     except (select.error, IOError, OSError), err:
                         if err.args[0] == errno.EINTR:
                             continue
                         raise
+                    finally:
+                        if stats is not None:
+                            stats.poll_time += time.time() - polled
                     break
-                for wait in chain(r, w, e):
-                    self.fdwaits.remove(wait)
-                    if wait.expires is not None:
-                        self._remove_timeout(wait)
-                    self.schedule(wait.task)
+                events = {}
+                for regs, event in ((r, READ), (w, WRITE), (e, EXC)):
+                    for reg in regs:
+                        events[reg] = events.get(reg, 0) | event
+                for reg, mask in events.iteritems():
+                    for wait in reg.ready(mask):
+                        wait.fire(self, mask)
             elif self.timeouts:
                 timeout = self._handle_timeouts()
-                if timeout is not None:
-                    time.sleep(timeout)
+                # A task resumed by a timeout may have started waiting for
+                # IO, which the next iteration must select() on.
+                if (timeout is not None and not self.tasks and
+                    not self.fdwaits and not self._stopped()):
+                    if stats is not None:
+                        polled = time.time()
+                    self._sleep(timeout)
+                    if stats is not None:
+                        stats.poll_time += time.time() - polled
+            if stats is not None:
+                stats.ticks.add(time.time() - start -
+                                (stats.poll_time - poll_time))
+        self.stopping = False
+
 
+class VirtualClockHub(Hub):
+    
+    """A Hub whose clock only advances when there is nothing else to do.
+    
+    Whenever no task is ready and no IO is immediately available, the clock
+    jumps straight to the next timeout instead of waiting for it, so timer-
+    heavy code runs as fast as it can while seeing the same sequence of
+    events. IO is still real; the Hub only blocks on it if there are no
+    timeouts left.
+    
+    >>> hub = VirtualClockHub()
+    >>> hub.time()
+    0.0
+    >>> hub.sleep(3600)
+    >>> hub.time()
+    3600.0
+    """
+    
+    def __init__(self, start=0.0, **kwargs):
+        super(VirtualClockHub, self).__init__(**kwargs)
+        self.now = start
+    
+    def time(self):
+        """Return the virtual time."""
+        return self.now
+    
+    def _advance(self):
+        """Jump to the next timeout."""
+        if self.timeouts:
+            self.now = max(self.now, self.timeouts[0].expires)
+    
+    def _select(self, r, w, e, timeout):
+        if timeout is None:
+            return select.select(r, w, e, None)
+        ready = select.select(r, w, e, 0.0)
+        if timeout > 0.0 and not (ready[0] or ready[1] or ready[2]):
+            self._advance()
+        return ready
+    
+    def _sleep(self, timeout):
+        self._advance()
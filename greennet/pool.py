@@ -0,0 +1,298 @@
+"""A pool of reusable outbound connections."""
+
+
+from __future__ import with_statement
+from collections import deque
+from contextlib import contextmanager
+import errno
+import socket
+
+import greennet
+from greennet import greenlet
+from greennet import get_hub
+from greennet.hub import Wait
+
+try:
+    from OpenSSL import SSL
+    from greennet import ssl as greenssl
+except ImportError:
+    greenssl = None
+
+
+def _alive(sock):
+    """Return True if an idle connection looks usable.
+    
+    Peeks at the connection without blocking: a connection that has been
+    closed by the peer, or has unsolicited data waiting, is not reusable.
+    """
+    if greenssl and isinstance(sock, greenssl.peekable):
+        if sock.pending():
+            return False
+        try:
+            sock.recv(1, socket.MSG_PEEK)
+        except (SSL.WantReadError, SSL.WantWriteError):
+            return True
+        except SSL.Error:
+            return False
+        return False
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        try:
+            sock.recv(1, socket.MSG_PEEK)
+        except socket.error, err:
+            return err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK)
+        return False
+    finally:
+        sock.settimeout(timeout)
+
+
+class PoolWait(Wait):
+    
+    """Wait for a connection to be released to a ConnectionPool."""
+    
+    __slots__ = ('pool',)
+    
+    def __init__(self, task, pool):
+        super(PoolWait, self).__init__(task, None)
+        self.pool = pool
+    
+    def cancel(self, hub):
+        # Waits compare by expiry, so find this one by identity.
+        waits = self.pool._waits
+        for i, wait in enumerate(waits):
+            if wait is self:
+                del waits[i]
+                break
+        super(PoolWait, self).cancel(hub)
+
+
+class ReapTimer(Wait):
+    
+    """Close a ConnectionPool's connections that have been idle too long."""
+    
+    __slots__ = ('pool',)
+    
+    def __init__(self, pool, expires):
+        super(ReapTimer, self).__init__(None, expires)
+        self.pool = pool
+    
+    def timeout(self):
+        self.pool._reap()
+
+
+class PoolStats(object):
+    
+    """Counters describing the use of a ConnectionPool.
+    
+    acquires -- number of connections handed out
+    created -- number of connections established
+    reused -- number of idle connections handed out again
+    discarded -- number of idle connections found dead on checkout
+    reaped -- number of connections closed for being idle too long
+    waits -- number of acquires that waited for a connection to be released
+    wait_time -- seconds spent waiting for connections to be released
+    max_wait -- longest single such wait
+    connect_time -- seconds spent establishing connections
+    
+    Current connection counts are read from the pool by snapshot().
+    """
+    
+    def __init__(self, pool):
+        self.pool = pool
+        self.acquires = 0
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self.reaped = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.connect_time = 0.0
+    
+    def snapshot(self):
+        """Return the current counters and gauges as a dict."""
+        pool = self.pool
+        return {
+            'acquires': self.acquires,
+            'created': self.created,
+            'reused': self.reused,
+            'discarded': self.discarded,
+            'reaped': self.reaped,
+            'waits': self.waits,
+            'wait_time': self.wait_time,
+            'max_wait': self.max_wait,
+            'connect_time': self.connect_time,
+            'size': pool.size,
+            'idle': len(pool.idle),
+            'in_use': pool.size - len(pool.idle),
+            'waiting': len(pool._waits),
+        }
+
+
+class ConnectionPool(object):
+    
+    """A bounded pool of connections to a single address.
+    
+    acquire() hands out an idle connection if one is still alive, else
+    connects a new one if fewer than max_size exist, else suspends the task
+    until one is released. Connections should be given back with release(),
+    or used through the connection() context manager.
+    
+    If ssl is given, it is a dict of keyword arguments for greennet.ssl.connect
+    (cert, verify), and the pool's connections use SSL. Connections idle for
+    more than idle_timeout seconds are closed by a timer on the Hub; pass None
+    to keep them until the peer closes them.
+    
+    Usage is counted in the stats attribute, a PoolStats.
+    """
+    
+    def __init__(self, address, max_size, ssl=None, idle_timeout=60.0,
+                 family=socket.AF_INET, hub=None):
+        self.address = address
+        self.max_size = max_size
+        self.ssl = ssl
+        self.idle_timeout = idle_timeout
+        self.family = family
+        self.hub = get_hub() if hub is None else hub
+        self.size = 0
+        self.idle = deque()
+        self.closed = False
+        self.stats = PoolStats(self)
+        self._waits = deque()
+        self._reaper = None
+    
+    def acquire(self, timeout=None):
+        """Return a connection from the pool.
+        
+        Raises Timeout if no connection can be had within timeout seconds.
+        """
+        if self.closed:
+            raise ValueError('ConnectionPool is closed')
+        sock = self._checkout()
+        if sock is None:
+            sock = self._acquire_slow(timeout)
+        self.stats.acquires += 1
+        return sock
+    
+    def _acquire_slow(self, timeout):
+        """Connect, or wait for a release, within a single deadline."""
+        started = None
+        try:
+            with self.hub.deadline(timeout):
+                while True:
+                    if self.size < self.max_size:
+                        return self._connect()
+                    if started is None:
+                        started = self.hub.time()
+                    wait = PoolWait(greenlet.getcurrent(), self)
+                    self._waits.append(wait)
+                    self.hub._suspend(wait)
+                    sock = self._checkout()
+                    if sock is not None:
+                        return sock
+        finally:
+            if started is not None:
+                waited = self.hub.time() - started
+                self.stats.waits += 1
+                self.stats.wait_time += waited
+                self.stats.max_wait = max(self.stats.max_wait, waited)
+    
+    def _checkout(self):
+        """Return the most recently used live idle connection, or None."""
+        while self.idle:
+            sock, since = self.idle.pop()
+            if _alive(sock):
+                self.stats.reused += 1
+                return sock
+            self.stats.discarded += 1
+            self._close(sock)
+        return None
+    
+    def _connect(self):
+        """Establish a new connection, counting it against max_size."""
+        self.size += 1
+        started = self.hub.time()
+        try:
+            sock = socket.socket(self.family, socket.SOCK_STREAM)
+            try:
+                greennet.connect(sock, self.address)
+                if self.ssl is not None:
+                    sock = greenssl.connect(sock, **self.ssl)
+            except:
+                sock.close()
+                raise
+        except:
+            self.size -= 1
+            self._wake()
+            raise
+        self.stats.created += 1
+        self.stats.connect_time += self.hub.time() - started
+        return sock
+    
+    def release(self, sock, discard=False):
+        """Return a connection to the pool.
+        
+        Pass discard=True if the connection must not be reused, e.g. because
+        a request on it failed part-way; it is then closed.
+        """
+        if discard or self.closed:
+            self._close(sock)
+        else:
+            self.idle.append((sock, self.hub.time()))
+            if self.idle_timeout is not None and self._reaper is None:
+                self._arm_reaper()
+        self._wake()
+    
+    @contextmanager
+    def connection(self, timeout=None):
+        """Acquire a connection for the duration of a with-block.
+        
+        The connection is discarded if the block raises an exception.
+        """
+        sock = self.acquire(timeout)
+        try:
+            yield sock
+        except:
+            self.release(sock, discard=True)
+            raise
+        self.release(sock)
+    
+    def close(self):
+        """Close the idle connections; those in use are closed on release."""
+        self.closed = True
+        if self._reaper is not None:
+            self.hub._remove_timeout(self._reaper)
+            self._reaper = None
+        while self.idle:
+            sock, since = self.idle.popleft()
+            self._close(sock)
+    
+    def _close(self, sock):
+        self.size -= 1
+        try:
+            sock.close()
+        except (socket.error, EnvironmentError):
+            pass
+    
+    def _wake(self):
+        """Wake the longest-waiting acquire, if any."""
+        if self._waits:
+            self.hub._wake(self._waits.popleft())
+    
+    def _arm_reaper(self):
+        """Time the reaper for the oldest idle connection."""
+        since = self.idle[0][1]
+        self._reaper = ReapTimer(self, since + self.idle_timeout)
+        self.hub._add_timeout(self._reaper)
+    
+    def _reap(self):
+        """Close connections that have been idle for idle_timeout seconds."""
+        self._reaper = None
+        expired = self.hub.time() - self.idle_timeout
+        while self.idle and self.idle[0][1] <= expired:
+            sock, since = self.idle.popleft()
+            self.stats.reaped += 1
+            self._close(sock)
+        if self.idle:
+            self._arm_reaper()
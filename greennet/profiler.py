@@ -0,0 +1,167 @@
+"""Per-task run time accounting and stack sampling."""
+
+
+import os
+import sys
+import time
+import thread
+import threading
+import weakref
+
+from greennet import get_hub
+
+
+def _code_label(code):
+    return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                           code.co_firstlineno)
+
+
+def task_label(task):
+    """Describe a task by the function it runs.
+    
+    >>> from greennet import greenlet
+    >>> def handler():
+    ...     pass
+    >>> task_label(greenlet(handler)).split()[0]
+    'handler'
+    """
+    run = getattr(task, 'run', None)
+    code = getattr(run, 'func_code', None)
+    if code is not None:
+        return _code_label(code)
+    frame = getattr(task, 'gr_frame', None)
+    if frame is None:
+        return repr(task)
+    while frame.f_back is not None:
+        frame = frame.f_back
+    return _code_label(frame.f_code)
+
+
+class TaskStats(object):
+    
+    """Run time and switch count of a single task, or the totals of count
+    finished tasks with the same label.
+    """
+    
+    __slots__ = ('label', 'switches', 'time', 'count')
+    
+    def __init__(self, label):
+        self.label = label
+        self.switches = 0
+        self.time = 0.0
+        self.count = 1
+
+
+class Profiler(object):
+    
+    """Account the time the Hub spends running each task.
+    
+    Every switch the Hub makes into a task is timed with timer (time.time by
+    default; pass time.clock for process CPU time). The results for running
+    tasks are kept in the tasks dict, which maps tasks to TaskStats; when a
+    task ends, its results are added to the finished dict, which maps labels
+    to TaskStats totals, so a server running a task per request does not
+    keep every task alive. (tasks holds weak references, so a task that
+    ends without the Hub switching to it, such as one killed by shutdown,
+    is dropped instead.)
+    
+    If interval is given, a sampling thread also records the stack running in
+    the Hub's thread every interval seconds. As each greenlet has its own
+    stack, samples are rooted at the running task's function (or the Hub's
+    loop), and can be written in the collapsed format used by flame graph
+    tools.
+    """
+    
+    def __init__(self, hub=None, interval=None, timer=time.time):
+        self.hub = get_hub() if hub is None else hub
+        self.interval = interval
+        self.timer = timer
+        self.tasks = weakref.WeakKeyDictionary()
+        self.finished = {}
+        self.samples = {}
+        self._started = None
+        self._ident = None
+        self._stopped = threading.Event()
+        self._thread = None
+    
+    def before_switch(self, task):
+        if task not in self.tasks:
+            self.tasks[task] = TaskStats(task_label(task))
+        self._started = self.timer()
+    
+    def after_switch(self, task):
+        stats = self.tasks[task]
+        stats.switches += 1
+        stats.time += self.timer() - self._started
+        if task.dead:
+            del self.tasks[task]
+            self._finish(stats)
+    
+    def _finish(self, stats):
+        """Add the results of a task that has ended to its label's totals."""
+        total = self.finished.get(stats.label)
+        if total is None:
+            self.finished[stats.label] = stats
+        else:
+            total.switches += stats.switches
+            total.time += stats.time
+            total.count += stats.count
+    
+    def start(self):
+        """Start profiling; must be called from the Hub's thread."""
+        self._ident = thread.get_ident()
+        self.hub.switch_hooks.append(self)
+        if self.interval is not None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._sample_loop,
+                                            name='greennet.profiler')
+            self._thread.setDaemon(True)
+            self._thread.start()
+    
+    def stop(self):
+        """Stop profiling, keeping the results collected so far."""
+        self.hub.switch_hooks.remove(self)
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+    
+    def sample(self):
+        """Record the stack currently running in the Hub's thread."""
+        frame = sys._current_frames().get(self._ident)
+        if frame is None:
+            return
+        stack = []
+        while frame is not None:
+            stack.append(_code_label(frame.f_code))
+            frame = frame.f_back
+        stack.reverse()
+        key = ';'.join(stack)
+        self.samples[key] = self.samples.get(key, 0) + 1
+    
+    def _sample_loop(self):
+        while not self._stopped.isSet():
+            self.sample()
+            self._stopped.wait(self.interval)
+    
+    def top(self, n=10, key='time'):
+        """Return the n TaskStats, of running tasks or totals of finished
+        ones, with the highest time (or switches).
+        """
+        stats = sorted(self.tasks.values() + self.finished.values(),
+                       key=lambda s: getattr(s, key), reverse=True)
+        return stats[:n]
+    
+    def report(self, n=10, key='time', file=None):
+        """Write a table of the top n tasks."""
+        if file is None:
+            file = sys.stdout
+        file.write('%12s %10s  %s\n' % ('time', 'switches', 'task'))
+        for stats in self.top(n, key):
+            file.write('%12.6f %10d  %s\n' %
+                       (stats.time, stats.switches, stats.label))
+    
+    def write_collapsed(self, file):
+        """Write the stack samples, one 'frame;frame;... count' per line."""
+        for stack, count in sorted(self.samples.iteritems()):
+            file.write('%s %d\n' % (stack, count))
@@ -1,7 +1,6 @@
 """A double-ended queue with an optional maximum size."""
 
 
-import time
 from collections import deque
 
 from greennet import greenlet
@@ -19,9 +18,22 @@ class QueueWait(Wait):
         super(QueueWait, self).__init__(task, expires)
         self.queue = queue
     
+    def _unlink(self):
+        """Remove this wait from the Queue's waits."""
+        # Waits compare by expiry, so find this one by identity.
+        waits = getattr(self.queue, self._wait_attr)
+        for i, wait in enumerate(waits):
+            if wait is self:
+                del waits[i]
+                break
+    
     def timeout(self):
-        getattr(self.queue, self._wait_attr).remove(self)
+        self._unlink()
         super(QueueWait, self).timeout()
+    
+    def cancel(self, hub):
+        self._unlink()
+        super(QueueWait, self).cancel(hub)
 
 class PopWait(QueueWait):
     """Wait for a pop to happen."""
@@ -80,44 +92,38 @@ class Queue(object):
         return len(self.queue) >= self.maxlen
     
     def _wait_for_append(self, timeout):
-        """Suspend the current task until an append happens.
+        """Suspend the current task until the Queue is not empty.
         
-        Call this if popping from an empty Queue.
+        Call this if popping from an empty Queue. Another task may take the
+        item before this one is resumed, in which case it waits again.
         """
-        expires = None if timeout is None else time.time() + timeout
-        wait = AppendWait(greenlet.getcurrent(), self, expires)
-        if timeout is not None:
-            self.hub._add_timeout(wait)
-        self._append_waits.append(wait)
-        self.hub.run()
+        expires = self.hub._expires(timeout)
+        while not self.queue:
+            wait = AppendWait(greenlet.getcurrent(), self, expires)
+            self._append_waits.append(wait)
+            self.hub._suspend(wait)
     
     def _wait_for_pop(self, timeout):
-        """Suspend the current task until a pop happens.
+        """Suspend the current task until the Queue is not full.
         
-        Call this if appending to a full Queue.
+        Call this if appending to a full Queue. Another task may fill the
+        Queue before this one is resumed, in which case it waits again.
         """
-        expires = None if timeout is None else time.time() + timeout
-        wait = PopWait(greenlet.getcurrent(), self, expires)
-        if timeout is not None:
-            self.hub._add_timeout(wait)
-        self._pop_waits.append(wait)
-        self.hub.run()
+        expires = self.hub._expires(timeout)
+        while self.full():
+            wait = PopWait(greenlet.getcurrent(), self, expires)
+            self._pop_waits.append(wait)
+            self.hub._suspend(wait)
     
     def _popped(self):
         """Called when the Queue is reduced in size."""
         if self._pop_waits:
-            wait = self._pop_waits.popleft()
-            if wait.expires is not None:
-                self.hub._remove_timeout(wait)
-            self.hub.schedule(wait.task)
+            self.hub._wake(self._pop_waits.popleft())
     
     def _appended(self):
         """Called when the Queue increases in size."""
         if self._append_waits:
-            wait = self._append_waits.popleft()
-            if wait.expires is not None:
-                self.hub._remove_timeout(wait)
-            self.hub.schedule(wait.task)
+            self.hub._wake(self._append_waits.popleft())
     
     def wait_until_empty(self, timeout=None):
         """Suspend the current task until the Queue is empty.
@@ -132,13 +138,11 @@ class Queue(object):
         """
         if not self.queue:
             return
-        expires = None if timeout is None else time.time() + timeout
-        wait = PopWait(greenlet.getcurrent(), self, expires)
-        if timeout is not None:
-            self.hub._add_timeout(wait)
+        expires = self.hub._expires(timeout)
         while self.queue:
+            wait = PopWait(greenlet.getcurrent(), self, expires)
             self._pop_waits.append(wait)
-            self.hub.run()
+            self.hub._suspend(wait)
         self._popped()
     
     def pop(self, timeout=None):
@@ -0,0 +1,244 @@
+"""Token-bucket rate limiting on the Hub's clock."""
+
+
+from __future__ import with_statement
+from collections import deque
+import errno
+import socket
+
+import greennet
+from greennet import greenlet
+from greennet import get_hub
+from greennet.hub import Wait
+
+
+# Token counts are floats; this much short of a request still satisfies it.
+EPSILON = 1e-9
+
+
+class BucketWait(Wait):
+    
+    """Wait for tokens from a TokenBucket."""
+    
+    __slots__ = ('bucket', 'n')
+    
+    def __init__(self, task, bucket, n, expires):
+        super(BucketWait, self).__init__(task, expires)
+        self.bucket = bucket
+        self.n = n
+    
+    def timeout(self):
+        self.bucket._unlink(self)
+        super(BucketWait, self).timeout()
+    
+    def cancel(self, hub):
+        self.bucket._unlink(self)
+        super(BucketWait, self).cancel(hub)
+
+
+class RefillTimer(Wait):
+    
+    """Hand out a TokenBucket's tokens to the tasks waiting for them."""
+    
+    __slots__ = ('bucket',)
+    
+    def __init__(self, bucket, expires):
+        super(RefillTimer, self).__init__(None, expires)
+        self.bucket = bucket
+    
+    def timeout(self):
+        self.bucket._refill()
+
+
+class TokenBucket(object):
+    
+    """A token bucket refilled at rate tokens per second, holding at most
+    burst tokens (by default, one second's worth).
+    
+    Tasks that cannot get their tokens right away queue up in order. The
+    bucket keeps a single timer on the Hub, for when the first in line can
+    be served; when it fires, every waiter the accumulated tokens cover is
+    woken at once. The timer is never set less than resolution seconds
+    ahead, so a busy bucket fires at most 1/resolution times a second no
+    matter how many tasks wait on it.
+    """
+    
+    def __init__(self, rate, burst=None, resolution=0.01, hub=None):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.hub = get_hub() if hub is None else hub
+        self.rate = float(rate)
+        self.burst = max(rate, 1) if burst is None else burst
+        self.resolution = resolution
+        self.tokens = float(self.burst)
+        self._stamp = self.hub.time()
+        self._waits = deque()
+        self._timer = None
+    
+    def _update(self):
+        """Add the tokens accumulated since the last update."""
+        now = self.hub.time()
+        self.tokens += (now - self._stamp) * self.rate
+        self._stamp = now
+        # While tasks wait, tokens are theirs as soon as they arrive, so
+        # the cap only applies to an idle bucket.
+        if not self._waits and self.tokens > self.burst:
+            self.tokens = float(self.burst)
+    
+    def take(self, n):
+        """Take up to n tokens without waiting; return how many were taken.
+        
+        Whole tokens only are taken, and none while other tasks wait.
+        """
+        if self._waits:
+            return 0
+        self._update()
+        taken = max(min(n, int(self.tokens + EPSILON)), 0)
+        self.tokens -= taken
+        return taken
+    
+    def acquire(self, n=1, timeout=None):
+        """Take n tokens, suspending the current task until there are
+        enough.
+        
+        Raises Timeout if the tokens cannot be had within timeout seconds,
+        and ValueError if n exceeds the burst size.
+        """
+        if n > self.burst:
+            raise ValueError('cannot acquire more than %r tokens' %
+                             (self.burst,))
+        if not self._waits:
+            self._update()
+            if self.tokens + EPSILON >= n:
+                self.tokens -= n
+                return
+        wait = BucketWait(greenlet.getcurrent(), self, n,
+                          self.hub._expires(timeout))
+        self._waits.append(wait)
+        if self._timer is None:
+            self._arm()
+        self.hub._suspend(wait)
+    
+    def refund(self, n):
+        """Return n unused tokens to the bucket."""
+        self.tokens += n
+        if self._waits:
+            self._reschedule()
+        elif self.tokens > self.burst:
+            self.tokens = float(self.burst)
+    
+    def _arm(self):
+        """Time the refill for when the first waiter can be served."""
+        self._update()
+        delay = (self._waits[0].n - self.tokens) / self.rate
+        expires = self.hub.time() + max(delay, self.resolution)
+        self._timer = RefillTimer(self, expires)
+        self.hub._add_timeout(self._timer)
+    
+    def _reschedule(self):
+        """Serve the waiters now, if the timer is not about to."""
+        if self._timer is not None:
+            self.hub._remove_timeout(self._timer)
+        self._refill()
+    
+    def _refill(self):
+        """Wake every waiter the tokens now cover, in order."""
+        self._timer = None
+        self._update()
+        waits = self._waits
+        while waits and waits[0].n <= self.tokens + EPSILON:
+            wait = waits.popleft()
+            self.tokens -= wait.n
+            self.hub._wake(wait)
+        if waits:
+            self._arm()
+        elif self.tokens > self.burst:
+            self.tokens = float(self.burst)
+    
+    def _unlink(self, wait):
+        """Forget a waiter that timed out or was cancelled."""
+        # Waits compare by expiry, so find this one by identity.
+        for i, other in enumerate(self._waits):
+            if other is wait:
+                del self._waits[i]
+                break
+        else:
+            return
+        if i == 0:
+            # The waiters behind may be served sooner.
+            if self._waits:
+                self._reschedule()
+            elif self._timer is not None:
+                self.hub._remove_timeout(self._timer)
+                self._timer = None
+
+
+def _acquire_some(bucket, n):
+    """Wait for at least one token, and take up to n."""
+    bucket.acquire(1)
+    return 1 + bucket.take(int(min(n, bucket.burst)) - 1)
+
+
+def send(sock, data, bucket, timeout=None):
+    """Send some data, using one token of bucket per byte.
+    
+    Waits until the socket is writable and at least one token is available,
+    then sends as many bytes as there are tokens; the tokens for bytes the
+    socket did not take are refunded.
+    """
+    ssl = greennet.ssl and isinstance(sock, greennet.ssl.peekable)
+    with greennet.deadline(timeout):
+        while True:
+            if not ssl:
+                greennet.writeable(sock)
+            n = _acquire_some(bucket, len(data))
+            sent = 0
+            try:
+                if ssl:
+                    sent = greennet.ssl.send(sock, buffer(data, 0, n))
+                else:
+                    sent = sock.send(buffer(data, 0, n))
+            except socket.error, err:
+                if err.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+            finally:
+                if sent < n:
+                    bucket.refund(n - sent)
+            if sent or not data:
+                return sent
+
+
+def sendall(sock, data, bucket, timeout=None):
+    """Send all the data, at most as fast as the bucket allows."""
+    with greennet.deadline(timeout):
+        while data:
+            data = buffer(data, send(sock, data, bucket))
+
+
+def recv(sock, bufsize, bucket, timeout=None):
+    """Receive some data, using one token of bucket per byte.
+    
+    Waits until the socket is readable and at least one token is available,
+    then receives at most as many bytes as there are tokens.
+    """
+    ssl = greennet.ssl and isinstance(sock, greennet.ssl.peekable)
+    with greennet.deadline(timeout):
+        while True:
+            if not ssl:
+                greennet.readable(sock)
+            n = _acquire_some(bucket, bufsize)
+            data = None
+            try:
+                if ssl:
+                    data = greennet.ssl.recv(sock, n)
+                else:
+                    data = sock.recv(n)
+            except socket.error, err:
+                if err.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+            finally:
+                received = 0 if data is None else len(data)
+                if received < n:
+                    bucket.refund(n - received)
+            if data is not None:
+                return data
@@ -0,0 +1,275 @@
+"""Results of spawned tasks, and waiting on several of them at once."""
+
+
+import sys
+
+import greennet
+from greennet import greenlet
+from greennet.hub import Wait, Cancelled
+
+
+class ResultWait(Wait):
+    
+    """Wait for some of a set of AsyncResults to be ready.
+    
+    The wait is linked to each of the results; those that become ready are
+    collected in the ready list, and the task is woken once, when need of
+    them are, however many results there are.
+    """
+    
+    __slots__ = ('results', 'need', 'ready', 'woken')
+    
+    def __init__(self, task, results, need, expires):
+        super(ResultWait, self).__init__(task, expires)
+        self.results = results
+        self.need = need
+        self.ready = []
+        self.woken = False
+        for result in results:
+            result._waits.append(self)
+    
+    def fire(self, hub, result):
+        """Called when one of the results is ready."""
+        self.ready.append(result)
+        if not self.woken and len(self.ready) >= self.need:
+            self.woken = True
+            hub._wake(self)
+    
+    def unlink(self):
+        """Stop waiting on the results."""
+        # Waits compare by expiry, so find this one by identity.
+        for result in self.results:
+            waits = result._waits
+            for i, wait in enumerate(waits):
+                if wait is self:
+                    del waits[i]
+                    break
+    
+    def timeout(self):
+        self.unlink()
+        super(ResultWait, self).timeout()
+    
+    def cancel(self, hub):
+        self.unlink()
+        super(ResultWait, self).cancel(hub)
+
+
+def _wait(hub, results, need, timeout):
+    """Suspend the current task until need of the pending results are
+    ready; return those that are.
+    """
+    wait = ResultWait(greenlet.getcurrent(), results, need,
+                      hub._expires(timeout))
+    try:
+        hub._suspend(wait)
+    finally:
+        wait.unlink()
+    return wait.ready
+
+
+class AsyncResult(object):
+    
+    """A value or an exception that will be available later.
+    
+    >>> result = AsyncResult()
+    >>> result.ready()
+    False
+    >>> result.get(0)
+    Traceback (most recent call last):
+        ...
+    Timeout
+    >>> result.set('a value')
+    >>> result.get()
+    'a value'
+    
+    >>> result = AsyncResult()
+    >>> result.set_exception(KeyError('a key'))
+    >>> result.successful()
+    False
+    >>> result.get()
+    Traceback (most recent call last):
+        ...
+    KeyError: 'a key'
+    """
+    
+    def __init__(self, hub=None):
+        self.hub = greennet.get_hub() if hub is None else hub
+        self.task = None
+        self.value = None
+        self.exception = None
+        self._traceback = None
+        self._ready = False
+        self._waits = []
+    
+    def ready(self):
+        """Return True if the value or exception has been set."""
+        return self._ready
+    
+    def successful(self):
+        """Return True if the value (rather than an exception) was set."""
+        return self._ready and self.exception is None
+    
+    def set(self, value=None):
+        """Set the value, waking all the tasks waiting for it at once."""
+        self._set(value, None, None)
+    
+    def set_exception(self, exc, traceback=None):
+        """Set an exception instance, to be raised by get()."""
+        self._set(None, exc, traceback)
+    
+    def _set(self, value, exc, traceback):
+        if self._ready:
+            raise RuntimeError('AsyncResult is already set')
+        self.value = value
+        self.exception = exc
+        self._traceback = traceback
+        self._ready = True
+        waits, self._waits = self._waits, []
+        for wait in waits:
+            wait.fire(self.hub, self)
+    
+    def get(self, timeout=None):
+        """Return the value, or raise the exception, suspending the current
+        task until one is set.
+        """
+        if not self._ready:
+            _wait(self.hub, [self], 1, timeout)
+        if self.exception is not None:
+            raise self.exception.__class__, self.exception, self._traceback
+        return self.value
+    
+    def cancel(self):
+        """Cancel the task computing the result (see spawn).
+        
+        A task that has not started is not run, and the result is set to
+        Cancelled at once. A waiting task has Cancelled raised in it (see
+        Hub.throw), which it may handle. Returns False if the result has no
+        task, is ready, or its task is running or about to resume, and
+        cannot be interrupted.
+        """
+        task = self.task
+        if task is None or self._ready:
+            return False
+        if not task and not task.dead:
+            self.set_exception(Cancelled())
+            return True
+        return self.hub.throw(task)
+
+
+def _run(result, func, args, kwargs):
+    """Body of a spawned task."""
+    if result._ready:
+        return      # cancelled before it started
+    try:
+        value = func(*args, **kwargs)
+    except Exception, err:
+        result.set_exception(err, sys.exc_info()[2])
+    else:
+        result.set(value)
+
+
+def spawn(func, *args, **kwargs):
+    """Run func(*args, **kwargs) in a new task; return an AsyncResult for
+    its return value or exception.
+    
+    >>> results = [spawn(pow, 2, n) for n in xrange(4)]
+    >>> [result.get() for result in results]
+    [1, 2, 4, 8]
+    """
+    hub = greennet.get_hub()
+    result = AsyncResult(hub)
+    result.task = greenlet(_run)
+    hub.schedule(result.task, result, func, args, kwargs)
+    return result
+
+
+def wait_any(results, timeout=None, cancel=True):
+    """Suspend the current task until any of the results is ready; return
+    that result.
+    
+    If cancel is true, the tasks computing the other results are then
+    cancelled (see AsyncResult.cancel), as when hedging a request across
+    replicas and keeping the first answer.
+    
+    >>> def sleep(n):
+    ...     greennet.sleep(n)
+    ...     return n
+    >>> results = [spawn(sleep, n) for n in (0.03, 0.01, 0.02)]
+    >>> wait_any(results).get()
+    0.01
+    >>> [result.get() for result in results]
+    Traceback (most recent call last):
+        ...
+    Cancelled
+    """
+    results = list(results)
+    if not results:
+        raise ValueError('no results to wait for')
+    for winner in results:
+        if winner._ready:
+            break
+    else:
+        winner = _wait(results[0].hub, results, 1, timeout)[0]
+    if cancel:
+        for result in results:
+            if result is not winner:
+                result.cancel()
+    return winner
+
+
+def wait_all(results, timeout=None):
+    """Suspend the current task until all the results are ready.
+    
+    >>> results = [spawn(pow, 2, n) for n in xrange(4)]
+    >>> wait_all(results)
+    >>> [result.ready() for result in results]
+    [True, True, True, True]
+    """
+    pending = [result for result in results if not result._ready]
+    if pending:
+        _wait(pending[0].hub, pending, len(pending), timeout)
+
+
+def as_completed(results, timeout=None):
+    """Yield the results as they become ready.
+    
+    Results that become ready during the same iteration of the loop are
+    yielded after a single suspension. The timeout, if given, is for all
+    the results; Timeout is raised from the iteration if it expires.
+    
+    >>> def sleep(n):
+    ...     greennet.sleep(n)
+    ...     return n
+    >>> results = [spawn(sleep, n) for n in (0.03, 0.01, 0.02)]
+    >>> [result.get() for result in as_completed(results)]
+    [0.01, 0.02, 0.03]
+    """
+    pending = []
+    for result in results:
+        if result._ready:
+            yield result
+        else:
+            pending.append(result)
+    if not pending:
+        return
+    hub = pending[0].hub
+    wait = ResultWait(None, pending, 1, hub._expires(timeout))
+    wait.woken = True       # not suspended yet
+    remaining = len(pending)
+    try:
+        while remaining:
+            if not wait.ready:
+                wait.task = greenlet.getcurrent()
+                wait.woken = False
+                hub._suspend(wait)
+            ready, wait.ready = wait.ready, []
+            remaining -= len(ready)
+            for result in ready:
+                yield result
+    finally:
+        wait.unlink()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -3,7 +3,6 @@
 
 from __future__ import with_statement
 from contextlib import closing
-import time
 import socket
 
 from OpenSSL import SSL, crypto
@@ -73,20 +72,16 @@ def _io(op, sock, args=(), kw=None, timeout=None):
         kw = {}
     if timeout is None:
         timeout = kw.pop('timeout', None)
-    if timeout is not None:
-        end = time.time() + timeout
-        kw['timeout'] = timeout
-    while True:
-        try:
-            return op(sock, *args, **kw)
-        except SSL.ZeroReturnError:
-            return ''
-        except SSL.WantReadError:
-            greennet.readable(sock, kw.get('timeout'))
-        except SSL.WantWriteError:
-            greennet.writable(sock, kw.get('timeout'))
-        if timeout is not None:
-            kw['timeout'] = end - time.time()
+    with greennet.deadline(timeout):
+        while True:
+            try:
+                return op(sock, *args, **kw)
+            except SSL.ZeroReturnError:
+                return ''
+            except SSL.WantReadError:
+                greennet.readable(sock)
+            except SSL.WantWriteError:
+                greennet.writeable(sock)
 
 
 def connect(sock, address=None, cert=None, verify=None, timeout=None):
@@ -100,15 +95,12 @@ def connect(sock, address=None, cert=None, verify=None, timeout=None):
     The calling task will be suspended until the socket is connected and the
     SSL handshake is complete.
     """
-    if address is not None:
-        if timeout is not None:
-            end = time.time() + timeout
-        greennet.connect(sock, address, timeout)
-        if timeout is not None:
-            timeout = end - time.time()
-    sock = _setup_connection(sock, cert, verify)
-    sock.set_connect_state()
-    _io(lambda sock: sock.do_handshake(), sock, timeout=timeout)
+    with greennet.deadline(timeout):
+        if address is not None:
+            greennet.connect(sock, address)
+        sock = _setup_connection(sock, cert, verify)
+        sock.set_connect_state()
+        _io(lambda sock: sock.do_handshake(), sock)
     return sock
 
 
@@ -155,14 +147,10 @@ def shutdown(sock, timeout=None):
     Calls the SSL shutdown method until it completes. The calling task will be
     suspended until this completes.
     """
-    if timeout is not None:
-        end = time.time() + timeout
     h = greennet.get_hub()
-    while not sock.shutdown():
-        h.poll(sock, read=sock.want_read(),
-               write=sock.want_write(), timeout=timeout)
-        if timeout is not None:
-            timeout = end - time.time()
+    with h.deadline(timeout):
+        while not sock.shutdown():
+            h.poll(sock, read=sock.want_read(), write=sock.want_write())
 
 
 def renegotiate_client(sock, cert=None, verify=None, timeout=None):
@@ -190,15 +178,12 @@ def renegotiate_server(sock, cert=None, verify=None, timeout=None):
     Specify new certificates and verification options, and re-handshake. The
     calling task will be suspended until the re-handshake is complete.
     """
-    if timeout is not None:
-        end = time.time() + timeout
-    shutdown(sock, timeout)
-    if timeout is not None:
-        timeout = end - time.time()
-    sock = sock.dup()
-    sock = _setup_connection(sock, cert, verify)
-    sock.set_accept_state()
-    _io(lambda sock: sock.do_handshake(), sock, timeout=timeout)
+    with greennet.deadline(timeout):
+        shutdown(sock)
+        sock = sock.dup()
+        sock = _setup_connection(sock, cert, verify)
+        sock.set_accept_state()
+        _io(lambda sock: sock.do_handshake(), sock)
     return sock
 
 
@@ -0,0 +1,423 @@
+"""Synchronization primitives for tasks."""
+
+
+from __future__ import with_statement
+from collections import deque
+
+from greennet import greenlet
+from greennet import get_hub
+from greennet.hub import Wait, Timeout
+
+
+class SyncWait(Wait):
+    
+    """Wait in a Waiters queue.
+    
+    A wait that times out or is cancelled is only marked inactive, so that
+    leaving the queue is O(1); Waiters skips and compacts inactive waits.
+    """
+    
+    __slots__ = ('waiters', 'active')
+    
+    def __init__(self, task, waiters, expires):
+        super(SyncWait, self).__init__(task, expires)
+        self.waiters = waiters
+        self.active = True
+    
+    def timeout(self):
+        self.waiters._discard(self)
+        super(SyncWait, self).timeout()
+    
+    def cancel(self, hub):
+        self.waiters._discard(self)
+        super(SyncWait, self).cancel(hub)
+
+
+class Waiters(object):
+    
+    """A FIFO queue of suspended tasks, woken one at a time or all at once."""
+    
+    __slots__ = ('hub', 'waits', 'dead')
+    
+    def __init__(self, hub):
+        self.hub = hub
+        self.waits = deque()
+        self.dead = 0
+    
+    def __len__(self):
+        """Number of tasks waiting."""
+        return len(self.waits) - self.dead
+    
+    def wait(self, expires):
+        """Suspend the current task until woken, or until expires.
+        
+        The expiry time comes from Hub._expires, or is None to ignore the
+        task's expired Deadline.
+        """
+        wait = SyncWait(greenlet.getcurrent(), self, expires)
+        self.waits.append(wait)
+        self.hub._suspend(wait)
+    
+    def wake_one(self):
+        """Wake the longest-waiting task; return it, or None if none waits."""
+        waits = self.waits
+        while waits:
+            wait = waits.popleft()
+            if wait.active:
+                wait.active = False
+                self.hub._wake(wait)
+                return wait.task
+            self.dead -= 1
+        return None
+    
+    def wake_all(self):
+        """Wake every waiting task, in order."""
+        waits = self.waits
+        self.waits = deque()
+        self.dead = 0
+        hub = self.hub
+        for wait in waits:
+            if wait.active:
+                wait.active = False
+                hub._wake(wait)
+    
+    def _discard(self, wait):
+        if not wait.active:
+            return
+        wait.active = False
+        self.dead += 1
+        if self.dead > 16 and self.dead * 2 > len(self.waits):
+            self.waits = deque([w for w in self.waits if w.active])
+            self.dead = 0
+
+
+class Event(object):
+    
+    """A flag that tasks can wait to be set.
+    
+    >>> e = Event()
+    >>> e.is_set()
+    False
+    >>> e.wait(0)
+    Traceback (most recent call last):
+        ...
+    Timeout
+    >>> e.set()
+    >>> e.wait()
+    >>> e.clear()
+    >>> e.is_set()
+    False
+    """
+    
+    def __init__(self, hub=None):
+        self.hub = get_hub() if hub is None else hub
+        self._flag = False
+        self._waiters = Waiters(self.hub)
+    
+    def is_set(self):
+        return self._flag
+    
+    def set(self):
+        """Set the flag, waking all the waiting tasks at once."""
+        self._flag = True
+        self._waiters.wake_all()
+    
+    def clear(self):
+        self._flag = False
+    
+    def wait(self, timeout=None):
+        """Suspend the current task until the flag is set."""
+        if not self._flag:
+            self._waiters.wait(self.hub._expires(timeout))
+
+
+class Lock(object):
+    
+    """A mutual-exclusion lock.
+    
+    A released Lock is handed straight to the task that has waited longest,
+    so waiters are served in order and only one of them is woken.
+    
+    >>> lock = Lock()
+    >>> lock.acquire()
+    True
+    >>> lock.acquire(False)
+    False
+    >>> lock.acquire(timeout=0)
+    Traceback (most recent call last):
+        ...
+    Timeout
+    >>> lock.release()
+    >>> with lock:
+    ...     lock.locked()
+    True
+    """
+    
+    def __init__(self, hub=None):
+        self.hub = get_hub() if hub is None else hub
+        self._locked = False
+        self._waiters = Waiters(self.hub)
+    
+    def locked(self):
+        return self._locked
+    
+    def acquire(self, blocking=True, timeout=None):
+        """Acquire the Lock, suspending the current task until it is free.
+        
+        Returns False if blocking is false and the Lock is taken, and
+        raises Timeout if it cannot be had within timeout seconds.
+        """
+        if not self._locked:
+            self._locked = True
+            return True
+        if not blocking:
+            return False
+        self._waiters.wait(self.hub._expires(timeout))
+        return True
+    
+    def release(self):
+        if not self._locked:
+            raise RuntimeError('release of an unlocked Lock')
+        if self._waiters.wake_one() is None:
+            self._locked = False
+    
+    __enter__ = acquire
+    
+    def __exit__(self, *exc_info):
+        self.release()
+    
+    def _release_save(self):
+        self.release()
+    
+    def _acquire_restore(self, state, expires):
+        if not self._locked:
+            self._locked = True
+        else:
+            self._waiters.wait(expires)
+    
+    def _is_owned(self):
+        return self._locked
+
+
+class RLock(object):
+    
+    """A Lock that the task holding it may acquire again; it is released
+    when release() has been called as many times as acquire().
+    
+    >>> lock = RLock()
+    >>> with lock:
+    ...     with lock:
+    ...         pass
+    >>> lock.release()
+    Traceback (most recent call last):
+        ...
+    RuntimeError: release of an RLock not held by the current task
+    """
+    
+    def __init__(self, hub=None):
+        self.hub = get_hub() if hub is None else hub
+        self._owner = None
+        self._count = 0
+        self._waiters = Waiters(self.hub)
+    
+    def acquire(self, blocking=True, timeout=None):
+        """Acquire the RLock, as Lock.acquire."""
+        task = greenlet.getcurrent()
+        if self._owner is task:
+            self._count += 1
+            return True
+        if self._owner is None:
+            self._owner = task
+            self._count = 1
+            return True
+        if not blocking:
+            return False
+        self._waiters.wait(self.hub._expires(timeout))
+        return True
+    
+    def release(self):
+        if self._owner is not greenlet.getcurrent():
+            raise RuntimeError('release of an RLock not held by the '
+                               'current task')
+        self._count -= 1
+        if not self._count:
+            self._hand_over(1)
+    
+    __enter__ = acquire
+    
+    def __exit__(self, *exc_info):
+        self.release()
+    
+    def _hand_over(self, count):
+        """Pass the RLock to the next waiting task, which will hold it count
+        times, or free it.
+        """
+        self._owner = self._waiters.wake_one()
+        self._count = count if self._owner is not None else 0
+    
+    def _release_save(self):
+        if self._owner is not greenlet.getcurrent():
+            raise RuntimeError('release of an RLock not held by the '
+                               'current task')
+        count = self._count
+        self._count = 0
+        self._hand_over(1)
+        return count
+    
+    def _acquire_restore(self, count, expires):
+        if self._owner is None:
+            self._owner = greenlet.getcurrent()
+        else:
+            self._waiters.wait(expires)
+        self._count = count
+    
+    def _is_owned(self):
+        return self._owner is greenlet.getcurrent()
+
+
+class Semaphore(object):
+    
+    """A counter of available resources; acquire() takes one, suspending
+    the current task while there are none, and release() returns one.
+    
+    >>> s = Semaphore(2)
+    >>> s.acquire(), s.acquire(), s.acquire(False)
+    (True, True, False)
+    >>> s.release()
+    >>> s.acquire()
+    True
+    """
+    
+    def __init__(self, value=1, hub=None):
+        if value < 0:
+            raise ValueError('Semaphore initial value must be >= 0')
+        self.hub = get_hub() if hub is None else hub
+        self._value = value
+        self._waiters = Waiters(self.hub)
+    
+    def acquire(self, blocking=True, timeout=None):
+        """Take a resource, as Lock.acquire."""
+        if self._value:
+            self._value -= 1
+            return True
+        if not blocking:
+            return False
+        self._waiters.wait(self.hub._expires(timeout))
+        return True
+    
+    def release(self):
+        """Return a resource, handing it straight to a waiting task."""
+        if self._waiters.wake_one() is None:
+            self._value += 1
+    
+    __enter__ = acquire
+    
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class BoundedSemaphore(Semaphore):
+    
+    """A Semaphore that may not be released more times than acquired.
+    
+    >>> s = BoundedSemaphore(1)
+    >>> s.release()
+    Traceback (most recent call last):
+        ...
+    ValueError: BoundedSemaphore released too many times
+    """
+    
+    def __init__(self, value=1, hub=None):
+        super(BoundedSemaphore, self).__init__(value, hub)
+        self._initial = value
+    
+    def release(self):
+        if self._value >= self._initial:
+            raise ValueError('BoundedSemaphore released too many times')
+        super(BoundedSemaphore, self).release()
+
+
+class Condition(object):
+    
+    """A condition variable, associated with a Lock or RLock (by default, a
+    new RLock).
+    
+    wait() releases the lock while it waits, and always reacquires it
+    before returning or raising, Timeout included.
+    """
+    
+    def __init__(self, lock=None, hub=None):
+        self.hub = get_hub() if hub is None else hub
+        self.lock = RLock(self.hub) if lock is None else lock
+        self.acquire = self.lock.acquire
+        self.release = self.lock.release
+        self._waiters = Waiters(self.hub)
+    
+    def __enter__(self):
+        return self.lock.__enter__()
+    
+    def __exit__(self, *exc_info):
+        return self.lock.__exit__(*exc_info)
+    
+    def wait(self, timeout=None):
+        """Release the lock, suspend the current task until notified, and
+        reacquire the lock.
+        """
+        if not self.lock._is_owned():
+            raise RuntimeError('cannot wait on an un-acquired Condition')
+        expires = self.hub._expires(timeout)
+        state = self.lock._release_save()
+        try:
+            self._waiters.wait(expires)
+        finally:
+            self._reacquire(state)
+    
+    def _reacquire(self, state):
+        """Reacquire the lock after wait(), even past an expired Deadline.
+        
+        If a Deadline expires while the lock is being reacquired, it is
+        reacquired anyway, then Timeout is raised.
+        """
+        timed_out = False
+        while True:
+            try:
+                self.lock._acquire_restore(state, None)
+            except Timeout:
+                timed_out = True
+            else:
+                break
+        if timed_out:
+            raise Timeout()
+    
+    def wait_for(self, predicate, timeout=None):
+        """Wait until predicate() is true, and return its value.
+        
+        The timeout covers all the waits needed.
+        """
+        result = predicate()
+        if result:
+            return result
+        with self.hub.deadline(timeout):
+            while not result:
+                self.wait()
+                result = predicate()
+        return result
+    
+    def notify(self, n=1):
+        """Wake up to n of the tasks waiting on the Condition."""
+        if not self.lock._is_owned():
+            raise RuntimeError('cannot notify on an un-acquired Condition')
+        for i in xrange(n):
+            if self._waiters.wake_one() is None:
+                break
+    
+    def notify_all(self):
+        """Wake all the tasks waiting on the Condition."""
+        if not self.lock._is_owned():
+            raise RuntimeError('cannot notify on an un-acquired Condition')
+        self._waiters.wake_all()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -1,6 +1,9 @@
 """Utility functions."""
 
 
+import re
+
+
 def prefixes(s):
     """Generator yielding all prefixes of s.
     
@@ -11,6 +14,98 @@ def prefixes(s):
         yield s[:i]
 
 
+class Matcher(object):
+    
+    """Incremental search for one or more terminators (Aho-Corasick).
+    
+    The automaton is built once; the search state is an int that the
+    caller carries from one chunk of data to the next, so a terminator
+    split across chunks is found without scanning any byte twice.
+    
+    >>> m = Matcher(('\\r\\n', '\\n\\n'))
+    >>> m.search('some da')
+    (-1, 0)
+    >>> end, state = m.search('ta\\r')
+    >>> end, state
+    (-1, 1)
+    >>> m.search('\\nmore', state)
+    (1, 2)
+    >>> m.matched(2)
+    '\\r\\n'
+    """
+    
+    def __init__(self, terms):
+        if isinstance(terms, basestring):
+            terms = (terms,)
+        terms = tuple(terms)
+        if not terms or not all(terms):
+            raise ValueError('empty terminator')
+        self.terms = terms
+        # Build the trie; state 0 is the root.
+        goto = [{}]
+        output = [None]
+        for term in terms:
+            state = 0
+            for c in term:
+                if c not in goto[state]:
+                    goto[state][c] = len(goto)
+                    goto.append({})
+                    output.append(None)
+                state = goto[state][c]
+            if output[state] is None:
+                output[state] = term
+        # Turn it into a DFA breadth-first, following failure links, so
+        # that every byte costs exactly one dict lookup.
+        trans = [None] * len(goto)
+        trans[0] = dict(goto[0])
+        queue = [(s, 0) for s in goto[0].itervalues()]
+        for state, fail in queue:
+            if output[state] is None:
+                output[state] = output[fail]
+            trans[state] = table = dict(trans[fail])
+            for c, child in goto[state].iteritems():
+                table[c] = child
+                queue.append((child, trans[fail].get(c, 0)))
+        self._trans = trans
+        self._output = output
+        starts = ''.join(sorted(trans[0]))
+        if len(starts) == 1:
+            self._skip = lambda data, pos: data.find(starts, pos)
+        else:
+            search = re.compile('[%s]' % (re.escape(starts),)).search
+            def skip(data, pos):
+                m = search(data, pos)
+                return m.start() if m else -1
+            self._skip = skip
+    
+    def search(self, data, state=0):
+        """Scan data, starting from a state returned by a previous call.
+        
+        Returns (end, state): end is the index just past the first
+        terminator to complete in data, or -1 if none did.
+        """
+        trans = self._trans
+        output = self._output
+        pos = 0
+        size = len(data)
+        while pos < size:
+            if not state:
+                # Nothing is partially matched: skip ahead (in C) to the
+                # next byte that can start a terminator.
+                pos = self._skip(data, pos)
+                if pos < 0:
+                    return -1, 0
+            state = trans[state].get(data[pos], 0)
+            pos += 1
+            if output[state] is not None:
+                return pos, state
+        return -1, state
+    
+    def matched(self, state):
+        """Return the terminator completed in state, or None."""
+        return self._output[state]
+
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()
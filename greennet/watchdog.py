@@ -0,0 +1,87 @@
+"""Detect tasks that block the Hub for too long."""
+
+
+import sys
+import time
+import thread
+import logging
+import threading
+import traceback
+
+from greennet import get_hub
+
+
+log = logging.getLogger('greennet.watchdog')
+
+
+def log_blocked(task, elapsed, stack):
+    """Default Watchdog callback: log a warning with the task's stack."""
+    log.warning('%r has blocked the hub for %.3f seconds:\n%s',
+                task, elapsed, stack)
+
+
+class Watchdog(object):
+    
+    """Report tasks that do not switch back to the Hub in time.
+    
+    A monitor thread checks every interval seconds (by default, half the
+    threshold) whether the task the Hub last switched into has been running
+    for more than threshold seconds. If so, it captures the stack of the
+    Hub's thread and calls callback(task, elapsed, stack) from the monitor
+    thread, once per offending switch. The default callback is log_blocked.
+    
+    The monitor only gets to run when the blocking code releases the GIL,
+    which blocking system calls and long-running Python code both do.
+    """
+    
+    def __init__(self, hub=None, threshold=0.1, callback=None, interval=None):
+        self.hub = get_hub() if hub is None else hub
+        self.threshold = threshold
+        self.callback = log_blocked if callback is None else callback
+        self.interval = threshold / 2.0 if interval is None else interval
+        self._current = None
+        self._reported = None
+        self._stopped = threading.Event()
+        self._thread = None
+    
+    def before_switch(self, task):
+        self._current = (task, time.time(), thread.get_ident())
+    
+    def after_switch(self, task):
+        self._current = None
+    
+    def start(self):
+        """Install the switch hook and start the monitor thread."""
+        self._stopped.clear()
+        self.hub.switch_hooks.append(self)
+        self._thread = threading.Thread(target=self._monitor,
+                                        name='greennet.watchdog')
+        self._thread.setDaemon(True)
+        self._thread.start()
+    
+    def stop(self):
+        """Remove the switch hook and stop the monitor thread."""
+        self.hub.switch_hooks.remove(self)
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+    
+    def check(self):
+        """Report the current task if it has exceeded the threshold."""
+        current = self._current
+        if current is None or current is self._reported:
+            return
+        task, started, ident = current
+        elapsed = time.time() - started
+        if elapsed < self.threshold:
+            return
+        frame = sys._current_frames().get(ident)
+        if frame is None or self._current is not current:
+            return
+        self._reported = current
+        self.callback(task, elapsed, ''.join(traceback.format_stack(frame)))
+    
+    def _monitor(self):
+        while not self._stopped.isSet():
+            self.check()
+            self._stopped.wait(self.interval)
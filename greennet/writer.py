@@ -0,0 +1,179 @@
+"""Buffered writing to sockets."""
+
+
+from greennet import greenlet
+from greennet import get_hub, send, ssl, COALESCE_LIMIT, _coalesce
+from greennet.hub import Wait, Timeout, Cancelled
+
+
+class FlushWait(Wait):
+    
+    """Wait for a WriteBuffer to be flushed."""
+    
+    __slots__ = ('writer',)
+    
+    def __init__(self, task, writer, expires):
+        super(FlushWait, self).__init__(task, expires)
+        self.writer = writer
+    
+    def _waits(self):
+        return self.writer._flush_waits
+    
+    def _unlink(self):
+        # Waits compare by expiry, so find this one by identity.
+        waits = self._waits()
+        for i, wait in enumerate(waits):
+            if wait is self:
+                del waits[i]
+                break
+    
+    def timeout(self):
+        self._unlink()
+        super(FlushWait, self).timeout()
+    
+    def cancel(self, hub):
+        self._unlink()
+        super(FlushWait, self).cancel(hub)
+
+
+class DrainWait(FlushWait):
+    
+    """Wait for a WriteBuffer to drain to its low watermark."""
+    
+    __slots__ = ()
+    
+    def _waits(self):
+        return self.writer._drain_waits
+
+
+class WriteBuffer(object):
+    
+    """Coalesce small writes to a socket into one send per Hub tick.
+    
+    write() buffers the data, and a flush task scheduled on the Hub sends
+    everything written during the current tick in as few sends as possible.
+    If sending fails, the error is raised by the next write(), drain() or
+    flush(), and the buffered data is discarded.
+    
+    Without a high watermark, write() never blocks. With one, a write that
+    takes the buffered size over high suspends the writer until the flush
+    task has brought it down to low (by default, a quarter of high), which
+    bounds the memory a slow peer can make the buffer hold.
+    
+    timeout, if given, is the default timeout of write(), drain() and
+    flush(), and bounds each send of the flush task too, so a peer that
+    stops reading cannot hold the buffer forever; a send timing out is an
+    error like any other. Call close() before closing the socket.
+    """
+    
+    def __init__(self, sock, hub=None, high=None, low=None, timeout=None):
+        self.sock = sock
+        self.hub = get_hub() if hub is None else hub
+        self.timeout = timeout
+        if low is None:
+            low = 0 if high is None else high // 4
+        if high is not None and low > high:
+            raise ValueError('low watermark above high watermark')
+        self.high = high
+        self.low = low
+        self.error = None
+        if ssl and isinstance(sock, ssl.peekable):
+            self._send = ssl.send
+        else:
+            self._send = send
+        self._bufs = []
+        self._size = 0
+        self._flusher = None
+        self._flush_waits = []
+        self._drain_waits = []
+    
+    def __len__(self):
+        """Number of bytes written but not yet sent."""
+        return self._size
+    
+    def write(self, data, timeout=None):
+        """Buffer data to be sent at the end of the current tick.
+        
+        If that takes the buffered size over the high watermark, suspend
+        the current task as drain(timeout) does; the data stays buffered
+        even if Timeout is raised.
+        """
+        if self.error is not None:
+            raise self.error
+        if not data:
+            return
+        self._bufs.append(data)
+        self._size += len(data)
+        if self._flusher is None:
+            self._flusher = greenlet(self._flush)
+            self.hub.schedule(self._flusher)
+        if self.high is not None and self._size > self.high:
+            self.drain(timeout)
+    
+    def drain(self, timeout=None):
+        """Suspend the current task until at most low bytes are buffered."""
+        if timeout is None:
+            timeout = self.timeout
+        if self._size > self.low and self.error is None:
+            wait = DrainWait(greenlet.getcurrent(), self,
+                             self.hub._expires(timeout))
+            self._drain_waits.append(wait)
+            self.hub._suspend(wait)
+        if self.error is not None:
+            raise self.error
+    
+    def flush(self, timeout=None):
+        """Suspend the current task until all buffered data has been sent."""
+        if timeout is None:
+            timeout = self.timeout
+        if self._flusher is not None:
+            wait = FlushWait(greenlet.getcurrent(), self,
+                             self.hub._expires(timeout))
+            self._flush_waits.append(wait)
+            self.hub._suspend(wait)
+        if self.error is not None:
+            raise self.error
+    
+    def close(self):
+        """Discard the buffered data, and stop the flush task.
+        
+        The flush task's wait is cancelled at once, so the Hub stops
+        polling the socket, which can then be closed.
+        """
+        self._bufs = []
+        self._size = 0
+        if self._flusher is not None:
+            self.hub.throw(self._flusher)
+    
+    def _wake(self, waits):
+        for wait in waits:
+            self.hub._wake(wait)
+    
+    def _flush(self):
+        """Send buffered data until there is none; run as a task."""
+        _send = self._send
+        timeout = self.timeout
+        try:
+            while self._bufs:
+                bufs, self._bufs = self._bufs, []
+                try:
+                    for data in _coalesce(bufs, COALESCE_LIMIT):
+                        while data:
+                            sent = _send(self.sock, data, timeout)
+                            data = buffer(data, sent)
+                            self._size -= sent
+                            if self._drain_waits and self._size <= self.low:
+                                waits, self._drain_waits = \
+                                    self._drain_waits, []
+                                self._wake(waits)
+                except (EnvironmentError, Timeout, Cancelled), err:
+                    self.error = err
+                    self._bufs = []
+                    self._size = 0
+                    break
+        finally:
+            self._flusher = None
+            waits = self._drain_waits + self._flush_waits
+            self._drain_waits = []
+            self._flush_waits = []
+            self._wake(waits)
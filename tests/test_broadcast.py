@@ -0,0 +1,162 @@
+import unittest
+
+import greennet
+from greennet import broadcast
+from greennet.broadcast import Broadcast, Closed, Disconnected
+
+
+class BroadcastTestCase(unittest.TestCase):
+    def setUp(self):
+        self.hub = greennet.hub.VirtualClockHub()
+    
+    def spawn(self, func, *args):
+        self.hub.schedule(greennet.greenlet(func), *args)
+
+
+class TestBroadcast(BroadcastTestCase):
+    def test_fan_out(self):
+        channel = Broadcast(16, hub=self.hub)
+        received = dict((i, []) for i in xrange(5))
+        def subscriber(i, sub):
+            for message in sub:
+                received[i].append(message)
+        for i in xrange(5):
+            self.spawn(subscriber, i, channel.subscribe())
+        self.hub.switch()
+        for i in xrange(10):
+            channel.publish(i)
+            if i % 3 == 0:
+                self.hub.switch()
+        channel.close()
+        self.hub.run()
+        for i in xrange(5):
+            self.assertEqual(received[i], range(10))
+        self.assertEqual(len(channel), 5)
+        self.assertRaises(Closed, channel.publish, 'late')
+        self.assertRaises(Closed, channel.subscribe)
+    
+    def test_batch_wake(self):
+        channel = Broadcast(16, hub=self.hub)
+        wakeups = []
+        def subscriber(sub):
+            while True:
+                try:
+                    wakeups.append(sub.recv_many())
+                except Closed:
+                    return
+        for i in xrange(100):
+            self.spawn(subscriber, channel.subscribe())
+        self.hub.switch()
+        self.assertEqual(len(channel._readers), 100)
+        channel.publish_many(['a', 'b', 'c'])
+        channel.publish('d')
+        self.assertEqual(len(channel._readers), 0)
+        self.hub.switch()
+        # Each subscriber was woken once, and read everything at once.
+        self.assertEqual(wakeups, [['a', 'b', 'c', 'd']] * 100)
+        channel.close()
+        self.hub.run()
+    
+    def test_recv_timeout(self):
+        channel = Broadcast(4, hub=self.hub)
+        sub = channel.subscribe()
+        self.assertRaises(greennet.Timeout, sub.recv, 5)
+        self.assertEqual(self.hub.time(), 5)
+        self.assertEqual(len(channel._readers), 0)
+        channel.publish_many('abc')
+        self.assertEqual(len(sub), 3)
+        self.assertEqual(sub.recv(), 'a')
+        self.assertEqual(sub.recv_many(1), ['b'])
+        self.assertEqual(sub.recv_many(), ['c'])
+    
+    def test_late_subscriber(self):
+        channel = Broadcast(4, hub=self.hub)
+        channel.publish('before')
+        sub = channel.subscribe()
+        channel.publish('after')
+        self.assertEqual(sub.recv_many(), ['after'])
+    
+    def test_wraparound(self):
+        channel = Broadcast(3, hub=self.hub)
+        sub = channel.subscribe()
+        got = []
+        for i in xrange(10):
+            channel.publish_many([i, i])
+            got.extend(sub.recv_many())
+        self.assertEqual(got, [i for i in xrange(10) for j in xrange(2)])
+    
+    def test_invalid(self):
+        self.assertRaises(ValueError, Broadcast, 0, hub=self.hub)
+        self.assertRaises(ValueError, Broadcast, 1, 'ignore', hub=self.hub)
+
+
+class TestPolicies(BroadcastTestCase):
+    def test_drop(self):
+        channel = Broadcast(4, hub=self.hub)
+        slow, fast = channel.subscribe(), channel.subscribe()
+        for i in xrange(10):
+            channel.publish(i)
+            self.assertEqual(fast.recv(), i)
+        self.assertEqual(len(slow), 4)
+        self.assertEqual(slow.recv_many(), [6, 7, 8, 9])
+        self.assertEqual(slow.dropped, 6)
+        self.assertEqual(fast.dropped, 0)
+    
+    def test_disconnect(self):
+        channel = Broadcast(8, broadcast.DISCONNECT, hub=self.hub)
+        slow, fast = channel.subscribe(), channel.subscribe()
+        channel.publish_many(range(4))
+        self.assertEqual(slow.recv_many(2), [0, 1])
+        self.assertEqual(fast.recv_many(), range(4))
+        channel.publish_many(range(4, 11))
+        self.assertEqual(fast.recv_many(), range(4, 11))
+        self.assertRaises(Disconnected, slow.recv)
+        self.assertRaises(Closed, slow.recv)
+        self.assertEqual(len(channel), 1)
+    
+    def test_block(self):
+        channel = Broadcast(4, broadcast.BLOCK, hub=self.hub)
+        sub = channel.subscribe()
+        got = []
+        def subscriber():
+            for message in sub:
+                got.append((message, self.hub.time()))
+                self.hub.sleep(1)
+        self.spawn(subscriber)
+        channel.publish_many(range(10))
+        # The publisher was held back until the subscriber had read two
+        # buffers' worth.
+        self.assertEqual(self.hub.time(), 4)
+        self.assertEqual(channel._backlog(), 2)
+        channel.close()
+        self.hub.run()
+        self.assertEqual(got, [(i, i) for i in xrange(10)])
+    
+    def test_block_timeout(self):
+        channel = Broadcast(2, broadcast.BLOCK, hub=self.hub)
+        sub = channel.subscribe()
+        self.assertRaises(greennet.Timeout, channel.publish_many, 'abc', 1)
+        self.assertEqual(sub.recv_many(), ['a', 'b'])
+        # Closing the slow subscriber unblocks the publisher as well.
+        channel.publish_many('cd')
+        sub.close()
+        channel.publish_many('efg')
+        self.assertEqual(len(channel), 0)
+    
+    def test_slowest_cursor(self):
+        channel = Broadcast(8, broadcast.BLOCK, hub=self.hub)
+        subs = [channel.subscribe() for i in xrange(3)]
+        channel.publish_many(range(6))
+        subs[0].recv_many(2)
+        subs[1].recv_many(4)
+        self.assertEqual(channel._tail, 0)
+        subs[2].recv_many(1)
+        self.assertEqual(channel._tail, 1)
+        subs[2].close()
+        self.assertEqual(channel._tail, 2)
+        subs[0].recv_many()
+        self.assertEqual(channel._tail, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
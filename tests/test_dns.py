@@ -0,0 +1,305 @@
+import socket
+import struct
+import unittest
+
+import greennet
+from greennet import dns
+
+
+class StubServer(object):
+    
+    """Answers DNS queries from a dict of names to lists of records.
+    
+    Records are (type, rdata, ttl) tuples, optionally followed by the
+    encoded owner name if it is not the queried name. With truncate set,
+    answers over UDP are truncated, and only complete over TCP.
+    """
+    
+    def __init__(self, hub):
+        self.hub = hub
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.setblocking(False)
+        self.address = self.sock.getsockname()
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(self.address)
+        self.listener.listen(5)
+        self.listener.setblocking(False)
+        self.records = {}
+        self.soa_ttl = None
+        self.delay = 0
+        self.silent = False
+        self.truncate = False
+        self.queries = []
+        self.hub.schedule(greennet.greenlet(self.serve))
+        self.hub.schedule(greennet.greenlet(self.serve_tcp))
+    
+    def close(self):
+        self.sock.close()
+        self.listener.close()
+    
+    def serve(self):
+        while True:
+            self.hub.poll(self.sock, read=True)
+            query, addr = self.sock.recvfrom(512)
+            self.hub.schedule(greennet.greenlet(self.answer), query, addr)
+    
+    def serve_tcp(self):
+        while True:
+            self.hub.poll(self.listener, read=True)
+            conn = self.listener.accept()[0]
+            self.hub.poll(conn, read=True)
+            data = conn.recv(1024)
+            response = self.respond(data[2:], tcp=True)
+            conn.sendall(struct.pack('!H', len(response)) + response)
+            conn.close()
+    
+    def answer(self, query, addr):
+        response = self.respond(query)
+        if response is not None:
+            self.sock.sendto(response, addr)
+    
+    def respond(self, query, tcp=False):
+        ident = struct.unpack('!H', query[:2])[0]
+        name, end = dns._read_name(query, 12)
+        qtype = struct.unpack('!H', query[end:end + 2])[0]
+        self.queries.append((name, qtype, tcp))
+        if self.delay:
+            self.hub.sleep(self.delay)
+        if self.silent:
+            return None
+        question = query[12:end + 4]
+        records = self.records.get(name)
+        answers = ''
+        authority = ''
+        if records is None:
+            rcode = dns.RCODE_NXDOMAIN
+        else:
+            rcode = dns.RCODE_NOERROR
+            records = [r for r in records if r[0] in (qtype, dns.TYPE_CNAME)]
+            for record in records:
+                rtype, rdata, ttl = record[:3]
+                owner = record[3:] and record[3] or '\xc0\x0c'
+                answers += owner + struct.pack('!HHIH', rtype, dns.CLASS_IN,
+                                               ttl, len(rdata)) + rdata
+        if not answers and self.soa_ttl is not None:
+            rdata = '\0\0' + struct.pack('!IIIII', 1, 2, 3, 4, self.soa_ttl)
+            authority = struct.pack('!HHHIH', 0xc00c, dns.TYPE_SOA,
+                                    dns.CLASS_IN, 3600, len(rdata)) + rdata
+        flags = 0x8180 | rcode
+        if self.truncate and not tcp:
+            flags |= dns.FLAG_TC
+            records = ()
+            answers = authority = ''
+        header = struct.pack('!HHHHHH', ident, flags, 1,
+                             len(records or ()), bool(authority), 0)
+        return header + question + answers + authority
+
+
+def a_record(ip, ttl=300):
+    return (1, socket.inet_aton(ip), ttl)
+
+
+class TestResolver(unittest.TestCase):
+    def setUp(self):
+        self.hub = greennet.hub.VirtualClockHub()
+        self.server = StubServer(self.hub)
+        self.resolver = dns.Resolver([self.server.address], hosts={},
+                                     timeout=5, tries=2, search=[], ndots=1,
+                                     hub=self.hub)
+    
+    def tearDown(self):
+        self.server.close()
+    
+    def test_address(self):
+        self.assertEqual(self.resolver.resolve('127.0.0.1', 80),
+                         [('127.0.0.1', 80)])
+        self.assertEqual(self.server.queries, [])
+    
+    def test_hosts(self):
+        self.resolver.hosts = {('myhost', socket.AF_INET): ['10.0.0.1']}
+        self.assertEqual(self.resolver.resolve('MyHost', 80),
+                         [('10.0.0.1', 80)])
+        self.assertEqual(self.server.queries, [])
+    
+    def test_resolve(self):
+        self.server.records['example.com'] = [a_record('10.0.0.1'),
+                                              a_record('10.0.0.2')]
+        self.assertEqual(self.resolver.resolve('example.com', 80),
+                         [('10.0.0.1', 80), ('10.0.0.2', 80)])
+        self.assertEqual(self.server.queries,
+                         [('example.com', 1, False)])
+    
+    def test_cname(self):
+        target = '\x07example\x03com\x00'
+        self.server.records['www.example.com'] = [
+            (dns.TYPE_CNAME, target, 600),
+            (1, socket.inet_aton('10.0.0.1'), 60, target),
+            (1, socket.inet_aton('10.9.9.9'), 60, '\x05other\x00'),
+        ]
+        self.assertEqual(self.resolver.resolve('www.example.com', 80),
+                         [('10.0.0.1', 80)])
+        expires = self.resolver.cache[('www.example.com', socket.AF_INET)][0]
+        self.assertEqual(expires, 60)
+    
+    def test_ttl_cache(self):
+        self.server.records['example.com'] = [a_record('10.0.0.1', 60)]
+        self.resolver.resolve('example.com', 80)
+        self.hub.sleep(59)
+        self.resolver.resolve('example.com', 443)
+        self.assertEqual(len(self.server.queries), 1)
+        self.hub.sleep(1)
+        self.resolver.resolve('example.com', 80)
+        self.assertEqual(len(self.server.queries), 2)
+    
+    def test_max_ttl(self):
+        self.resolver.max_ttl = 10
+        self.server.records['example.com'] = [a_record('10.0.0.1', 3600)]
+        self.resolver.resolve('example.com', 80)
+        self.hub.sleep(10)
+        self.resolver.resolve('example.com', 80)
+        self.assertEqual(len(self.server.queries), 2)
+    
+    def test_cache_eviction(self):
+        self.resolver.max_entries = 3
+        for name, ttl in [('a.com', 300), ('b.com', 60), ('c.com', 600),
+                          ('d.com', 300)]:
+            self.server.records[name] = [a_record('10.0.0.1', ttl)]
+            self.resolver.resolve(name, 80)
+        # The entry expiring first makes room.
+        self.assertEqual(sorted(name for name, family in self.resolver.cache),
+                         ['a.com', 'c.com', 'd.com'])
+        for i in xrange(10):
+            self.hub.sleep(300)
+            self.resolver.resolve('a.com', 80)
+        self.assertEqual(len(self.server.queries), 14)
+        self.assert_(len(self.resolver._expiries) <= 6)
+    
+    def test_negative_cache(self):
+        self.resolver.negative_ttl = 30
+        self.assertRaises(dns.DNSError, self.resolver.resolve,
+                          'nowhere.example', 80)
+        self.assertRaises(socket.gaierror, self.resolver.resolve,
+                          'nowhere.example', 80)
+        self.assertEqual(len(self.server.queries), 1)
+        self.hub.sleep(30)
+        self.server.records['nowhere.example'] = [a_record('10.0.0.1')]
+        self.assertEqual(self.resolver.resolve('nowhere.example', 80),
+                         [('10.0.0.1', 80)])
+    
+    def test_negative_cache_soa(self):
+        self.server.soa_ttl = 5
+        self.server.records['example.com'] = []
+        try:
+            self.resolver.resolve('example.com', 80)
+        except dns.DNSError, err:
+            self.assertEqual(err.args[0], socket.EAI_NONAME)
+        else:
+            self.fail('DNSError not raised')
+        self.hub.sleep(5)
+        self.assertRaises(dns.DNSError, self.resolver.resolve,
+                          'example.com', 80)
+        self.assertEqual(len(self.server.queries), 2)
+    
+    def test_coalesce(self):
+        self.server.delay = 1
+        self.server.records['example.com'] = [a_record('10.0.0.1')]
+        results = []
+        def task():
+            results.append(self.resolver.resolve('example.com', 80))
+        for i in xrange(10):
+            self.hub.schedule(greennet.greenlet(task))
+        self.hub.switch()
+        self.hub.sleep(2)
+        self.assertEqual(results, [[('10.0.0.1', 80)]] * 10)
+        self.assertEqual(len(self.server.queries), 1)
+    
+    def test_timeout(self):
+        self.server.silent = True
+        self.assertRaises(greennet.Timeout, self.resolver.resolve,
+                          'example.com', 80, 3)
+        self.assertEqual(self.hub.time(), 3)
+        try:
+            self.resolver.resolve('example.com', 80)
+        except dns.DNSError, err:
+            self.assertEqual(err.args[0], socket.EAI_AGAIN)
+        else:
+            self.fail('DNSError not raised')
+        self.assertEqual(self.hub.time(), 10)
+        self.assertEqual(len(self.server.queries), 2)
+        self.assertEqual(self.resolver.cache, {})
+    
+    def test_search(self):
+        self.resolver.search = ['corp', 'example.com']
+        self.server.records['db.corp'] = [a_record('10.0.0.1')]
+        self.server.records['redis.svc.example.com'] = [a_record('10.0.0.2')]
+        self.assertEqual(self.resolver.resolve('db', 80), [('10.0.0.1', 80)])
+        self.assertEqual(self.resolver.resolve('redis.svc', 80),
+                         [('10.0.0.2', 80)])
+        self.assertEqual([name for name, qtype, tcp in self.server.queries],
+                         ['db.corp', 'redis.svc', 'redis.svc.corp',
+                          'redis.svc.example.com'])
+        # Absolute names are not searched; misses are cached per name.
+        del self.server.queries[:]
+        self.assertRaises(dns.DNSError, self.resolver.resolve, 'db.', 80)
+        try:
+            self.resolver.resolve('redis', 80)
+        except dns.DNSError, err:
+            self.assertEqual(err.args[0], socket.EAI_NONAME)
+            self.assert_("'redis'" in err.args[1])
+        else:
+            self.fail('DNSError not raised')
+        self.assertEqual([name for name, qtype, tcp in self.server.queries],
+                         ['db', 'redis.corp', 'redis.example.com', 'redis'])
+    
+    def test_truncated(self):
+        self.server.truncate = True
+        self.server.records['example.com'] = [a_record('10.0.0.1')]
+        self.assertEqual(self.resolver.resolve('example.com', 80),
+                         [('10.0.0.1', 80)])
+        self.assertEqual(self.server.queries, [('example.com', 1, False),
+                                               ('example.com', 1, True)])
+    
+    def test_query_killed(self):
+        self.server.silent = True
+        errors = []
+        def task():
+            try:
+                self.resolver.resolve('example.com', 80)
+            except dns.DNSError, err:
+                errors.append(err.args[0])
+        for i in xrange(2):
+            self.hub.schedule(greennet.greenlet(task))
+        self.hub.switch()
+        self.hub.switch()
+        server_fds = (self.server.sock.fileno(),
+                      self.server.listener.fileno())
+        query_tasks = [task for task, wait in self.hub.waiting.items()
+                       if isinstance(wait, greennet.hub.FDWait) and
+                       wait.fd not in server_fds]
+        self.assertEqual(len(query_tasks), 1)
+        # Kill the query task as Hub.shutdown does.
+        self.hub._cancel_wait(query_tasks[0])
+        self.hub.schedule(greennet.greenlet(self.hub._kill), query_tasks[0])
+        self.hub.run_until(lambda: len(errors) == 2)
+        self.assertEqual(errors, [socket.EAI_AGAIN] * 2)
+        self.assertEqual(self.resolver._lookups, {})
+    
+    def test_connect(self):
+        old_hub = greennet.get_hub()
+        greennet.set_hub(self.hub)
+        dns.set_resolver(self.resolver)
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            listener.bind(('127.0.0.1', 0))
+            listener.listen(1)
+            port = listener.getsockname()[1]
+            self.server.records['upstream'] = [a_record('127.0.0.1')]
+            greennet.connect(sock, ('upstream', port), timeout=5)
+            self.assertEqual(sock.getpeername(), ('127.0.0.1', port))
+        finally:
+            greennet.set_hub(old_hub)
+            sock.close()
+            listener.close()
@@ -0,0 +1,141 @@
+import socket
+import unittest
+
+import greennet
+from greennet import framing
+
+
+class TestCodecs(unittest.TestCase):
+    def roundtrip(self, codec, frames):
+        data = ''.join(codec.encode_many(frames))
+        self.assertEqual(codec.decode(data)[:2], (frames, len(data)))
+        # Fed a byte at a time, every frame comes out exactly once, and
+        # never before the rest reaches the size the codec asked for.
+        out = []
+        buf = ''
+        need = 1
+        for c in data:
+            buf += c
+            decoded, pos, next_need = codec.decode(buf)
+            if len(buf) < need:
+                self.assertEqual(decoded, [])
+            out.extend(decoded)
+            buf = buf[pos:]
+            need = next_need
+        self.assertEqual(out, frames)
+        self.assertEqual(buf, '')
+    
+    def test_u16(self):
+        self.roundtrip(framing.LengthPrefixCodec('!H'), ['a', '', 'b' * 300])
+    
+    def test_u32(self):
+        self.roundtrip(framing.LengthPrefixCodec(), ['spam', 'x' * 300])
+    
+    def test_varint(self):
+        self.roundtrip(framing.VarintCodec(), ['a', '', 'b' * 300])
+    
+    def test_delimited(self):
+        self.roundtrip(framing.DelimitedCodec('\r\n'), ['a', '', 'b\rc\n'])
+    
+    def test_max_size(self):
+        for codec in (framing.LengthPrefixCodec(max_size=10),
+                      framing.VarintCodec(max_size=10),
+                      framing.DelimitedCodec(max_size=10)):
+            self.assertRaises(framing.FrameError, codec.encode, 'x' * 11)
+            data = ''.join(codec.encode_many(['x' * 10]))
+            self.assertEqual(codec.decode(data)[0], ['x' * 10])
+        # The length prefix is checked before the frame arrives.
+        codec = framing.LengthPrefixCodec(max_size=10)
+        self.assertRaises(framing.FrameError, codec.decode,
+                          '\x00\x00\x00\x0bx')
+        self.assertEqual(framing.LengthPrefixCodec('!H').max_size, 65535)
+    
+    def test_bad_varint(self):
+        self.assertRaises(framing.FrameError, framing.VarintCodec().decode,
+                          '\xff' * 10)
+    
+    def test_delimiter_in_frame(self):
+        codec = framing.DelimitedCodec('\n')
+        self.assertRaises(framing.FrameError, codec.encode, 'a\nb')
+
+
+class CountingSocket(object):
+    
+    """Socket wrapper counting calls to recv."""
+    
+    def __init__(self, sock):
+        self.sock = sock
+        self.recvs = 0
+    
+    def recv(self, bufsize, flags=0):
+        self.recvs += 1
+        return self.sock.recv(bufsize, flags)
+    
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+class TestFrameReader(unittest.TestCase):
+    def setUp(self):
+        self.s1, self.s2 = socket.socketpair()
+        self.codec = framing.VarintCodec()
+    
+    def tearDown(self):
+        self.s1.close()
+        self.s2.close()
+    
+    def test_batch(self):
+        frames = ['message %d' % (i,) for i in xrange(100)]
+        framing.send_frames(self.s1, self.codec, frames)
+        sock = CountingSocket(self.s2)
+        reader = framing.FrameReader(sock, self.codec)
+        self.assertEqual(reader.recv(), frames)
+        self.assertEqual(sock.recvs, 1)
+    
+    def test_large_frame(self):
+        frame = 'x' * 1000000
+        self.s1.setblocking(False)
+        def writer():
+            framing.send_frames(self.s1, self.codec, [frame, 'next'])
+            self.s1.shutdown(socket.SHUT_WR)
+        greennet.schedule(greennet.greenlet(writer))
+        reader = framing.FrameReader(self.s2, self.codec, 4096)
+        self.assertEqual(list(reader), [frame, 'next'])
+        greennet.run()
+    
+    def test_delimited_small_chunks(self):
+        decodes = []
+        class CountingCodec(framing.DelimitedCodec):
+            def decode(self, data):
+                decodes.append(len(data))
+                return super(CountingCodec, self).decode(data)
+        codec = CountingCodec('\r\n')
+        # The delimiter straddles two reads.
+        frame = 'x' * 199999
+        self.s1.setblocking(False)
+        def writer():
+            framing.send_frames(self.s1, codec, [frame, 'next'])
+            self.s1.shutdown(socket.SHUT_WR)
+        greennet.schedule(greennet.greenlet(writer))
+        reader = framing.FrameReader(self.s2, codec, 100)
+        self.assertEqual(list(reader), [frame, 'next'])
+        greennet.run()
+        # The 2000 pieces of the frame were joined and decoded once.
+        self.assertEqual(decodes, [200007])
+    
+    def test_delimited_too_large(self):
+        codec = framing.DelimitedCodec('\r\n', max_size=1000)
+        self.s1.sendall('x' * 5000)
+        reader = framing.FrameReader(self.s2, codec, 100)
+        self.assertRaises(framing.FrameError, reader.recv)
+        self.assertTrue(reader._size <= 1100)
+    
+    def test_eof_mid_frame(self):
+        self.s1.sendall('\x05abc')
+        self.s1.shutdown(socket.SHUT_WR)
+        reader = framing.FrameReader(self.s2, self.codec)
+        self.assertRaises(greennet.ConnectionLost, reader.recv)
+    
+    def test_timeout(self):
+        reader = framing.FrameReader(self.s2, self.codec)
+        self.assertRaises(greennet.Timeout, reader.recv, 0)
@@ -0,0 +1,277 @@
+import socket
+import unittest
+
+import greennet
+from greennet import http
+
+
+def hello(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return ['Hello %s' % (environ['PATH_INFO'],)]
+
+
+def echo(environ, start_response):
+    body = environ['wsgi.input'].read()
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [body]
+
+
+def stream(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    def generate():
+        yield 'one '
+        yield ''
+        yield 'two'
+    return generate()
+
+
+def fail(environ, start_response):
+    raise RuntimeError('failed')
+
+
+def read_response(reader):
+    head = reader.read_until('\r\n\r\n', 65536, http.HeaderTooLarge)
+    lines = head.split('\r\n')[:-2]
+    headers = dict(line.lower().split(': ', 1) for line in lines[1:])
+    length = headers.get('content-length')
+    body = http.Input(reader, length and int(length),
+                      headers.get('transfer-encoding') == 'chunked')
+    return lines[0], headers, body.read()
+
+
+class CountingSocket(object):
+    
+    """Socket wrapper counting calls to send."""
+    
+    def __init__(self, sock):
+        self.sock = sock
+        self.sends = 0
+    
+    def send(self, data):
+        self.sends += 1
+        return self.sock.send(data)
+    
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        self.client, self.server = socket.socketpair()
+        self.client.setblocking(False)
+        self.reader = http.Reader(self.client)
+    
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+    
+    def serve(self, app, sock=None, **kwargs):
+        server = http.WSGIServer(app, **kwargs)
+        task = greennet.greenlet(server.handle)
+        greennet.schedule(task, sock or self.server, ('127.0.0.1', 1234))
+        return task
+    
+    def request(self, data):
+        greennet.sendall(self.client, data)
+        return read_response(self.reader)
+    
+    def assertClosed(self):
+        self.assertEqual(greennet.recv(self.client, 100, timeout=1), '')
+    
+    def test_keep_alive(self):
+        self.serve(hello)
+        for path in '/a', '/b':
+            status, headers, body = self.request(
+                'GET %s HTTP/1.1\r\nHost: example.com\r\n\r\n' % (path,))
+            self.assertEqual(status, 'HTTP/1.1 200 OK')
+            self.assertEqual(body, 'Hello ' + path)
+            self.assertEqual(headers['content-length'], str(len(body)))
+            self.assertTrue('date' in headers)
+            self.assertFalse('connection' in headers)
+        greennet.sendall(self.client, 'GET / HTTP/1.1\r\n'
+                                      'Connection: close\r\n\r\n')
+        status, headers, body = read_response(self.reader)
+        self.assertEqual(headers['connection'], 'close')
+        self.assertClosed()
+    
+    def test_pipelining(self):
+        sock = CountingSocket(self.server)
+        self.serve(hello, sock)
+        greennet.sendall(self.client,
+                         ''.join('GET /%d HTTP/1.1\r\n\r\n' % (i,)
+                                 for i in xrange(10)))
+        for i in xrange(10):
+            self.assertEqual(read_response(self.reader)[2], 'Hello /%d' % (i,))
+        self.assertEqual(sock.sends, 1)
+    
+    def test_http10(self):
+        self.serve(hello)
+        status, headers, body = self.request(
+            'GET / HTTP/1.0\r\nConnection: keep-alive\r\n\r\n')
+        self.assertEqual(status, 'HTTP/1.0 200 OK')
+        self.assertEqual(headers['connection'], 'keep-alive')
+        status, headers, body = self.request('GET / HTTP/1.0\r\n\r\n')
+        self.assertEqual(headers['connection'], 'close')
+        self.assertClosed()
+    
+    def test_content_length_body(self):
+        self.serve(echo)
+        status, headers, body = self.request(
+            'POST / HTTP/1.1\r\nContent-Length: 5\r\n\r\nhello')
+        self.assertEqual(body, 'hello')
+    
+    def test_chunked_body(self):
+        self.serve(echo)
+        status, headers, body = self.request(
+            'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+            '5;ext=1\r\nhello\r\n6\r\n world\r\n0\r\nTrailer: x\r\n\r\n'
+            'GET / HTTP/1.1\r\nContent-Length: 3\r\n\r\nabc')
+        self.assertEqual(body, 'hello world')
+        self.assertEqual(read_response(self.reader)[2], 'abc')
+    
+    def test_chunked_response(self):
+        self.serve(stream)
+        status, headers, body = self.request('GET / HTTP/1.1\r\n\r\n')
+        self.assertEqual(headers['transfer-encoding'], 'chunked')
+        self.assertEqual(body, 'one two')
+        status, headers, body = self.request('HEAD / HTTP/1.1\r\n\r\n')
+        self.assertEqual(body, '')
+        status, headers, body = self.request('GET / HTTP/1.0\r\n\r\n')
+        self.assertEqual(headers['connection'], 'close')
+        self.assertEqual(self.reader.read(100), 'one two')
+        self.assertClosed()
+    
+    def test_unread_body(self):
+        self.serve(hello)
+        self.request('POST / HTTP/1.1\r\nContent-Length: 3\r\n\r\nabc')
+        self.assertEqual(self.request('GET /x HTTP/1.1\r\n\r\n')[2],
+                         'Hello /x')
+    
+    def test_expect_continue(self):
+        self.serve(echo)
+        greennet.sendall(self.client, 'POST / HTTP/1.1\r\nContent-Length: 2'
+                                      '\r\nExpect: 100-continue\r\n\r\n')
+        self.assertEqual(read_response(self.reader)[0],
+                         'HTTP/1.1 100 Continue')
+        greennet.sendall(self.client, 'ok')
+        self.assertEqual(read_response(self.reader)[2], 'ok')
+    
+    def test_header_too_large(self):
+        self.serve(hello, max_header_size=100)
+        status, headers, body = self.request(
+            'GET / HTTP/1.1\r\nX-Long: %s\r\n\r\n' % ('x' * 100,))
+        self.assertEqual(status, 'HTTP/1.1 431 Request Header Fields Too Large')
+        self.assertClosed()
+    
+    def test_too_many_headers(self):
+        self.serve(hello, max_headers=2)
+        status, headers, body = self.request(
+            'GET / HTTP/1.1\r\nA: 1\r\nB: 2\r\nC: 3\r\n\r\n')
+        self.assertEqual(status[9:12], '431')
+    
+    def test_bad_request(self):
+        self.serve(hello)
+        self.assertEqual(self.request('NONSENSE\r\n\r\n')[0][9:12], '400')
+        self.assertClosed()
+    
+    def test_smuggling(self):
+        self.serve(echo)
+        status, headers, body = self.request(
+            'POST / HTTP/1.1\r\nContent-Length: 3\r\n'
+            'Transfer-Encoding: chunked\r\n\r\n0\r\n\r\n')
+        self.assertEqual(status[9:12], '400')
+    
+    def test_app_error(self):
+        http.log.disabled = True
+        try:
+            self.serve(fail)
+            status, headers, body = self.request('GET / HTTP/1.1\r\n\r\n')
+            self.assertEqual(status, 'HTTP/1.1 500 Internal Server Error')
+            self.assertClosed()
+        finally:
+            http.log.disabled = False
+    
+    def test_idle_timeout(self):
+        hub = greennet.hub.VirtualClockHub()
+        old_hub = greennet.get_hub()
+        greennet.set_hub(hub)
+        try:
+            self.serve(hello, idle_timeout=5)
+            self.request('GET / HTTP/1.1\r\n\r\n')
+            hub.sleep(4)
+            self.request('GET / HTTP/1.1\r\n\r\n')
+            hub.sleep(5)
+            self.assertEqual(hub.time(), 9)
+            self.assertClosed()
+        finally:
+            greennet.set_hub(old_hub)
+    
+    def test_request_timeout(self):
+        hub = greennet.hub.VirtualClockHub()
+        old_hub = greennet.get_hub()
+        greennet.set_hub(hub)
+        try:
+            self.serve(hello, request_timeout=5)
+            greennet.sendall(self.client, 'GET / HTTP/1.1\r\n')
+            hub.sleep(5)
+            self.assertClosed()
+        finally:
+            greennet.set_hub(old_hub)
+    
+    def test_client_not_reading(self):
+        hub = greennet.hub.VirtualClockHub()
+        old_hub = greennet.get_hub()
+        greennet.set_hub(hub)
+        try:
+            chunk = 'x' * 65536
+            def flood(environ, start_response):
+                start_response('200 OK', [('Content-Type', 'text/plain')])
+                while True:
+                    yield chunk
+            task = self.serve(flood, request_timeout=5)
+            greennet.sendall(self.client, 'GET / HTTP/1.1\r\n\r\n')
+            hub.sleep(10)
+            self.assertTrue(task.dead)
+            self.assertEqual(hub.fdwaits, {})
+            self.assertEqual(hub.timeouts, [])
+        finally:
+            greennet.set_hub(old_hub)
+    
+    def test_shutdown(self):
+        hub = greennet.hub.VirtualClockHub()
+        old_hub = greennet.get_hub()
+        greennet.set_hub(hub)
+        http.log.disabled = True
+        try:
+            def slow(environ, start_response):
+                hub.sleep(60)
+                return hello(environ, start_response)
+            self.serve(slow)
+            greennet.sendall(self.client, 'GET / HTTP/1.1\r\n\r\n')
+            hub.switch()
+            self.assertEqual(hub.shutdown(1), (0, 1))
+            # No 500 response: the connection was just closed.
+            self.assertEqual(self.client.recv(100), '')
+        finally:
+            http.log.disabled = False
+            greennet.set_hub(old_hub)
+    
+    def test_environ(self):
+        environs = []
+        def app(environ, start_response):
+            environs.append(environ)
+            return hello(environ, start_response)
+        self.serve(app)
+        self.request('GET http://example.com/a%20b?x=1 HTTP/1.1\r\n'
+                     'Host: example.com\r\nX-A: 1\r\nX-A: 2\r\n'
+                     'Content-Type: text/plain\r\n\r\n')
+        environ = environs[0]
+        self.assertEqual(environ['REQUEST_METHOD'], 'GET')
+        self.assertEqual(environ['PATH_INFO'], '/a b')
+        self.assertEqual(environ['QUERY_STRING'], 'x=1')
+        self.assertEqual(environ['HTTP_HOST'], 'example.com')
+        self.assertEqual(environ['HTTP_X_A'], '1,2')
+        self.assertEqual(environ['CONTENT_TYPE'], 'text/plain')
+        self.assertEqual(environ['REMOTE_ADDR'], '127.0.0.1')
+        self.assertEqual(environ['wsgi.url_scheme'], 'http')
+        self.assertEqual(environ['wsgi.input'].read(), '')
@@ -1,8 +1,10 @@
+from __future__ import with_statement
 import time
 import socket
 import unittest
 
 import greennet
+import greennet.queue
 
 
 IMMEDIATE_THRESHOLD = 0.01   # how quick is "immediate"
@@ -92,6 +94,517 @@ class TestHub(unittest.TestCase):
         a[0] = 2
         self.hub.run()
         self.assertEqual(a[0], 3)
+    
+    def test_run_again(self):
+        a = []
+        self.hub.schedule(greennet.greenlet(a.append), 1)
+        self.hub.run()
+        self.hub.schedule(greennet.greenlet(a.append), 2)
+        self.hub.run()
+        self.assertEqual(a, [1, 2])
+        timeout = 0.1
+        start = time.time()
+        self.hub.sleep(timeout)
+        duration = time.time() - start
+        self.assert_(duration < timeout + IMMEDIATE_THRESHOLD
+                     and duration > timeout - IMMEDIATE_THRESHOLD)
+    
+    def test_equal_expiry_timeouts(self):
+        first = greennet.hub.Sleep(None, 1.0)
+        second = greennet.hub.Sleep(None, 1.0)
+        self.hub._add_timeout(first)
+        self.hub._add_timeout(second)
+        self.hub._remove_timeout(second)
+        self.assertEqual(len(self.hub.timeouts), 1)
+        self.assert_(self.hub.timeouts[0] is first)
+    
+    def test_switch_does_not_starve_timeouts(self):
+        a = [0]
+        def busy():
+            while not a[0]:
+                self.hub.switch()
+        def task():
+            a[0] = 1
+        timeout = 0.1
+        start = time.time()
+        self.hub.schedule(greennet.greenlet(busy))
+        self.hub.call_later(greennet.greenlet(task), timeout)
+        self.hub.run()
+        duration = time.time() - start
+        self.assert_(duration < timeout + IMMEDIATE_THRESHOLD
+                     and duration > timeout - IMMEDIATE_THRESHOLD)
+    
+    def test_run_tasks_generation(self):
+        a = []
+        def task():
+            for i in xrange(3):
+                a.append(i)
+                self.hub.switch()
+        self.hub.schedule(greennet.greenlet(task))
+        self.hub.call_later(greennet.greenlet(a.append), 0, 'timer')
+        self.hub.run()
+        self.assertEqual(a, [0, 'timer', 1, 2])
+    
+    def test_budget(self):
+        hub = greennet.hub.Hub(budget=0)
+        a = []
+        for i in xrange(3):
+            hub.schedule(greennet.greenlet(a.append), i)
+        hub.call_later(greennet.greenlet(a.append), 0, 'timer')
+        hub.run()
+        self.assertEqual(a, [0, 'timer', 1, 2])
+    
+    def test_run_tasks_generation_priority(self):
+        a = []
+        def high():
+            for i in xrange(3):
+                a.append('high')
+                self.hub.switch()
+        def normal():
+            a.append('normal')
+            self.hub.schedule_priority(greennet.greenlet(a.append), 0,
+                                       'new high')
+        self.hub.schedule_priority(greennet.greenlet(high), 0)
+        self.hub.schedule(greennet.greenlet(normal))
+        self.hub.call_later(greennet.greenlet(a.append), 0, 'timer')
+        self.hub.run()
+        # Neither the rescheduled task nor the new one runs before the
+        # next iteration, however high their priority.
+        self.assertEqual(a, ['high', 'normal', 'timer', 'high', 'new high',
+                             'high'])
+    
+    def test_schedule_priority(self):
+        a = []
+        self.hub.schedule(greennet.greenlet(a.append), 'normal')
+        self.hub.schedule_priority(greennet.greenlet(a.append), 7, 'low')
+        self.hub.schedule_priority(greennet.greenlet(a.append), 0, 'high')
+        self.hub.run()
+        self.assertEqual(a, ['high', 'normal', 'low'])
+    
+    def test_schedule_priority_keyword(self):
+        # A priority keyword is the task's, like any other.
+        a = []
+        def task(priority):
+            a.append(priority)
+        self.hub.schedule(greennet.greenlet(task), priority='mine')
+        self.hub.run()
+        self.assertEqual(a, ['mine'])
+    
+    def test_switch_keeps_priority(self):
+        a = []
+        def task(name):
+            for i in xrange(2):
+                a.append(name)
+                self.hub.switch()
+        self.hub.schedule_priority(greennet.greenlet(task), 7, 'low')
+        self.hub.schedule_priority(greennet.greenlet(task), 0, 'high')
+        self.hub.run()
+        # Each iteration runs the high priority task first.
+        self.assertEqual(a, ['high', 'low', 'high', 'low'])
+    
+    def test_set_priority(self):
+        task = greennet.greenlet(lambda: None)
+        self.assertEqual(self.hub.get_priority(task),
+                         greennet.hub.DEFAULT_PRIORITY)
+        self.hub.set_priority(task, 1)
+        self.assertEqual(self.hub.get_priority(task), 1)
+        self.assertRaises(ValueError, self.hub.set_priority, task, -1)
+        self.assertRaises(ValueError, self.hub.set_priority,
+                          task, greennet.hub.PRIORITIES)
+    
+    def test_stats_disabled(self):
+        self.assertEqual(self.hub.stats, None)
+        self.hub.schedule(greennet.greenlet(lambda: None))
+        self.hub.run()
+        self.assertEqual(self.hub.stats, None)
+    
+    def test_stats(self):
+        stats = self.hub.enable_stats()
+        self.assert_(self.hub.stats is stats)
+        seen = []
+        def task():
+            self.hub.sleep(0.05)
+            seen.append(stats.snapshot())
+        self.hub.schedule(greennet.greenlet(task))
+        self.hub.schedule(greennet.greenlet(task))
+        self.hub.run()
+        self.assertEqual(seen[0]['ready'], 0)
+        self.assertEqual(seen[0]['timers'], 1)
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot['timeouts'], 2)
+        self.assertEqual(snapshot['ready_max'], 2)
+        self.assertEqual(snapshot['timers'], 0)
+        self.assert_(snapshot['iterations'] >= 2)
+        self.assertEqual(sum(snapshot['ticks']['counts']),
+                         snapshot['iterations'])
+        self.assert_(snapshot['poll_time'] > 0.05 - IMMEDIATE_THRESHOLD)
+        self.assert_(snapshot['run_time'] < IMMEDIATE_THRESHOLD)
+        self.hub.disable_stats()
+        self.assertEqual(self.hub.stats, None)
+
+
+class TestVirtualClockHub(unittest.TestCase):
+    def setUp(self):
+        self.hub = greennet.hub.VirtualClockHub()
+    
+    def test_sleep(self):
+        start = time.time()
+        self.hub.sleep(3600)
+        self.assertEqual(self.hub.time(), 3600)
+        self.assert_(time.time() - start < IMMEDIATE_THRESHOLD)
+    
+    def test_call_later(self):
+        a = []
+        def task(arg):
+            a.append((self.hub.time(), arg))
+        for timeout in (30, 10, 20):
+            self.hub.call_later(greennet.greenlet(task), timeout, timeout)
+        self.hub.run()
+        self.assertEqual(a, [(10, 10), (20, 20), (30, 30)])
+    
+    def test_start(self):
+        hub = greennet.hub.VirtualClockHub(1000.0)
+        hub.sleep(1)
+        self.assertEqual(hub.time(), 1001)
+    
+    def test_many_timers(self):
+        a = []
+        def task(n):
+            for i in xrange(n):
+                self.hub.sleep(60)
+            a.append(self.hub.time())
+        for n in xrange(1, 101):
+            self.hub.schedule(greennet.greenlet(task), n)
+        start = time.time()
+        self.hub.run()
+        self.assertEqual(a, [60 * n for n in xrange(1, 101)])
+        self.assert_(time.time() - start < 1)
+    
+    def test_poll_timeout(self):
+        s1, s2 = socket.socketpair()
+        try:
+            start = time.time()
+            self.assertRaises(greennet.Timeout,
+                              self.hub.poll, s1, read=True, timeout=60)
+            self.assertEqual(self.hub.time(), 60)
+            self.assert_(time.time() - start < IMMEDIATE_THRESHOLD)
+            s2.send('some data')
+            self.hub.poll(s1, read=True, timeout=60)
+            self.assertEqual(self.hub.time(), 60)
+        finally:
+            s1.close()
+            s2.close()
+    
+    def test_set_hub(self):
+        old_hub = greennet.get_hub()
+        greennet.set_hub(self.hub)
+        s1, s2 = socket.socketpair()
+        try:
+            self.assert_(greennet.get_hub() is self.hub)
+            s2.send('some data')
+            data = ''.join(greennet.recv_bytes(s1, 9, timeout=60))
+            self.assertEqual(data, 'some data')
+            self.assertRaises(greennet.Timeout, list,
+                              greennet.recv_until(s1, 'x', timeout=60))
+            self.assertEqual(self.hub.time(), 60)
+        finally:
+            greennet.set_hub(old_hub)
+            s1.close()
+            s2.close()
+        self.assert_(greennet.get_hub() is old_hub)
+
+
+class TestDeadline(unittest.TestCase):
+    def setUp(self):
+        self.hub = greennet.hub.VirtualClockHub()
+        self.s1, self.s2 = socket.socketpair()
+    
+    def tearDown(self):
+        self.s1.close()
+        self.s2.close()
+    
+    def test_single_timer(self):
+        self.s2.send('some data')
+        with self.hub.deadline(60) as d:
+            for i in xrange(5):
+                self.hub.poll(self.s1, read=True)
+                self.assertEqual(self.hub.timeouts, [d])
+                self.hub.poll(self.s1, read=True, timeout=120)
+                self.assertEqual(self.hub.timeouts, [d])
+        self.assertEqual(self.hub.timeouts, [])
+        self.assertEqual(self.hub.deadlines, {})
+    
+    def test_poll_timeout(self):
+        with self.hub.deadline(60):
+            self.assertRaises(greennet.Timeout,
+                              self.hub.poll, self.s1, read=True)
+            self.assertEqual(self.hub.time(), 60)
+            self.assertEqual(self.hub.fdwaits, {})
+            self.s2.send('some data')
+            self.assertRaises(greennet.Timeout,
+                              self.hub.poll, self.s1, read=True)
+        self.hub.poll(self.s1, read=True)
+        self.assertEqual(self.hub.time(), 60)
+    
+    def test_sleep(self):
+        with self.hub.deadline(60):
+            self.hub.sleep(30)
+            self.assertEqual(self.hub.time(), 30)
+            self.assertRaises(greennet.Timeout, self.hub.sleep, 3600)
+            self.assertEqual(self.hub.time(), 60)
+        self.assertEqual(self.hub.timeouts, [])
+    
+    def test_shorter_wait_timeout(self):
+        with self.hub.deadline(60) as d:
+            self.assertRaises(greennet.Timeout, self.hub.poll,
+                              self.s1, read=True, timeout=10)
+            self.assertEqual(self.hub.time(), 10)
+            self.assertEqual(self.hub.timeouts, [d])
+    
+    def test_nested(self):
+        with self.hub.deadline(60) as outer:
+            with self.hub.deadline(3600):
+                self.assertEqual(self.hub.timeouts, [outer])
+                self.assertRaises(greennet.Timeout, self.hub.sleep, 3600)
+                self.assertEqual(self.hub.time(), 60)
+        with self.hub.deadline(3600):
+            with self.hub.deadline(60):
+                self.assertRaises(greennet.Timeout, self.hub.sleep, 3600)
+                self.assertEqual(self.hub.time(), 120)
+            self.hub.sleep(60)
+            self.assertEqual(self.hub.time(), 180)
+        self.assertEqual(self.hub.timeouts, [])
+    
+    def test_none(self):
+        with self.hub.deadline(None):
+            self.assertEqual(self.hub.deadlines, {})
+            self.hub.sleep(3600)
+    
+    def test_queue(self):
+        q = greennet.queue.Queue(hub=self.hub)
+        with self.hub.deadline(60):
+            self.assertRaises(greennet.Timeout, q.popleft)
+            self.assertEqual(self.hub.time(), 60)
+        self.assertEqual(self.hub.timeouts, [])
+    
+    def test_composite(self):
+        old_hub = greennet.get_hub()
+        greennet.set_hub(self.hub)
+        try:
+            def sender():
+                for c in 'some data':
+                    self.hub.sleep(10)
+                    self.s2.send(c)
+            self.hub.schedule(greennet.greenlet(sender))
+            self.assertRaises(greennet.Timeout, list,
+                              greennet.recv_bytes(self.s1, 9, timeout=45))
+            self.assertEqual(self.hub.time(), 45)
+        finally:
+            greennet.set_hub(old_hub)
+    
+    def test_generator_between_chunks(self):
+        # A suspended receive generator bounds none of its consumer's other
+        # waits, and still times out as a whole.
+        old_hub = greennet.get_hub()
+        greennet.set_hub(self.hub)
+        try:
+            self.s2.send('some ')
+            for gen in (greennet.recv_bytes(self.s1, 9, timeout=20),
+                        greennet.recv_until(self.s1, 'x', timeout=20)):
+                self.assertEqual(gen.next(), 'some ')
+                self.hub.sleep(30)
+                self.assertEqual(self.hub.deadlines, {})
+                # The 20 seconds have run out: no more waiting.
+                now = self.hub.time()
+                self.assertRaises(greennet.Timeout, gen.next)
+                self.assertEqual(self.hub.time(), now)
+                self.s2.send('some ')
+            gen = greennet.recv_until_maxlen(self.s1, 'x', 100, ValueError,
+                                             timeout=20)
+            gen.next()
+            del gen
+            self.hub.sleep(30)
+            self.assertEqual(self.hub.timeouts, [])
+        finally:
+            greennet.set_hub(old_hub)
+
+
+class TestThrow(unittest.TestCase):
+    def setUp(self):
+        self.hub = greennet.hub.VirtualClockHub()
+        self.s1, self.s2 = socket.socketpair()
+    
+    def tearDown(self):
+        self.s1.close()
+        self.s2.close()
+    
+    def test_sleep(self):
+        caught = []
+        def task():
+            try:
+                self.hub.sleep(60)
+            except greennet.Cancelled:
+                caught.append(self.hub.time())
+        t = greennet.greenlet(task)
+        self.hub.schedule(t)
+        self.hub.sleep(1)
+        self.assertEqual(self.hub.waiting.keys(), [t])
+        self.assertTrue(self.hub.throw(t))
+        self.assertFalse(self.hub.throw(t))
+        self.hub.run()
+        self.assertEqual(caught, [1])
+        self.assertEqual(self.hub.timeouts, [])
+        self.assertEqual(self.hub.waiting, {})
+    
+    def test_poll_deadline(self):
+        caught = []
+        def task():
+            with self.hub.deadline(10):
+                try:
+                    self.hub.poll(self.s1, read=True)
+                except KeyError, err:
+                    caught.append(err.args)
+                self.hub.sleep(5)
+            caught.append(self.hub.time())
+        t = greennet.greenlet(task)
+        self.hub.schedule(t)
+        self.hub.switch()
+        self.hub.throw(t, KeyError, KeyError('a key'))
+        self.hub.run()
+        # The wait was cancelled and the Deadline left unharmed.
+        self.assertEqual(caught, [('a key',), 5])
+        self.assertEqual(self.hub.fdwaits, {})
+        self.assertEqual(self.hub.timeouts, [])
+    
+    def test_not_waiting(self):
+        q = greennet.queue.Queue(hub=self.hub)
+        got = []
+        def task():
+            got.append(q.popleft())
+        t = greennet.greenlet(task)
+        # Not started...
+        self.hub.schedule(t)
+        self.assertFalse(self.hub.throw(t))
+        self.hub.switch()
+        # ...or woken and not yet resumed.
+        q.append('an item')
+        self.assertFalse(self.hub.throw(t))
+        self.hub.run()
+        self.assertEqual(got, ['an item'])
+        self.assertEqual(self.hub.waiting, {})
+
+
+class TestShutdown(unittest.TestCase):
+    def setUp(self):
+        self.hub = greennet.hub.VirtualClockHub()
+    
+    def ticker(self, ticks, stop_at=None):
+        def task():
+            for i in xrange(10):
+                self.hub.sleep(1)
+                ticks.append(self.hub.time())
+                if self.hub.time() == stop_at:
+                    self.hub.stop()
+        self.hub.schedule(greennet.greenlet(task))
+    
+    def test_stop(self):
+        ticks = []
+        self.ticker(ticks, stop_at=3)
+        self.hub.run()
+        self.assertEqual(ticks, [1, 2, 3])
+        self.assertEqual(len(self.hub.timeouts), 1)
+        self.hub.run()
+        self.assertEqual(ticks, range(1, 11))
+    
+    def test_stop_before_run(self):
+        ticks = []
+        self.ticker(ticks)
+        self.hub.stop()
+        self.hub.run()
+        self.assertEqual(ticks, [])
+        self.assertEqual(len(self.hub.timeouts), 1)
+        self.assertFalse(self.hub.stopping)
+    
+    def test_run_until_predicate(self):
+        ticks = []
+        self.ticker(ticks)
+        self.assertTrue(self.hub.run_until(lambda: len(ticks) >= 4))
+        self.assertEqual(ticks, [1, 2, 3, 4])
+        self.assertTrue(self.hub.run_until(lambda: True))
+        self.assertEqual(ticks, [1, 2, 3, 4])
+        self.assertFalse(self.hub.run_until(lambda: len(ticks) > 10))
+        self.assertEqual(ticks, range(1, 11))
+    
+    def test_run_until_deadline(self):
+        ticks = []
+        self.ticker(ticks)
+        self.assertTrue(self.hub.run_until(5.5))
+        self.assertEqual(ticks, [1, 2, 3, 4, 5])
+        self.assertEqual(self.hub.time(), 5.5)
+        self.assertEqual(len(self.hub.timeouts), 1)
+        self.hub.run()
+        self.assertTrue(self.hub.run_until(20))
+        self.assertEqual(self.hub.time(), 20)
+        self.assertEqual(self.hub.timeouts, [])
+    
+    def test_shutdown(self):
+        q = greennet.queue.Queue(hub=self.hub)
+        done = []
+        def task(timeout):
+            try:
+                self.hub.sleep(timeout)
+            except greennet.Shutdown:
+                done.append(('killed', timeout, self.hub.time()))
+            else:
+                done.append(('drained', timeout, self.hub.time()))
+        def consumer():
+            try:
+                q.popleft()
+            except greennet.Cancelled:
+                done.append(('killed', None, self.hub.time()))
+        for timeout in (1, 2, 10):
+            self.hub.schedule(greennet.greenlet(task), timeout)
+        self.hub.schedule(greennet.greenlet(consumer))
+        self.hub.switch()
+        self.assertEqual(self.hub.shutdown(5), (2, 2))
+        self.assertEqual(sorted(done), [('drained', 1, 1), ('drained', 2, 2),
+                                        ('killed', None, 5),
+                                        ('killed', 10, 5)])
+        self.assertEqual(self.hub.waiting, {})
+        self.assertEqual(self.hub.timeouts, [])
+    
+    def test_shutdown_unhandled(self):
+        done = []
+        def task(timeout):
+            try:
+                self.hub.sleep(timeout)
+            finally:
+                done.append(timeout)
+        for timeout in (1, 10, 20):
+            self.hub.schedule(greennet.greenlet(task), timeout)
+        self.hub.switch()
+        self.assertEqual(self.hub.shutdown(5), (1, 2))
+        self.assertEqual(sorted(done), [1, 10, 20])
+        self.assertEqual(self.hub.timeouts, [])
+        # The loop is still usable.
+        self.hub.schedule(greennet.greenlet(task), 1)
+        self.hub.run()
+        self.assertEqual(self.hub.time(), 6)
+    
+    def test_shutdown_drained(self):
+        s1, s2 = socket.socketpair()
+        try:
+            # A parked connection is not in flight, and does not hold up
+            # the shutdown.
+            self.hub.call_when_readable(s1, s1.recv, 64)
+            self.hub.schedule(greennet.greenlet(self.hub.sleep), 2)
+            self.assertEqual(self.hub.shutdown(5), (1, 0))
+            self.assertEqual(self.hub.time(), 2)
+            self.assertEqual(self.hub.timeouts, [])
+            self.assertEqual(len(self.hub.fdwaits), 1)
+        finally:
+            s1.close()
+            s2.close()
 
 
 class TestHubWithSockets(unittest.TestCase):
@@ -136,6 +649,121 @@ class TestHubWithSockets(unittest.TestCase):
                           timeout=IMMEDIATE_THRESHOLD)
         self.assert_(time.time() - start < IMMEDIATE_THRESHOLD * 2)
     
+    def test_poll_reader_and_writer(self):
+        a = []
+        def reader():
+            self.hub.poll(self.s1, read=True)
+            a.append('read')
+        def writer():
+            self.hub.poll(self.s1, write=True)
+            a.append('write')
+            self.s2.send('some data')
+        self.hub.schedule(greennet.greenlet(reader))
+        self.hub.schedule(greennet.greenlet(writer))
+        self.hub.switch()
+        self.assertEqual(self.hub.fdwaits.keys(), [self.s1.fileno()])
+        reg = self.hub.fdwaits[self.s1.fileno()]
+        self.assertEqual(len(reg.waits), 2)
+        self.assertEqual(reg.mask, greennet.hub.READ | greennet.hub.WRITE)
+        self.hub.run()
+        self.assertEqual(a, ['write', 'read'])
+        self.assertEqual(self.hub.fdwaits, {})
+    
+    def test_switch_does_not_starve_io(self):
+        a = [0]
+        def busy():
+            while not a[0]:
+                self.hub.switch()
+        def reader():
+            self.hub.poll(self.s1, read=True)
+            a[0] = 1
+        self.hub.schedule(greennet.greenlet(busy))
+        self.hub.schedule(greennet.greenlet(reader))
+        self.s2.send('some data')
+        start = time.time()
+        self.hub.run()
+        self.assert_(time.time() - start < IMMEDIATE_THRESHOLD)
+    
+    def test_poll_resumes_at_priority(self):
+        a = []
+        def reader():
+            self.hub.poll(self.s1, read=True)
+            a.append('reader')
+        def busy():
+            for i in xrange(2):
+                self.hub.switch()
+            a.append('busy')
+        self.hub.schedule(greennet.greenlet(busy))
+        self.hub.schedule_priority(greennet.greenlet(reader), 0)
+        self.hub.switch()
+        self.s2.send('some data')
+        self.hub.run()
+        self.assertEqual(a, ['reader', 'busy'])
+    
+    def test_stats_fdwaits(self):
+        stats = self.hub.enable_stats()
+        seen = []
+        def reader():
+            self.hub.poll(self.s1, read=True)
+        def writer():
+            self.hub.poll(self.s1, write=True)
+            seen.append(stats.snapshot())
+            self.s2.send('some data')
+        self.hub.schedule(greennet.greenlet(reader))
+        self.hub.schedule(greennet.greenlet(writer))
+        self.hub.run()
+        self.assertEqual(seen[0]['fds'], 1)
+        self.assertEqual(seen[0]['fdwaits'], 1)
+        self.assertEqual(stats.snapshot()['fdwaits'], 0)
+    
+    def test_poll_many(self):
+        s3, s4 = socket.socketpair()
+        try:
+            s3.setblocking(False)
+            self.s2.send('some data')
+            s3.send('more data')
+            fds = [(self.s1, greennet.hub.READ), (s4, greennet.hub.READ),
+                   (self.s2, greennet.hub.READ)]
+            ready = self.hub.poll_many(fds)
+            self.assertEqual(sorted(ready),
+                             sorted([(self.s1, greennet.hub.READ),
+                                     (s4, greennet.hub.READ)]))
+            self.assertEqual(self.hub.fdwaits, {})
+        finally:
+            s3.close()
+            s4.close()
+    
+    def test_poll_many_timeout(self):
+        start = time.time()
+        self.assertRaises(greennet.Timeout, self.hub.poll_many,
+                          [(self.s1, greennet.hub.READ),
+                           (self.s2, greennet.hub.READ)],
+                          IMMEDIATE_THRESHOLD)
+        self.assert_(time.time() - start < IMMEDIATE_THRESHOLD * 2)
+        self.assertEqual(self.hub.fdwaits, {})
+    
+    def test_call_when_readable(self):
+        got = []
+        def callback(*args):
+            got.append((args, self.s1.recv(64)))
+        self.hub.call_when_readable(self.s1, callback, 1, 2)
+        self.hub.switch()
+        self.assertEqual(got, [])
+        self.assertEqual(len(self.hub.tasks), 0)
+        self.s2.send('data')
+        self.hub.run()
+        self.assertEqual(got, [((1, 2), 'data')])
+        self.assertEqual(self.hub.fdwaits, {})
+    
+    def test_call_when_readable_cancel(self):
+        got = []
+        callback = self.hub.call_when_readable(self.s1, got.append, 'fired')
+        callback.cancel(self.hub)
+        self.assertEqual(self.hub.fdwaits, {})
+        self.s2.send('data')
+        self.hub.run()
+        self.assertEqual(got, [])
+    
     def test_poll_exc(self):
         pass
     
@@ -0,0 +1,170 @@
+from __future__ import with_statement
+import socket
+import unittest
+
+import greennet
+from greennet.pool import ConnectionPool
+from greennet.profiler import Profiler
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.hub = greennet.hub.VirtualClockHub()
+        self.old_hub = greennet.get_hub()
+        greennet.set_hub(self.hub)
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(16)
+        self.address = self.listener.getsockname()
+        self.accepted = []
+    
+    def tearDown(self):
+        greennet.set_hub(self.old_hub)
+        for sock in self.accepted:
+            sock.close()
+        self.listener.close()
+    
+    def accept(self):
+        sock = self.listener.accept()[0]
+        self.accepted.append(sock)
+        return sock
+    
+    def test_reuse(self):
+        pool = ConnectionPool(self.address, 2)
+        sock = pool.acquire()
+        self.accept()
+        pool.release(sock)
+        self.assert_(pool.acquire() is sock)
+        self.assertEqual(pool.stats.created, 1)
+        self.assertEqual(pool.stats.reused, 1)
+        self.assertEqual(pool.stats.acquires, 2)
+        self.assertEqual(pool.stats.snapshot()['in_use'], 1)
+        pool.release(sock)
+        pool.close()
+    
+    def test_dead_connection(self):
+        pool = ConnectionPool(self.address, 2)
+        sock = pool.acquire()
+        pool.release(sock)
+        self.accept().close()
+        self.hub.poll(sock, read=True)
+        other = pool.acquire()
+        self.assert_(other is not sock)
+        self.assertEqual(pool.stats.discarded, 1)
+        self.assertEqual(pool.size, 1)
+        pool.release(other)
+        pool.close()
+    
+    def test_unsolicited_data(self):
+        pool = ConnectionPool(self.address, 2)
+        sock = pool.acquire()
+        pool.release(sock)
+        self.accept().send('stale response')
+        self.hub.poll(sock, read=True)
+        self.assert_(pool.acquire() is not sock)
+        self.assertEqual(pool.stats.discarded, 1)
+        pool.close()
+    
+    def test_wait_for_release(self):
+        pool = ConnectionPool(self.address, 1)
+        sock = pool.acquire()
+        got = []
+        def waiter():
+            got.append(pool.acquire())
+        self.hub.schedule(greennet.greenlet(waiter))
+        self.hub.switch()
+        self.assertEqual(pool.stats.snapshot()['waiting'], 1)
+        self.hub.sleep(10)
+        pool.release(sock)
+        self.hub.run()
+        self.assertEqual(got, [sock])
+        self.assertEqual(pool.stats.waits, 1)
+        self.assertEqual(pool.stats.wait_time, 10)
+        self.assertEqual(pool.stats.max_wait, 10)
+        self.assertEqual(pool.size, 1)
+        pool.release(sock)
+        pool.close()
+    
+    def test_acquire_timeout(self):
+        pool = ConnectionPool(self.address, 1)
+        sock = pool.acquire()
+        self.assertRaises(greennet.Timeout, pool.acquire, 5)
+        self.assertEqual(self.hub.time(), 5)
+        self.assertEqual(pool.stats.snapshot()['waiting'], 0)
+        self.assertEqual(pool.stats.wait_time, 5)
+        pool.release(sock)
+        self.assert_(pool.acquire(0) is sock)
+        pool.release(sock)
+        pool.close()
+    
+    def test_discard_frees_slot(self):
+        pool = ConnectionPool(self.address, 1)
+        sock = pool.acquire()
+        got = []
+        def waiter():
+            got.append(pool.acquire())
+        self.hub.schedule(greennet.greenlet(waiter))
+        self.hub.switch()
+        pool.release(sock, discard=True)
+        self.hub.run()
+        self.assertEqual(len(got), 1)
+        self.assert_(got[0] is not sock)
+        self.assertEqual(pool.stats.created, 2)
+        pool.release(got[0])
+        pool.close()
+    
+    def test_reap_idle(self):
+        pool = ConnectionPool(self.address, 2, idle_timeout=30)
+        s1 = pool.acquire()
+        s2 = pool.acquire()
+        pool.release(s1)
+        self.hub.sleep(10)
+        pool.release(s2)
+        self.assertEqual(len(self.hub.timeouts), 1)
+        self.hub.sleep(25)
+        self.assertEqual([sock for sock, since in pool.idle], [s2])
+        self.assertEqual(pool.stats.reaped, 1)
+        self.hub.run()
+        self.assertEqual(self.hub.time(), 40)
+        self.assertEqual(len(pool.idle), 0)
+        self.assertEqual(pool.size, 0)
+        self.assertEqual(pool.stats.reaped, 2)
+    
+    def test_reap_profiled(self):
+        # The reaper is a timer with no task; switch hooks must cope.
+        profiler = Profiler(self.hub)
+        profiler.start()
+        try:
+            pool = ConnectionPool(self.address, 1, idle_timeout=30)
+            pool.release(pool.acquire())
+            self.hub.run()
+        finally:
+            profiler.stop()
+        self.assertEqual(pool.stats.reaped, 1)
+        self.assert_([stats for stats in profiler.finished.itervalues()
+                      if 'pool.py' in stats.label])
+    
+    def test_connection(self):
+        pool = ConnectionPool(self.address, 1)
+        with pool.connection() as sock:
+            pass
+        try:
+            with pool.connection() as other:
+                self.assert_(other is sock)
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        self.assertEqual(pool.size, 0)
+        pool.close()
+    
+    def test_close(self):
+        pool = ConnectionPool(self.address, 2)
+        s1 = pool.acquire()
+        s2 = pool.acquire()
+        pool.release(s1)
+        pool.close()
+        self.assertEqual(self.hub.timeouts, [])
+        self.assertEqual(pool.size, 1)
+        pool.release(s2)
+        self.assertEqual(pool.size, 0)
+        self.assertRaises(ValueError, pool.acquire)
@@ -0,0 +1,126 @@
+import time
+import unittest
+from StringIO import StringIO
+
+import greennet
+from greennet.profiler import Profiler
+
+
+def spin(duration):
+    end = time.time() + duration
+    while time.time() < end:
+        pass
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.hub = greennet.hub.Hub()
+    
+    def run_tasks(self, profiler):
+        def busy():
+            for i in xrange(2):
+                spin(0.05)
+                self.hub.switch()
+        def idle():
+            for i in xrange(4):
+                self.hub.switch()
+        busy_task = greennet.greenlet(busy)
+        idle_task = greennet.greenlet(idle)
+        self.hub.schedule(busy_task)
+        self.hub.schedule(idle_task)
+        profiler.start()
+        try:
+            self.hub.run()
+        finally:
+            profiler.stop()
+        return busy_task, idle_task
+    
+    def test_accounting(self):
+        profiler = Profiler(self.hub)
+        self.run_tasks(profiler)
+        self.assertEqual(len(profiler.tasks), 0)
+        stats = dict((stats.label.split()[0], stats)
+                     for stats in profiler.finished.itervalues())
+        self.assertEqual(stats['busy'].switches, 3)
+        self.assertEqual(stats['idle'].switches, 5)
+        self.assert_(stats['busy'].time >= 0.1)
+        self.assert_(stats['idle'].time < 0.01)
+        top = profiler.top(1)
+        self.assertEqual(len(top), 1)
+        self.assert_(top[0].label.startswith('busy '))
+        self.assert_(profiler.top(1, 'switches')[0].label.startswith('idle '))
+        out = StringIO()
+        profiler.report(file=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assert_('busy' in lines[1])
+        self.assertEqual(self.hub.switch_hooks, [])
+    
+    def test_running_task(self):
+        profiler = Profiler(self.hub)
+        def task():
+            for i in xrange(2):
+                self.hub.switch()
+        task = greennet.greenlet(task)
+        self.hub.schedule(task)
+        profiler.start()
+        try:
+            self.hub.switch()
+        finally:
+            profiler.stop()
+        self.assertEqual(profiler.tasks[task].switches, 1)
+        self.assertEqual(profiler.finished, {})
+    
+    def test_finished_tasks(self):
+        profiler = Profiler(self.hub)
+        def handler():
+            self.hub.switch()
+        for i in xrange(100):
+            self.hub.schedule(greennet.greenlet(handler))
+        profiler.start()
+        try:
+            self.hub.run()
+        finally:
+            profiler.stop()
+        self.assertEqual(len(profiler.tasks), 0)
+        self.assertEqual(len(profiler.finished), 1)
+        stats = profiler.finished.values()[0]
+        self.assert_(stats.label.startswith('handler '))
+        self.assertEqual(stats.count, 100)
+        self.assertEqual(stats.switches, 200)
+    
+    def test_timer_without_task(self):
+        profiler = Profiler(self.hub)
+        fired = []
+        class Timer(greennet.hub.Wait):
+            def timeout(self):
+                fired.append(self)
+        self.hub._add_timeout(Timer(None, self.hub._expires(0)))
+        profiler.start()
+        try:
+            self.hub.run()
+        finally:
+            profiler.stop()
+        self.assertEqual(len(fired), 1)
+        self.assertEqual(len(profiler.tasks), 0)
+        stats = profiler.finished.values()
+        self.assertEqual(len(stats), 1)
+        self.assert_(stats[0].label.startswith('timeout '))
+        self.assertEqual(stats[0].switches, 1)
+    
+    def test_sampling(self):
+        profiler = Profiler(self.hub, interval=0.005)
+        self.run_tasks(profiler)
+        out = StringIO()
+        profiler.write_collapsed(out)
+        lines = out.getvalue().splitlines()
+        self.assert_(lines)
+        spinning = [line for line in lines
+                    if line.startswith('busy ') and ';spin ' in line]
+        self.assert_(spinning)
+        stack, count = spinning[0].rsplit(' ', 1)
+        self.assert_(int(count) > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
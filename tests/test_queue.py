@@ -1,4 +1,3 @@
-import time
 import unittest
 
 import greennet
@@ -10,7 +9,7 @@ IMMEDIATE_THRESHOLD = 0.01   # how quick is "immediate"
 
 class TestQueue(unittest.TestCase):
     def setUp(self):
-        self.hub = greennet.hub.Hub()
+        self.hub = greennet.hub.VirtualClockHub()
     
     def test_len(self):
         q = Queue(hub=self.hub)
@@ -56,11 +55,11 @@ class TestQueue(unittest.TestCase):
         self.assertEqual(len(q), 1)
         self.assertEqual(q.pop(), 'an item')
         self.assertEqual(len(q), 0)
-        start = time.time()
+        start = self.hub.time()
         self.assertRaises(greennet.Timeout,
                           q.pop,
                           IMMEDIATE_THRESHOLD)
-        self.assert_(time.time() - start < IMMEDIATE_THRESHOLD * 2)
+        self.assert_(self.hub.time() - start < IMMEDIATE_THRESHOLD * 2)
         self.assertEqual(len(q), 0)
     
     def test_popleft(self):
@@ -73,11 +72,11 @@ class TestQueue(unittest.TestCase):
         self.assertEqual(len(q), 1)
         self.assertEqual(q.popleft(), 'another item')
         self.assertEqual(len(q), 0)
-        start = time.time()
+        start = self.hub.time()
         self.assertRaises(greennet.Timeout,
                           q.popleft,
                           IMMEDIATE_THRESHOLD)
-        self.assert_(time.time() - start < IMMEDIATE_THRESHOLD * 2)
+        self.assert_(self.hub.time() - start < IMMEDIATE_THRESHOLD * 2)
         self.assertEqual(len(q), 0)
     
     def test_full(self):
@@ -96,12 +95,12 @@ class TestQueue(unittest.TestCase):
         q.append('an item')
         self.assertEqual(len(q), 1)
         self.assert_(q.full())
-        start = time.time()
+        start = self.hub.time()
         self.assertRaises(greennet.Timeout,
                           q.append,
                           'another_item',
                           IMMEDIATE_THRESHOLD)
-        self.assert_(time.time() - start < IMMEDIATE_THRESHOLD * 2)
+        self.assert_(self.hub.time() - start < IMMEDIATE_THRESHOLD * 2)
         self.assertEqual(len(q), 1)
         self.assert_(q.full())
         q.pop()
@@ -114,12 +113,12 @@ class TestQueue(unittest.TestCase):
         q.appendleft('an item')
         self.assertEqual(len(q), 1)
         self.assert_(q.full())
-        start = time.time()
+        start = self.hub.time()
         self.assertRaises(greennet.Timeout,
                           q.appendleft,
                           'another_item',
                           IMMEDIATE_THRESHOLD)
-        self.assert_(time.time() - start < IMMEDIATE_THRESHOLD * 2)
+        self.assert_(self.hub.time() - start < IMMEDIATE_THRESHOLD * 2)
         self.assertEqual(len(q), 1)
         self.assert_(q.full())
         q.pop()
@@ -131,9 +130,9 @@ class TestQueue(unittest.TestCase):
         q = Queue(hub=self.hub)
         timeout = 0.5
         self.hub.call_later(greennet.greenlet(q.append), timeout, 'an item')
-        start = time.time()
+        start = self.hub.time()
         self.assertEqual(q.pop(), 'an item')
-        duration = time.time() - start
+        duration = self.hub.time() - start
         self.assert_(duration < timeout + IMMEDIATE_THRESHOLD
                      and duration > timeout - IMMEDIATE_THRESHOLD)
     
@@ -141,9 +140,9 @@ class TestQueue(unittest.TestCase):
         q = Queue(hub=self.hub)
         timeout = 0.5
         self.hub.call_later(greennet.greenlet(q.append), timeout, 'an item')
-        start = time.time()
+        start = self.hub.time()
         self.assertEqual(q.popleft(), 'an item')
-        duration = time.time() - start
+        duration = self.hub.time() - start
         self.assert_(duration < timeout + IMMEDIATE_THRESHOLD
                      and duration > timeout - IMMEDIATE_THRESHOLD)
     
@@ -152,9 +151,9 @@ class TestQueue(unittest.TestCase):
         timeout = 0.5
         self.hub.call_later(greennet.greenlet(q.appendleft),
                             timeout, 'an item')
-        start = time.time()
+        start = self.hub.time()
         self.assertEqual(q.pop(), 'an item')
-        duration = time.time() - start
+        duration = self.hub.time() - start
         self.assert_(duration < timeout + IMMEDIATE_THRESHOLD
                      and duration > timeout - IMMEDIATE_THRESHOLD)
     
@@ -163,9 +162,9 @@ class TestQueue(unittest.TestCase):
         timeout = 0.5
         self.hub.call_later(greennet.greenlet(q.appendleft),
                             timeout, 'an item')
-        start = time.time()
+        start = self.hub.time()
         self.assertEqual(q.popleft(), 'an item')
-        duration = time.time() - start
+        duration = self.hub.time() - start
         self.assert_(duration < timeout + IMMEDIATE_THRESHOLD
                      and duration > timeout - IMMEDIATE_THRESHOLD)
     
@@ -174,9 +173,9 @@ class TestQueue(unittest.TestCase):
         q.append('an item')
         timeout = 0.5
         self.hub.call_later(greennet.greenlet(q.pop), timeout)
-        start = time.time()
+        start = self.hub.time()
         q.append('an item')
-        duration = time.time() - start
+        duration = self.hub.time() - start
         self.assert_(duration < timeout + IMMEDIATE_THRESHOLD
                      and duration > timeout - IMMEDIATE_THRESHOLD)
         self.assertEqual(q.pop(), 'an item')
@@ -186,9 +185,9 @@ class TestQueue(unittest.TestCase):
         q.append('an item')
         timeout = 0.5
         self.hub.call_later(greennet.greenlet(q.pop), timeout)
-        start = time.time()
+        start = self.hub.time()
         q.appendleft('an item')
-        duration = time.time() - start
+        duration = self.hub.time() - start
         self.assert_(duration < timeout + IMMEDIATE_THRESHOLD
                      and duration > timeout - IMMEDIATE_THRESHOLD)
         self.assertEqual(q.pop(), 'an item')
@@ -198,9 +197,9 @@ class TestQueue(unittest.TestCase):
         q.append('an item')
         timeout = 0.5
         self.hub.call_later(greennet.greenlet(q.popleft), timeout)
-        start = time.time()
+        start = self.hub.time()
         q.append('an item')
-        duration = time.time() - start
+        duration = self.hub.time() - start
         self.assert_(duration < timeout + IMMEDIATE_THRESHOLD
                      and duration > timeout - IMMEDIATE_THRESHOLD)
         self.assertEqual(q.pop(), 'an item')
@@ -210,9 +209,9 @@ class TestQueue(unittest.TestCase):
         q.append('an item')
         timeout = 0.5
         self.hub.call_later(greennet.greenlet(q.popleft), timeout)
-        start = time.time()
+        start = self.hub.time()
         q.appendleft('an item')
-        duration = time.time() - start
+        duration = self.hub.time() - start
         self.assert_(duration < timeout + IMMEDIATE_THRESHOLD
                      and duration > timeout - IMMEDIATE_THRESHOLD)
         self.assertEqual(q.pop(), 'an item')
@@ -230,9 +229,9 @@ class TestQueue(unittest.TestCase):
         q.append('an item')
         timeout = 0.5
         self.hub.call_later(greennet.greenlet(q.clear), timeout)
-        start = time.time()
+        start = self.hub.time()
         q.append('an item')
-        duration = time.time() - start
+        duration = self.hub.time() - start
         self.assert_(duration < timeout + IMMEDIATE_THRESHOLD
                      and duration > timeout - IMMEDIATE_THRESHOLD)
         self.assertEqual(q.pop(), 'an item')
@@ -242,9 +241,9 @@ class TestQueue(unittest.TestCase):
         q.append('an item')
         timeout = 0.5
         self.hub.call_later(greennet.greenlet(q.clear), timeout)
-        start = time.time()
+        start = self.hub.time()
         q.appendleft('an item')
-        duration = time.time() - start
+        duration = self.hub.time() - start
         self.assert_(duration < timeout + IMMEDIATE_THRESHOLD
                      and duration > timeout - IMMEDIATE_THRESHOLD)
         self.assertEqual(q.pop(), 'an item')
@@ -256,9 +255,9 @@ class TestQueue(unittest.TestCase):
         timeout = 0.5
         self.hub.call_later(greennet.greenlet(q.pop), timeout)
         self.hub.call_later(greennet.greenlet(q.pop), timeout * 2)
-        start = time.time()
+        start = self.hub.time()
         q.wait_until_empty()
-        duration = time.time() - start
+        duration = self.hub.time() - start
         self.assert_(duration < timeout * 2 + IMMEDIATE_THRESHOLD
                      and duration > timeout * 2 - IMMEDIATE_THRESHOLD)
     
@@ -269,9 +268,9 @@ class TestQueue(unittest.TestCase):
         timeout = 0.5
         self.hub.call_later(greennet.greenlet(q.popleft), timeout)
         self.hub.call_later(greennet.greenlet(q.popleft), timeout * 2)
-        start = time.time()
+        start = self.hub.time()
         q.wait_until_empty()
-        duration = time.time() - start
+        duration = self.hub.time() - start
         self.assert_(duration < timeout * 2 + IMMEDIATE_THRESHOLD
                      and duration > timeout * 2 - IMMEDIATE_THRESHOLD)
     
@@ -281,20 +280,48 @@ class TestQueue(unittest.TestCase):
         q.append('another item')
         timeout = 0.5
         self.hub.call_later(greennet.greenlet(q.clear), timeout)
-        start = time.time()
+        start = self.hub.time()
         q.wait_until_empty()
-        duration = time.time() - start
+        duration = self.hub.time() - start
         self.assert_(duration < timeout + IMMEDIATE_THRESHOLD
                      and duration > timeout - IMMEDIATE_THRESHOLD)
     
+    def test_popleft_taken_before_wakeup(self):
+        q = Queue(hub=self.hub)
+        a = []
+        def consumer():
+            a.append(q.popleft())
+        self.hub.schedule(greennet.greenlet(consumer))
+        self.hub.switch()
+        q.append('an item')
+        self.assertEqual(q.popleft(), 'an item')
+        self.hub.switch()
+        self.assertEqual(a, [])
+        q.append('another item')
+        self.hub.run()
+        self.assertEqual(a, ['another item'])
+    
+    def test_append_filled_before_wakeup(self):
+        q = Queue(1, hub=self.hub)
+        q.append('an item')
+        self.hub.schedule(greennet.greenlet(q.append), 'another item')
+        self.hub.switch()
+        self.assertEqual(q.popleft(), 'an item')
+        q.append('a third item')
+        self.hub.switch()
+        self.assertEqual(len(q), 1)
+        self.assertEqual(q.popleft(), 'a third item')
+        self.hub.run()
+        self.assertEqual(q.popleft(), 'another item')
+    
     def test_wait_until_empty_timeout(self):
         q = Queue(hub=self.hub)
         q.append('an item')
-        start = time.time()
+        start = self.hub.time()
         self.assertRaises(greennet.Timeout,
                           q.wait_until_empty,
                           IMMEDIATE_THRESHOLD)
-        self.assert_(time.time() - start < IMMEDIATE_THRESHOLD * 2)
+        self.assert_(self.hub.time() - start < IMMEDIATE_THRESHOLD * 2)
 
 
 if __name__ == '__main__':
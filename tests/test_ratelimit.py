@@ -0,0 +1,154 @@
+import socket
+import unittest
+
+import greennet
+from greennet import ratelimit
+from greennet.profiler import Profiler
+from greennet.ratelimit import TokenBucket
+
+
+class TestTokenBucket(unittest.TestCase):
+    def setUp(self):
+        self.hub = greennet.hub.VirtualClockHub()
+    
+    def test_burst(self):
+        bucket = TokenBucket(10, hub=self.hub)
+        bucket.acquire(10)
+        self.assertEqual(self.hub.time(), 0)
+        bucket.acquire(5)
+        self.assertAlmostEqual(self.hub.time(), 0.5)
+        self.hub.sleep(10)
+        self.assertEqual(bucket.take(100), 10)
+        self.assertRaises(ValueError, bucket.acquire, 11)
+    
+    def test_rate(self):
+        bucket = TokenBucket(100, burst=1, hub=self.hub)
+        for i in xrange(101):
+            bucket.acquire()
+        self.assertAlmostEqual(self.hub.time(), 1.0)
+    
+    def test_batch_wake(self):
+        bucket = TokenBucket(1000, burst=1, hub=self.hub)
+        bucket.acquire()
+        done = []
+        def task(i):
+            bucket.acquire()
+            done.append((i, self.hub.time()))
+        for i in xrange(100):
+            self.hub.schedule(greennet.greenlet(task), i)
+        self.hub.switch()
+        # A single timer serves all the waiters...
+        self.assertEqual(len(self.hub.timeouts), 1)
+        self.hub.run()
+        # ...in order, and ten at a time at the default resolution.
+        self.assertEqual([i for i, t in done], range(100))
+        self.assertEqual(len(set(t for i, t in done)), 10)
+        self.assertAlmostEqual(done[-1][1], 0.1)
+    
+    def test_refill_profiled(self):
+        # The refill timer has no task; switch hooks must cope.
+        bucket = TokenBucket(10, burst=1, hub=self.hub)
+        bucket.acquire()
+        done = []
+        def task():
+            bucket.acquire()
+            done.append(self.hub.time())
+        self.hub.schedule(greennet.greenlet(task))
+        profiler = Profiler(self.hub)
+        profiler.start()
+        try:
+            self.hub.run()
+        finally:
+            profiler.stop()
+        self.assertEqual(len(done), 1)
+        self.assertAlmostEqual(done[0], 0.1)
+        self.assert_([stats for stats in profiler.finished.itervalues()
+                      if 'ratelimit.py' in stats.label])
+    
+    def test_timeout(self):
+        bucket = TokenBucket(1, hub=self.hub)
+        bucket.acquire()
+        got = []
+        def task(n):
+            bucket.acquire(n)
+            got.append((n, self.hub.time()))
+        self.assertRaises(greennet.Timeout, bucket.acquire, 1, 0.5)
+        self.hub.schedule(greennet.greenlet(task), 1)
+        self.hub.run()
+        self.assertEqual(got, [(1, 1.0)])
+        self.assertEqual(self.hub.timeouts, [])
+    
+    def test_timeout_head(self):
+        bucket = TokenBucket(1, burst=2, hub=self.hub)
+        bucket.acquire(2)
+        got = []
+        def task(n, timeout):
+            try:
+                bucket.acquire(n, timeout)
+            except greennet.Timeout:
+                got.append((n, 'timeout'))
+            else:
+                got.append((n, self.hub.time()))
+        self.hub.schedule(greennet.greenlet(task), 2, 0.5)
+        self.hub.schedule(greennet.greenlet(task), 1, None)
+        self.hub.run()
+        # Once the first waiter gives up, the second is served as soon as
+        # it has enough tokens.
+        self.assertEqual(got, [(2, 'timeout'), (1, 1.0)])
+    
+    def test_refund(self):
+        bucket = TokenBucket(1, burst=5, hub=self.hub)
+        bucket.acquire(5)
+        bucket.refund(3)
+        self.assertEqual(bucket.take(5), 3)
+        bucket.refund(100)
+        self.assertEqual(bucket.tokens, 5)
+
+
+class TestSockets(unittest.TestCase):
+    def setUp(self):
+        self.hub = greennet.hub.VirtualClockHub()
+        self.old_hub = greennet.get_hub()
+        greennet.set_hub(self.hub)
+        self.s1, self.s2 = socket.socketpair()
+        self.s1.setblocking(False)
+        self.s2.setblocking(False)
+    
+    def tearDown(self):
+        greennet.set_hub(self.old_hub)
+        self.s1.close()
+        self.s2.close()
+    
+    def test_sendall(self):
+        bucket = TokenBucket(1000, hub=self.hub)
+        received = []
+        def reader():
+            size = 0
+            while size < 5000:
+                data = greennet.recv(self.s2, 65536)
+                received.append(data)
+                size += len(data)
+        self.hub.schedule(greennet.greenlet(reader))
+        ratelimit.sendall(self.s1, 'x' * 5000, bucket)
+        self.assertAlmostEqual(self.hub.time(), 4.0)
+        self.hub.run()
+        self.assertEqual(''.join(received), 'x' * 5000)
+    
+    def test_recv(self):
+        bucket = TokenBucket(100, hub=self.hub)
+        self.s2.sendall('x' * 1000)
+        self.assertEqual(len(ratelimit.recv(self.s1, 1000, bucket)), 100)
+        self.assertEqual(bucket.tokens, 0)
+        data = ratelimit.recv(self.s1, 1000, bucket)
+        self.assertEqual(len(data), 1)
+        self.hub.sleep(0.5)
+        self.assertEqual(len(ratelimit.recv(self.s1, 1000, bucket)), 50)
+    
+    def test_recv_refund(self):
+        bucket = TokenBucket(100, hub=self.hub)
+        self.s2.sendall('x' * 10)
+        self.assertEqual(len(ratelimit.recv(self.s1, 1000, bucket)), 10)
+        self.assertEqual(bucket.tokens, 90)
+        self.assertRaises(greennet.Timeout, ratelimit.recv, self.s1, 10,
+                          bucket, 1)
+        self.assertEqual(bucket.tokens, 90)
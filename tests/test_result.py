@@ -0,0 +1,154 @@
+import unittest
+
+import greennet
+from greennet import AsyncResult, spawn, wait_any, wait_all, as_completed
+
+
+class ResultTestCase(unittest.TestCase):
+    def setUp(self):
+        self.hub = greennet.hub.VirtualClockHub()
+        self.old_hub = greennet.get_hub()
+        greennet.set_hub(self.hub)
+    
+    def tearDown(self):
+        greennet.set_hub(self.old_hub)
+    
+    def sleep(self, n):
+        self.hub.sleep(n)
+        return n
+
+
+class TestAsyncResult(ResultTestCase):
+    def test_get(self):
+        result = AsyncResult()
+        got = []
+        def waiter():
+            got.append(result.get())
+        for i in xrange(3):
+            self.hub.schedule(greennet.greenlet(waiter))
+        self.hub.call_later(greennet.greenlet(result.set), 5, 'a value')
+        self.hub.run()
+        self.assertEqual(got, ['a value'] * 3)
+        self.assertEqual(self.hub.time(), 5)
+        self.assertRaises(RuntimeError, result.set, 'another value')
+    
+    def test_timeout(self):
+        result = AsyncResult()
+        self.assertRaises(greennet.Timeout, result.get, 1)
+        self.assertEqual(result._waits, [])
+        self.assertEqual(self.hub.timeouts, [])
+    
+    def test_spawn_exception(self):
+        def fail():
+            self.hub.sleep(1)
+            raise KeyError('a key')
+        result = spawn(fail)
+        self.assertRaises(KeyError, result.get)
+        self.assertFalse(result.successful())
+        self.assertTrue(isinstance(result.exception, KeyError))
+    
+    def test_cancel(self):
+        result = spawn(self.sleep, 10)
+        # A task that has not started is never run.
+        self.assertTrue(result.cancel())
+        self.assertRaises(greennet.Cancelled, result.get)
+        self.assertFalse(result.cancel())
+        cleaned_up = []
+        def task():
+            try:
+                self.hub.sleep(10)
+            finally:
+                cleaned_up.append(self.hub.time())
+        result = spawn(task)
+        self.hub.sleep(1)
+        self.assertTrue(result.cancel())
+        self.assertRaises(greennet.Cancelled, result.get)
+        self.assertEqual(cleaned_up, [1])
+        self.assertEqual(self.hub.timeouts, [])
+        self.assertFalse(AsyncResult().cancel())
+
+
+class TestWait(ResultTestCase):
+    def test_wait_any(self):
+        results = [spawn(self.sleep, n) for n in (3, 1, 2)]
+        winner = wait_any(results)
+        self.assertTrue(winner is results[1])
+        self.assertEqual(self.hub.time(), 1)
+        self.hub.run()
+        # The losers were cancelled.
+        self.assertEqual(self.hub.time(), 1)
+        for result in results[0], results[2]:
+            self.assertTrue(isinstance(result.exception, greennet.Cancelled))
+        self.assertTrue(wait_any(results) is results[0])
+    
+    def test_wait_any_no_cancel(self):
+        results = [spawn(self.sleep, n) for n in (3, 1, 2)]
+        self.assertTrue(wait_any(results, cancel=False) is results[1])
+        self.hub.run()
+        self.assertEqual([r.get() for r in results], [3, 1, 2])
+        self.assertRaises(ValueError, wait_any, [])
+    
+    def test_wait_any_timeout(self):
+        results = [spawn(self.sleep, n) for n in (3, 2)]
+        self.assertRaises(greennet.Timeout, wait_any, results, 1)
+        for result in results:
+            self.assertEqual(result._waits, [])
+        self.assertTrue(wait_any(results) is results[1])
+    
+    def test_wait_all(self):
+        results = [spawn(self.sleep, n) for n in xrange(10, 0, -1)]
+        wait_all(results)
+        self.assertEqual(self.hub.time(), 10)
+        self.assertEqual([r.get() for r in results], range(10, 0, -1))
+        wait_all(results)
+        self.assertRaises(greennet.Timeout, wait_all,
+                          [spawn(self.sleep, 5)], 1)
+    
+    def test_single_suspension(self):
+        results = [AsyncResult() for i in xrange(100)]
+        suspensions = []
+        class Hook(object):
+            def before_switch(self, task):
+                suspensions.append(task)
+            def after_switch(self, task):
+                pass
+        def setter():
+            for result in results:
+                result.set()
+        self.hub.schedule(greennet.greenlet(setter))
+        self.hub.switch_hooks.append(Hook())
+        wait_all(results)
+        # Switched into the setter, then back here: just once each.
+        self.assertEqual(len(suspensions), 2)
+    
+    def test_as_completed(self):
+        results = [spawn(self.sleep, n) for n in (3, 1, 2, 1)]
+        got = [(r.get(), self.hub.time()) for r in as_completed(results)]
+        self.assertEqual(got, [(1, 1), (1, 1), (2, 2), (3, 3)])
+        got = [r.get() for r in as_completed(results)]
+        self.assertEqual(got, [3, 1, 2, 1])
+    
+    def test_as_completed_timeout(self):
+        results = [spawn(self.sleep, n) for n in (3, 1, 2)]
+        got = []
+        try:
+            for result in as_completed(results, 2.5):
+                got.append(result.get())
+                self.hub.sleep(0.1)
+        except greennet.Timeout:
+            got.append(self.hub.time())
+        self.assertEqual(got, [1, 2, 2.5])
+        for result in results:
+            self.assertEqual(result._waits, [])
+    
+    def test_as_completed_break(self):
+        results = [spawn(self.sleep, n) for n in (3, 1, 2)]
+        for result in as_completed(results):
+            break
+        self.assertEqual(self.hub.time(), 1)
+        for result in results:
+            self.assertEqual(result._waits, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
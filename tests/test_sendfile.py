@@ -0,0 +1,109 @@
+import os
+import mmap
+import socket
+import tempfile
+import unittest
+
+import greennet
+
+
+CERTS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                     os.pardir, 'examples', 'certs')
+
+
+class TestSendfile(unittest.TestCase):
+    def setUp(self):
+        self.file = tempfile.TemporaryFile()
+        self.data = ''.join(map(chr, xrange(251))) * 12000
+        self.file.write(self.data)
+        self.file.flush()
+        self.s1, self.s2 = socket.socketpair()
+        self.native = greennet._sendfile
+    
+    def tearDown(self):
+        greennet._sendfile = self.native
+        self.file.close()
+        self.s1.close()
+        self.s2.close()
+    
+    def transfer(self, sock, reader_sock, offset=0, count=None):
+        received = []
+        def reader():
+            while True:
+                data = greennet.recv(reader_sock, 65536)
+                if not data:
+                    break
+                received.append(data)
+        greennet.schedule(greennet.greenlet(reader))
+        sent = greennet.sendfile(sock, self.file, offset, count)
+        sock.shutdown(socket.SHUT_WR)
+        greennet.run()
+        return sent, ''.join(received)
+    
+    def test_native(self):
+        if self.native is None:
+            return
+        sent, data = self.transfer(self.s1, self.s2)
+        self.assertEqual(sent, len(self.data))
+        self.assertEqual(data, self.data)
+    
+    def test_mmap(self):
+        greennet._sendfile = None
+        sent, data = self.transfer(self.s1, self.s2)
+        self.assertEqual(sent, len(self.data))
+        self.assertEqual(data, self.data)
+    
+    def test_mmap_unaligned_offset(self):
+        greennet._sendfile = None
+        offset = mmap.ALLOCATIONGRANULARITY + 123
+        sent, data = self.transfer(self.s1, self.s2, offset, 100000)
+        self.assertEqual(sent, 100000)
+        self.assertEqual(data, self.data[offset:offset + 100000])
+    
+    def test_short_file(self):
+        offset = len(self.data) - 10
+        sent, data = self.transfer(self.s1, self.s2, offset, 100)
+        self.assertEqual(sent, 10)
+        self.assertEqual(data, self.data[-10:])
+    
+    def test_no_wait(self):
+        # A transfer that fits in the socket buffer never waits.
+        waits = []
+        writeable = greennet.writeable
+        def counting_writeable(sock, timeout=None):
+            waits.append(sock)
+            return writeable(sock, timeout)
+        greennet.writeable = counting_writeable
+        try:
+            for native in (self.native, None):
+                greennet._sendfile = native
+                self.assertEqual(greennet.sendfile(self.s1, self.file, 0,
+                                                   1000), 1000)
+                self.assertEqual(self.s2.recv(1000), self.data[:1000])
+        finally:
+            greennet.writeable = writeable
+        self.assertEqual(waits, [])
+    
+    def test_past_end(self):
+        self.assertEqual(greennet.sendfile(self.s1, self.file,
+                                           len(self.data) + 1), 0)
+    
+    def test_ssl(self):
+        if greennet.ssl is None:
+            return
+        cert = {
+            'certfile': os.path.join(CERTS, 'server.pem'),
+            'keyfile': os.path.join(CERTS, 'server.key'),
+        }
+        server, client = greennet.ssl.peekablepair(cert, cert)
+        received = []
+        def reader():
+            while sum(len(data) for data in received) < len(self.data):
+                received.append(greennet.ssl.recv(client, 65536))
+        greennet.schedule(greennet.greenlet(reader))
+        sent = greennet.sendfile(server, self.file)
+        greennet.run()
+        self.assertEqual(sent, len(self.data))
+        self.assertEqual(''.join(received), self.data)
+        server.close()
+        client.close()
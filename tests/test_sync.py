@@ -0,0 +1,245 @@
+from __future__ import with_statement
+import unittest
+
+import greennet
+from greennet.sync import (Event, Lock, RLock, Semaphore, BoundedSemaphore,
+                           Condition)
+
+
+class SyncTestCase(unittest.TestCase):
+    def setUp(self):
+        self.hub = greennet.hub.VirtualClockHub()
+        self.old_hub = greennet.get_hub()
+        greennet.set_hub(self.hub)
+    
+    def tearDown(self):
+        greennet.set_hub(self.old_hub)
+    
+    def spawn(self, func, *args):
+        self.hub.schedule(greennet.greenlet(func), *args)
+
+
+class TestEvent(SyncTestCase):
+    def test_set_wakes_all(self):
+        event = Event()
+        woken = []
+        def waiter(i):
+            event.wait()
+            woken.append((i, self.hub.time()))
+        for i in xrange(5):
+            self.spawn(waiter, i)
+        self.hub.sleep(1)
+        self.assertEqual(woken, [])
+        event.set()
+        self.hub.run()
+        self.assertEqual(woken, [(i, 1) for i in xrange(5)])
+        # Once set, wait() returns immediately until cleared.
+        event.wait()
+        event.clear()
+        self.assertRaises(greennet.Timeout, event.wait, 1)
+    
+    def test_timeout(self):
+        event = Event()
+        results = []
+        def waiter(timeout):
+            try:
+                event.wait(timeout)
+            except greennet.Timeout:
+                results.append((timeout, 'timeout'))
+            else:
+                results.append((timeout, self.hub.time()))
+        self.spawn(waiter, 1)
+        self.spawn(waiter, 3)
+        self.hub.sleep(2)
+        event.set()
+        self.hub.run()
+        self.assertEqual(results, [(1, 'timeout'), (3, 2)])
+        self.assertEqual(self.hub.timeouts, [])
+    
+    def test_deadline(self):
+        event = Event()
+        self.assertRaises(greennet.Timeout, self._wait_deadline, event)
+        self.assertEqual(len(event._waiters), 0)
+    
+    def _wait_deadline(self, event):
+        with greennet.deadline(1):
+            event.wait()
+
+
+class TestLock(SyncTestCase):
+    def test_fifo_handoff(self):
+        lock = Lock()
+        order = []
+        def task(i):
+            with lock:
+                order.append(i)
+                self.hub.sleep(1)
+        lock.acquire()
+        for i in xrange(5):
+            self.spawn(task, i)
+        self.hub.switch()
+        # Releasing hands the lock straight to the first waiter, so a task
+        # arriving later cannot barge in ahead of the queue.
+        lock.release()
+        self.assertTrue(lock.locked())
+        self.assertFalse(lock.acquire(False))
+        self.hub.run()
+        self.assertEqual(order, range(5))
+        self.assertEqual(self.hub.time(), 5)
+        self.assertFalse(lock.locked())
+    
+    def test_timeout(self):
+        lock = Lock()
+        lock.acquire()
+        got = []
+        def task(timeout):
+            try:
+                lock.acquire(timeout=timeout)
+            except greennet.Timeout:
+                got.append((timeout, 'timeout'))
+            else:
+                got.append((timeout, self.hub.time()))
+                lock.release()
+        self.spawn(task, 1)
+        self.spawn(task, None)
+        self.hub.sleep(2)
+        lock.release()
+        self.hub.run()
+        # The waiter that timed out is skipped.
+        self.assertEqual(got, [(1, 'timeout'), (None, 2)])
+        self.assertFalse(lock.locked())
+        self.assertRaises(RuntimeError, lock.release)
+    
+    def test_many_timeouts(self):
+        lock = Lock()
+        lock.acquire()
+        def task():
+            try:
+                lock.acquire(timeout=1)
+            except greennet.Timeout:
+                pass
+        for i in xrange(100):
+            self.spawn(task)
+        self.hub.run()
+        # Timed-out waits are compacted away rather than kept forever.
+        self.assertEqual(len(lock._waiters), 0)
+        self.assertTrue(len(lock._waiters.waits) <= 17)
+        lock.release()
+        self.assertFalse(lock.locked())
+
+
+class TestRLock(SyncTestCase):
+    def test_reentrant(self):
+        lock = RLock()
+        got = []
+        def task():
+            with lock:
+                got.append(self.hub.time())
+        with lock:
+            with lock:
+                self.spawn(task)
+                self.hub.sleep(1)
+            self.hub.sleep(1)
+        self.hub.run()
+        self.assertEqual(got, [2])
+    
+    def test_owner(self):
+        lock = RLock()
+        lock.acquire()
+        errors = []
+        def task():
+            try:
+                lock.release()
+            except RuntimeError:
+                errors.append(True)
+            self.assertFalse(lock.acquire(False))
+        self.spawn(task)
+        self.hub.run()
+        self.assertEqual(errors, [True])
+
+
+class TestSemaphore(SyncTestCase):
+    def test_limit(self):
+        sem = Semaphore(2)
+        active = []
+        peak = []
+        def task():
+            with sem:
+                active.append(None)
+                peak.append(len(active))
+                self.hub.sleep(1)
+                active.pop()
+        for i in xrange(6):
+            self.spawn(task)
+        self.hub.run()
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(self.hub.time(), 3)
+        self.assertEqual(sem._value, 2)
+    
+    def test_bounded(self):
+        sem = BoundedSemaphore(2)
+        sem.acquire()
+        sem.release()
+        self.assertRaises(ValueError, sem.release)
+        self.assertRaises(ValueError, Semaphore, -1)
+
+
+class TestCondition(SyncTestCase):
+    def test_notify(self):
+        cond = Condition()
+        items = []
+        got = []
+        def consumer():
+            with cond:
+                got.append(cond.wait_for(lambda: items and items.pop(0)))
+        for i in xrange(3):
+            self.spawn(consumer)
+        self.hub.switch()
+        with cond:
+            items.extend([1, 2])
+            cond.notify(2)
+        self.hub.sleep(1)
+        self.assertEqual(got, [1, 2])
+        with cond:
+            items.append(3)
+            cond.notify_all()
+        self.hub.run()
+        self.assertEqual(got, [1, 2, 3])
+    
+    def test_timeout_reacquires(self):
+        cond = Condition(Lock())
+        def holder():
+            with cond:
+                self.hub.sleep(5)
+        cond.acquire()
+        self.spawn(holder)
+        self.assertRaises(greennet.Timeout, cond.wait, 1)
+        # The lock was only reacquired once holder released it.
+        self.assertEqual(self.hub.time(), 5)
+        self.assertTrue(cond.lock.locked())
+        cond.release()
+    
+    def test_deadline_reacquires(self):
+        cond = Condition()
+        def holder():
+            with cond:
+                self.hub.sleep(5)
+        def waiter():
+            with cond:
+                with greennet.deadline(1):
+                    self.assertRaises(greennet.Timeout, cond.wait)
+                self.assertTrue(cond.lock._is_owned())
+        self.spawn(waiter)
+        self.spawn(holder)
+        self.hub.run()
+        self.assertEqual(self.hub.time(), 5)
+        self.assertTrue(cond.acquire(False))
+    
+    def test_unowned(self):
+        cond = Condition()
+        self.assertRaises(RuntimeError, cond.wait)
+        self.assertRaises(RuntimeError, cond.notify)
+
+
+if __name__ == '__main__':
+    unittest.main()
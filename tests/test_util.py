@@ -0,0 +1,87 @@
+import random
+import socket
+import unittest
+
+import greennet
+from greennet.util import Matcher
+
+
+def first_end(data, terms):
+    ends = [data.find(t) + len(t) for t in terms if t in data]
+    return min(ends) if ends else -1
+
+
+class TestMatcher(unittest.TestCase):
+    def search_chunks(self, matcher, chunks):
+        offset = 0
+        state = 0
+        for chunk in chunks:
+            end, state = matcher.search(chunk, state)
+            if end > -1:
+                return offset + end
+            offset += len(chunk)
+        return -1
+    
+    def test_failure_links(self):
+        m = Matcher('aab')
+        self.assertEqual(m.search('aaab'), (4, 3))
+        self.assertEqual(m.search('abaab')[0], 5)
+    
+    def test_earliest_end(self):
+        m = Matcher(('abcd', 'bc'))
+        end, state = m.search('xabcd')
+        self.assertEqual(end, 4)
+        self.assertEqual(m.matched(state), 'bc')
+    
+    def test_split(self):
+        m = Matcher('\r\n--boundary')
+        data = 'x' * 50 + '\r\n--bound\r\n--boundary' + 'y' * 10
+        for size in (1, 2, 3, 7, 13):
+            chunks = [data[i:i + size] for i in xrange(0, len(data), size)]
+            self.assertEqual(self.search_chunks(m, chunks), 71)
+    
+    def test_random(self):
+        rand = random.Random(1)
+        for i in xrange(200):
+            terms = tuple(''.join(rand.choice('ab\n') for j in
+                                  xrange(rand.randint(1, 4)))
+                          for k in xrange(rand.randint(1, 3)))
+            data = ''.join(rand.choice('ab\nc') for j in xrange(40))
+            size = rand.randint(1, 8)
+            chunks = [data[i:i + size] for i in xrange(0, len(data), size)]
+            self.assertEqual(self.search_chunks(Matcher(terms), chunks),
+                             first_end(data, terms), (terms, data))
+    
+    def test_empty(self):
+        self.assertRaises(ValueError, Matcher, '')
+        self.assertRaises(ValueError, Matcher, ())
+        self.assertRaises(ValueError, Matcher, ('a', ''))
+
+
+class TestRecvUntil(unittest.TestCase):
+    def setUp(self):
+        self.s1, self.s2 = socket.socketpair()
+    
+    def tearDown(self):
+        self.s1.close()
+        self.s2.close()
+    
+    def test_split_terminator(self):
+        self.s2.sendall('header\r\n\r\nbody')
+        data = ''.join(greennet.recv_until(self.s1, '\r\n\r\n', 3))
+        self.assertEqual(data, 'header\r\n\r\n')
+        self.assertEqual(self.s1.recv(4), 'body')
+    
+    def test_alternatives(self):
+        self.s2.sendall('line\nnext\r\n')
+        matcher = Matcher(('\r\n', '\n'))
+        self.assertEqual(''.join(greennet.recv_until(self.s1, matcher)),
+                         'line\n')
+        self.assertEqual(''.join(greennet.recv_until(self.s1, matcher, 2)),
+                         'next\r\n')
+    
+    def test_maxlen(self):
+        self.s2.sendall('x' * 20 + '\r\n')
+        self.assertRaises(ValueError, list,
+                          greennet.recv_until_maxlen(self.s1, '\r\n', 10,
+                                                     ValueError, 4))
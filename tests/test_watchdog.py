@@ -0,0 +1,62 @@
+import time
+import unittest
+
+import greennet
+from greennet.watchdog import Watchdog
+
+
+class TestWatchdog(unittest.TestCase):
+    def setUp(self):
+        self.hub = greennet.hub.Hub()
+        self.reports = []
+        self.watchdog = Watchdog(self.hub, 0.05, self.report, 0.01)
+        self.watchdog.start()
+    
+    def tearDown(self):
+        if self.watchdog in self.hub.switch_hooks:
+            self.watchdog.stop()
+    
+    def report(self, task, elapsed, stack):
+        self.reports.append((task, elapsed, stack))
+    
+    def test_blocking_task(self):
+        def blocking_task():
+            time.sleep(0.2)
+        task = greennet.greenlet(blocking_task)
+        self.hub.schedule(task)
+        self.hub.run()
+        self.assertEqual(len(self.reports), 1)
+        reported, elapsed, stack = self.reports[0]
+        self.assert_(reported is task)
+        self.assert_(elapsed >= 0.05)
+        self.assert_('blocking_task' in stack)
+    
+    def test_blocking_timeout(self):
+        def blocking_task():
+            self.hub.sleep(0)
+            time.sleep(0.2)
+        task = greennet.greenlet(blocking_task)
+        self.hub.schedule(task)
+        self.hub.run()
+        self.assertEqual(len(self.reports), 1)
+        self.assert_(self.reports[0][0] is task)
+    
+    def test_fast_tasks(self):
+        def task():
+            for i in xrange(10):
+                self.hub.switch()
+        for i in xrange(10):
+            self.hub.schedule(greennet.greenlet(task))
+        self.hub.run()
+        self.assertEqual(self.reports, [])
+    
+    def test_stop(self):
+        self.watchdog.stop()
+        self.assertEqual(self.hub.switch_hooks, [])
+        self.hub.schedule(greennet.greenlet(time.sleep), 0.2)
+        self.hub.run()
+        self.assertEqual(self.reports, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+import socket
+import unittest
+
+import greennet
+from greennet.writer import WriteBuffer
+
+
+class CountingSocket(object):
+    
+    """Socket wrapper counting calls to send."""
+    
+    def __init__(self, sock):
+        self.sock = sock
+        self.sends = []
+    
+    def send(self, data):
+        self.sends.append(str(data))
+        return self.sock.send(data)
+    
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+class TestSendallMany(unittest.TestCase):
+    def setUp(self):
+        self.s1, self.s2 = socket.socketpair()
+        self.s1.setblocking(False)
+    
+    def tearDown(self):
+        self.s1.close()
+        self.s2.close()
+    
+    def test_coalesce_small(self):
+        sock = CountingSocket(self.s1)
+        greennet.sendall_many(sock, ['header\r\n', 'body', '\r\n'])
+        self.assertEqual(sock.sends, ['header\r\nbody\r\n'])
+        self.assertEqual(self.s2.recv(100), 'header\r\nbody\r\n')
+    
+    def test_partial_writes(self):
+        sndbuf = self.s1.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+        bufs = ['head', 'x' * (sndbuf * 4), 'tail']
+        total = sum(len(buf) for buf in bufs)
+        received = []
+        def reader():
+            size = 0
+            while size < total:
+                data = greennet.recv(self.s2, 65536)
+                received.append(data)
+                size += len(data)
+        greennet.schedule(greennet.greenlet(reader))
+        greennet.sendall_many(self.s1, bufs)
+        greennet.run()
+        self.assertEqual(''.join(received), ''.join(bufs))
+
+
+class TestWriteBuffer(unittest.TestCase):
+    def setUp(self):
+        self.hub = greennet.hub.VirtualClockHub()
+        self.old_hub = greennet.get_hub()
+        greennet.set_hub(self.hub)
+        self.s1, self.s2 = socket.socketpair()
+        self.s1.setblocking(False)
+        self.sock = CountingSocket(self.s1)
+    
+    def tearDown(self):
+        greennet.set_hub(self.old_hub)
+        self.s1.close()
+        self.s2.close()
+    
+    def test_coalesce_tick(self):
+        writer = WriteBuffer(self.sock, self.hub)
+        def task(data):
+            writer.write(data)
+        for data in ('one ', 'two ', 'three'):
+            self.hub.schedule(greennet.greenlet(task), data)
+        self.hub.switch()
+        self.assertEqual(len(writer), 13)
+        writer.flush()
+        self.assertEqual(len(writer), 0)
+        self.assertEqual(self.sock.sends, ['one two three'])
+        self.assertEqual(self.s2.recv(100), 'one two three')
+    
+    def test_flush_empty(self):
+        writer = WriteBuffer(self.sock, self.hub)
+        writer.flush()
+        writer.write('')
+        writer.flush()
+        self.assertEqual(self.sock.sends, [])
+    
+    def test_separate_ticks(self):
+        writer = WriteBuffer(self.sock, self.hub)
+        writer.write('one')
+        writer.flush()
+        writer.write('two')
+        writer.flush()
+        self.assertEqual(self.sock.sends, ['one', 'two'])
+    
+    def test_error(self):
+        writer = WriteBuffer(self.sock, self.hub)
+        self.s2.close()
+        writer.write('data')
+        self.assertRaises(socket.error, writer.flush)
+        self.assertEqual(len(writer), 0)
+        self.assertRaises(socket.error, writer.write, 'more')
+    
+    def fill_socket(self):
+        try:
+            while True:
+                self.s1.send('x' * 65536)
+        except socket.error:
+            pass
+    
+    def test_watermarks(self):
+        writer = WriteBuffer(self.sock, self.hub, high=16384, low=4096)
+        total = 1 << 20
+        sizes = []
+        def producer():
+            for i in xrange(total / 1024):
+                writer.write('x' * 1024)
+                sizes.append(len(writer))
+            writer.flush()
+        received = []
+        def consumer():
+            size = 0
+            while size < total:
+                data = greennet.recv(self.s2, 1000)
+                received.append(data)
+                size += len(data)
+        self.hub.schedule(greennet.greenlet(producer))
+        self.hub.schedule(greennet.greenlet(consumer))
+        self.hub.run()
+        self.assertEqual(sum(len(data) for data in received), total)
+        self.assertTrue(max(sizes) <= 16384)
+        self.assertEqual(len(writer), 0)
+    
+    def test_write_suspends(self):
+        self.fill_socket()
+        writer = WriteBuffer(self.sock, self.hub, high=100)
+        writer.write('x' * 100)
+        self.assertRaises(greennet.Timeout, writer.write, 'x', 5)
+        self.assertEqual(self.hub.time(), 5)
+        self.assertEqual(len(writer), 101)
+        self.assertRaises(greennet.Timeout, writer.drain, 1)
+        self.assertRaises(greennet.Timeout, writer.flush, 1)
+    
+    def test_drain_low(self):
+        writer = WriteBuffer(self.sock, self.hub, high=100, low=50)
+        self.assertEqual(writer.low, 50)
+        writer.drain(0)
+        self.fill_socket()
+        writer.write('x' * 40)
+        writer.drain(0)
+        self.assertRaises(ValueError, WriteBuffer, self.sock, high=10, low=20)
+        self.assertEqual(WriteBuffer(self.sock, high=100).low, 25)
+    
+    def test_send_timeout(self):
+        self.fill_socket()
+        writer = WriteBuffer(self.sock, self.hub, high=100, timeout=5)
+        writer.write('x' * 50)
+        self.assertRaises(greennet.Timeout, writer.write, 'x' * 100)
+        self.assertEqual(self.hub.time(), 5)
+        # The flush task timed out as well, and gave up.
+        self.hub.switch()
+        self.assertRaises(greennet.Timeout, writer.flush)
+        self.assertEqual(len(writer), 0)
+        self.assertEqual(self.hub.fdwaits, {})
+    
+    def test_close(self):
+        self.fill_socket()
+        writer = WriteBuffer(self.sock, self.hub)
+        writer.write('x' * 50)
+        self.hub.switch()
+        self.assertEqual(len(self.hub.fdwaits), 1)
+        writer.close()
+        self.assertEqual(self.hub.fdwaits, {})
+        self.hub.run()
+        self.assertRaises(greennet.Cancelled, writer.flush)
+        self.assertEqual(len(writer), 0)
+    
+    def test_drain_error(self):
+        writer = WriteBuffer(self.sock, self.hub, high=100)
+        self.fill_socket()
+        writer.write('x' * 50)
+        def close():
+            self.s2.close()
+        self.hub.call_later(greennet.greenlet(close), 1)
+        self.assertRaises(socket.error, writer.write, 'x' * 100)
+        self.assertEqual(len(writer), 0)
@@ -12,15 +12,35 @@ def mod_import(name):
 
 modules = (
     'greennet',
+    'greennet.broadcast',
+    'greennet.dns',
+    'greennet.framing',
     'greennet.hub',
+    'greennet.profiler',
     'greennet.queue',
+    'greennet.result',
     'greennet.ssl',
+    'greennet.sync',
     'greennet.util',
 )
 
 test_modules = (
+    'test_broadcast',
+    'test_dns',
+    'test_framing',
     'test_hub',
+    'test_http',
+    'test_pool',
+    'test_profiler',
+    'test_proxy',
     'test_queue',
+    'test_ratelimit',
+    'test_result',
+    'test_sendfile',
+    'test_sync',
+    'test_util',
+    'test_watchdog',
+    'test_writer',
 )
 
 